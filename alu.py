@@ -0,0 +1,32 @@
+WORD_MASK = 0xFFFFFFFF
+SIGN_BIT = 0x80000000
+
+
+def to_signed(value):
+    # Two's-complement signed view of the low 32 bits; registers always hold this form.
+    return ((value + SIGN_BIT) & WORD_MASK) - SIGN_BIT
+
+
+def to_unsigned(value):
+    return value & WORD_MASK
+
+
+def sign_extend16(value):
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def sign_extend8(value):
+    return ((value + 0x80) & 0xFF) - 0x80
+
+
+def split_product(product):
+    # (HI, LO) of a 64-bit product, both as signed 32-bit words.
+    return to_signed(product >> 32), to_signed(product)
+
+
+def divide(dividend, divisor):
+    # (quotient, remainder) truncated toward zero, as the MIPS div instruction computes them.
+    quotient = abs(dividend) // abs(divisor)
+    if (dividend < 0) != (divisor < 0):
+        quotient = -quotient
+    return to_signed(quotient), to_signed(dividend - quotient * divisor)
@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from struct import Struct
+
+from decode_cache import DecodeCache
+from main import MIPS
+from syscalls import HostIO
+from tracing import TRACE_MODES
+
+register_file = Struct(">34i")
+# Trace file name by mode; the text modes write output.txt.
+trace_files = {"binary": "output.bin", "digest": "output.dig"}
+
+
+def register_digest(mips):
+    # SHA-256 of the 34 register slots ($0-$31, HI, LO) as big-endian signed words.
+    return hashlib.sha256(register_file.pack(*mips.regs)).hexdigest()
+
+
+def find_programs(source):
+    # A directory contributes every *.txt file in it; any other file is a manifest with one hex input
+    # path per line, relative to the manifest. Blank lines and lines starting with # are ignored.
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.endswith(".txt")]
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as file:
+        lines = [line.strip() for line in file]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+
+def run_program(job):
+    index, input_path, output_dir, options = job
+    name = f"{index:05d}_{os.path.splitext(os.path.basename(input_path))[0]}"
+    directory = os.path.join(output_dir, name)
+    os.makedirs(directory, exist_ok=True)
+
+    mips = MIPS()
+    decode_cache = DecodeCache(options["cache_dir"]) if options["cache_dir"] is not None else None
+    result = {"program": input_path, "output_dir": directory}
+    # Guest console: syscall output goes to console.txt, input comes from <program>.in if there is one.
+    console_path = os.path.splitext(input_path)[0] + ".in"
+    console_input = ""
+    if os.path.exists(console_path):
+        with open(console_path, "r") as file:
+            console_input = file.read()
+    start = time.perf_counter()
+    try:
+        with open(os.path.join(directory, "console.txt"), "w") as console:
+            host = HostIO(console, console_input)
+            mips.simulate(
+                input_path,
+                os.path.join(directory, trace_files.get(options["trace"], "output.txt")),
+                dispatch=options["dispatch"],
+                trace=options["trace"],
+                trace_every=options["trace_every"],
+                max_steps=options["max_steps"],
+                assembly_path=os.path.join(directory, "assembly_code.txt"),
+                loader=options["loader"],
+                decode_cache=decode_cache,
+                host=host,
+            )
+        result["status"] = "halted" if mips.halted else "budget_exceeded"
+        result["exit_code"] = host.exit_code
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = f"{type(error).__name__}: {error}"
+
+    result["wall_time"] = time.perf_counter() - start
+    result["instructions"] = mips.instruction_count
+    result["register_digest"] = register_digest(mips)
+    return result
+
+
+def run_batch(programs, output_dir, workers=None, max_steps=None, trace="off", dispatch="table", loader="eager",
+              cache_dir=None, trace_every=1):
+    options = {"max_steps": max_steps, "trace": trace, "dispatch": dispatch, "loader": loader, "cache_dir": cache_dir,
+               "trace_every": trace_every}
+    jobs = [(index, path, output_dir, options) for index, path in enumerate(programs)]
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    if workers == 1:
+        results = [run_program(job) for job in jobs]
+    else:
+        # Programs are small and numerous, so jobs are handed out in chunks to keep the pool busy.
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_program, jobs, chunksize=chunksize))
+    wall_time = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    instructions = sum(result["instructions"] for result in results)
+
+    return {
+        "workers": workers,
+        "programs": len(results),
+        "statuses": statuses,
+        "instructions": instructions,
+        "wall_time": wall_time,
+        "instructions_per_second": instructions / wall_time if wall_time else None,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many hex programs in parallel.")
+    parser.add_argument("source", help="directory of *.txt hex programs or a manifest file listing them")
+    parser.add_argument("--output-dir", default="output/batch")
+    parser.add_argument("--summary", default=None, help="JSON summary path (default: <output-dir>/summary.json)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-steps", type=int, default=None, help="instruction budget per program")
+    parser.add_argument("--trace", choices=TRACE_MODES, default="off")
+    parser.add_argument("--trace-every", type=int, default=1, help="record every N-th instruction (digest checkpoints)")
+    parser.add_argument("--dispatch", choices=["table", "jit"], default="table")
+    parser.add_argument("--loader", choices=["eager", "lazy"], default="eager")
+    parser.add_argument("--cache-dir", default=None, help="decode cache directory for the eager loader")
+    args = parser.parse_args()
+
+    summary = run_batch(find_programs(args.source), args.output_dir, args.workers, args.max_steps, args.trace,
+                        args.dispatch, args.loader, args.cache_dir, args.trace_every)
+
+    summary_path = args.summary or os.path.join(args.output_dir, "summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=2)
+
+    print(f"{summary['programs']} programs, {summary['instructions']} instructions in {summary['wall_time']:.2f}s "
+          f"with {summary['workers']} workers: {summary['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
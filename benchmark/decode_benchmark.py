@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+
+from main import MIPS
+
+
+def write_program(path, count, source="input/input.txt"):
+    # Repete as instruções do programa de exemplo até atingir a quantidade pedida.
+    with open(source, "r") as file:
+        lines = file.read().splitlines()
+
+    with open(path, "w") as file:
+        for i in range(count):
+            file.write(lines[i % len(lines)] + "\n")
+
+
+def string_decode(path):
+    mips = MIPS()
+    instructions = []
+    for bin in mips.hex_to_binary_instructions(path):
+        if bin[:6] == "000000":
+            instructions.append(mips.translate_R_instruction(bin))
+        elif bin[:6] == "000010" or bin[:6] == "000011":
+            instructions.append(mips.translate_J_instruction(bin))
+        else:
+            instructions.append(mips.translate_I_instruction(bin))
+    return instructions
+
+
+def integer_decode(path):
+    mips = MIPS()
+    return mips.decode_words(mips.hex_to_words(path))
+
+
+def timed(function, path):
+    start = time.perf_counter()
+    result = function(path)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare string-slicing and bit-field decoding.")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        write_program(path, args.count)
+        reference, string_time = timed(string_decode, path)
+        decoded, integer_time = timed(integer_decode, path)
+    finally:
+        os.remove(path)
+
+    assert [str(i) for i in reference] == [str(i) for i in decoded]
+
+    print(f"instructions:    {args.count}")
+    print(f"string decode:   {string_time:.3f}s ({args.count / string_time:,.0f} instr/s)")
+    print(f"bit-field decode: {integer_time:.3f}s ({args.count / integer_time:,.0f} instr/s)")
+    print(f"speedup:         {string_time / integer_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.trace_benchmark import loop_program
+from lockstep import LockstepEngine
+from main import MIPS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lockstep engine with one simulate() per state.")
+    parser.add_argument("--lanes", type=int, default=4096)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--serial", type=int, default=20, help="states run with simulate() for the comparison")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "loop.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(f"0x{word:08x}" for word in loop_program(args.iterations)))
+
+        # Lanes differ in the initial $5, so they share the control flow but not the results.
+        registers = np.zeros((args.lanes, 34), dtype=np.int64)
+        registers[:, 5] = np.arange(args.lanes)
+
+        mips = MIPS()
+        mips.words_to_assembly(mips.hex_to_words(path), None)
+        engine = LockstepEngine(mips.assembly_instructions, registers, memory_words=128)
+        start = time.perf_counter()
+        engine.run()
+        lockstep_time = time.perf_counter() - start
+        lockstep_rate = engine.instruction_count.sum() / lockstep_time
+
+        start = time.perf_counter()
+        executed = 0
+        for lane in range(args.serial):
+            mips = MIPS()
+            mips.regs[5] = lane
+            mips.simulate(path, os.path.join(directory, "output.txt"), trace="off", assembly_path=None)
+            executed += mips.instruction_count
+            assert engine.render(lane).split("\n") == open(os.path.join(directory, "output.txt")).read().split("\n")[-3:-1]
+        serial_rate = executed / (time.perf_counter() - start)
+
+    print(f"lockstep: {args.lanes} lanes in {lockstep_time:.2f}s, {lockstep_rate:,.0f} instr/s")
+    print(f"simulate: {serial_rate:,.0f} instr/s ({lockstep_rate / serial_rate:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark.decode_benchmark import write_program
+from main import MIPS
+from parallel_decode import decode_parallel
+
+# Register and immediate fields by opcode group; the opcode and funct are kept.
+R_FIELDS = 0x03FFF800
+J_FIELDS = 0x01FFFFFF
+I_FIELDS = 0x03FFFFFF
+
+
+def write_varied_program(path, count, source="input/input.txt"):
+    # Like write_program, with the register and immediate fields scrambled per line, so almost every
+    # word is distinct (the decoders decode each distinct word once).
+    with open(source, "r") as file:
+        words = [int(line, 16) for line in file.read().splitlines()]
+
+    with open(path, "w") as file:
+        for i in range(count):
+            word = words[i % len(words)]
+            opcode = word >> 26
+            fields = R_FIELDS if opcode == 0 else J_FIELDS if opcode in (2, 3) else I_FIELDS
+            file.write(f"0x{word ^ (i * 2654435761 & fields):08x}\n")
+
+
+def serial_load(path, listing):
+    # The eager loader: every word parsed, decoded and listed in this process.
+    mips = MIPS()
+    start = time.perf_counter()
+    words = mips.hex_to_words(path)
+    mips.words_to_assembly(words, listing)
+    return words, time.perf_counter() - start
+
+
+def parallel_load(path, listing, workers):
+    mips = MIPS()
+    start = time.perf_counter()
+    words = decode_parallel(mips, path, listing, workers)
+    return words, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the serial and the parallel chunked decoder.")
+    parser.add_argument("--count", type=int, default=2_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeated", action="store_true",
+                        help="repeat the sample program verbatim (few distinct words) instead of varying its fields")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.txt")
+        (write_program if args.repeated else write_varied_program)(path, args.count)
+        serial_listing = os.path.join(directory, "serial.txt")
+        reference, serial_time = serial_load(path, serial_listing)
+        with open(serial_listing, "rb") as file:
+            expected = file.read()
+
+        print(f"instructions: {args.count:,} ({os.cpu_count()} CPUs)")
+        print(f"{'decoder':<14}{'seconds':>10}{'instr/s':>14}{'speedup':>10}")
+        print(f"{'serial':<14}{serial_time:>10.3f}{args.count / serial_time:>14,.0f}{1:>9.2f}x")
+        for workers in args.workers:
+            listing = os.path.join(directory, f"parallel_{workers}.txt")
+            words, seconds = parallel_load(path, listing, workers)
+            with open(listing, "rb") as file:
+                if file.read() != expected:
+                    raise RuntimeError(f"listing differs with {workers} workers")
+            if words.tolist() != reference:
+                raise RuntimeError(f"program differs with {workers} workers")
+            name = f"{workers} worker" + ("s" if workers > 1 else "")
+            print(f"{name:<14}{seconds:>10.3f}{args.count / seconds:>14,.0f}{serial_time / seconds:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
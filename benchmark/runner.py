@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from benchmark.workloads import WORKLOADS, generate, write_hex
+from main import MIPS
+from tracing import open_trace
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Phases reported per workload. parse, decode and listing are rated in program words per second,
+# execute, trace and simulate in executed instructions per second.
+PHASES = ("parse", "decode", "listing", "execute", "trace", "simulate")
+
+
+def measure(path, directory, static_words=20000, min_execute=0.5):
+    # Runs the steps of simulate() one at a time with the trace off, then simulate() itself with the
+    # full trace; the trace phase is the part of simulate() the separate steps do not account for.
+    # The workloads are short loops, so parse, decode and listing run on an image of the program
+    # repeated to at least static_words words, and their times are scaled back to one copy.
+    words = MIPS().hex_to_words(path)
+    rounds = max(1, static_words // len(words))
+    image_path = os.path.join(directory, "image.txt")
+    write_hex(image_path, words * rounds)
+
+    mips = MIPS()
+    start = time.perf_counter()
+    image = mips.hex_to_words(image_path)
+    parse_time = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    mips.words_to_assembly(image, None)
+    decode_time = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    mips.write_assembly_code(os.path.join(directory, "assembly_code.txt"))
+    listing_time = (time.perf_counter() - start) / rounds
+
+    # A run is short, so it is repeated for at least min_execute seconds and the fastest one is kept.
+    execute_time = None
+    spent = 0
+    while spent < min_execute:
+        mips = MIPS()
+        mips.words_to_assembly(words, None)
+        for instruction in mips.assembly_instructions:
+            mips.write_in_memory(instruction)
+        with open(os.path.join(directory, "output_off.txt"), "w") as file:
+            start = time.perf_counter()
+            tracer = open_trace("off", file, mips)
+            mips.run_table(tracer)
+            tracer.finish()
+            elapsed = time.perf_counter() - start
+        execute_time = elapsed if execute_time is None else min(execute_time, elapsed)
+        spent += elapsed
+
+    reference = MIPS()
+    start = time.perf_counter()
+    reference.simulate(path, os.path.join(directory, "output.txt"),
+                       assembly_path=os.path.join(directory, "assembly_code.txt"))
+    simulate_time = time.perf_counter() - start
+
+    if reference.regs != mips.regs:
+        raise RuntimeError(f"{path}: simulate() and the phase-by-phase run disagree")
+
+    seconds = {
+        "parse": parse_time,
+        "decode": decode_time,
+        "listing": listing_time,
+        "execute": execute_time,
+        "simulate": simulate_time,
+    }
+    # Clamped, as timer noise can exceed the trace cost of very short runs.
+    seconds["trace"] = max(simulate_time - parse_time - decode_time - listing_time - execute_time, 1e-9)
+    return len(words), mips.instruction_count, seconds
+
+
+def run_workload(name, scale, repeat):
+    # Best of repeat runs for every phase.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"{name}.txt")
+        write_hex(path, generate(name, scale))
+        best = None
+        for _ in range(repeat):
+            words, instructions, seconds = measure(path, directory)
+            best = seconds if best is None else {phase: min(best[phase], seconds[phase]) for phase in PHASES}
+
+    rates = {}
+    for phase in PHASES:
+        amount = words if phase in ("parse", "decode", "listing") else instructions
+        rates[phase] = amount / best[phase]
+    return {"words": words, "instructions": instructions, "seconds": best, "rates": rates}
+
+
+def compare(results, baseline, tolerance):
+    # Phases whose rate fell below (1 - tolerance) times the baseline's.
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get("workloads", {}).get(name, {}).get("rates", {})
+        for phase in PHASES:
+            if phase in expected:
+                ratio = result["rates"][phase] / expected[phase]
+                if ratio < 1 - tolerance:
+                    regressions.append((name, phase, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the phases of MIPS.simulate on the synthetic workloads.")
+    parser.add_argument("workloads", nargs="*", help=f"any of {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every workload's default size")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per workload; the best time of each phase is kept")
+    parser.add_argument("--baseline", default=BASELINE)
+    # Timings on shared machines easily swing by a third between runs, so only large drops fail by default.
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="fraction of its baseline rate a phase may lose before it counts as a regression")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload: {name}")
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        if baseline.get("scale") != args.scale:
+            print(f"note: baseline was recorded at scale {baseline.get('scale')}, this run uses {args.scale}")
+
+    results = {}
+    print(f"{'workload':<10}{'instr':>9}" + "".join(f"{phase:>12}" for phase in PHASES))
+    for name in args.workloads or WORKLOADS:
+        results[name] = result = run_workload(name, args.scale, args.repeat)
+        print(f"{name:<10}{result['instructions']:>9}" + "".join(f"{result['rates'][phase]:>12,.0f}" for phase in PHASES))
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "scale": args.scale,
+                "workloads": results,
+            }, file, indent=2)
+            file.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, phase, ratio in regressions:
+        print(f"regression: {name} {phase} at {ratio:.0%} of baseline")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def client(socket, jobs, request, latencies, statuses):
+    # One connection sending jobs one after another; latency runs from sending a job to its result.
+    reader, writer = await asyncio.open_unix_connection(socket, limit=1 << 26)
+    for number in jobs:
+        start = time.perf_counter()
+        writer.write(json.dumps(dict(request, id=number)).encode() + b"\n")
+        await writer.drain()
+        while True:
+            message = json.loads(await reader.readline())
+            if message["type"] == "result":
+                break
+            if message["type"] == "error":
+                raise RuntimeError(message["error"])
+        latencies.append(time.perf_counter() - start)
+        statuses[message["status"]] = statuses.get(message["status"], 0) + 1
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load(socket, count, concurrency, request):
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[client(socket, range(index, count, concurrency), request, latencies, statuses)
+                           for index in range(concurrency)])
+    return latencies, statuses, time.perf_counter() - start
+
+
+def fresh_process(program, directory, runs):
+    # What the server saves: a new interpreter importing the simulator for every program.
+    command = [sys.executable, "-c", "import sys; from main import MIPS; "
+               "MIPS().simulate(sys.argv[1], sys.argv[2], trace='off', assembly_path=None)",
+               program, os.path.join(directory, "output.txt")]
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, cwd=os.path.dirname(SERVER))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def wait_for_socket(path, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if server.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("server did not start")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the simulation server.")
+    parser.add_argument("--socket", default=None, help="server to test (default: start one with --workers)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--program", default="input/input.txt")
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8, help="connections sending jobs at once")
+    parser.add_argument("--trace", choices=["full", "delta", "off"], default="off")
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--fresh-runs", type=int, default=5, help="one-process-per-program runs to compare with")
+    args = parser.parse_args()
+
+    with open(args.program, "r") as file:
+        request = {"type": "run", "program": file.read(), "trace": args.trace, "max_steps": args.max_steps}
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        socket = args.socket
+        if socket is None:
+            socket = os.path.join(directory, "mips.sock")
+            server = subprocess.Popen([sys.executable, SERVER, "--socket", socket, "--workers", str(args.workers)],
+                                      stderr=subprocess.DEVNULL)
+        try:
+            if server is not None:
+                wait_for_socket(socket, server)
+            latencies, statuses, elapsed = asyncio.run(load(socket, args.jobs, args.concurrency, request))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        fresh = fresh_process(os.path.abspath(args.program), directory, args.fresh_runs) if args.fresh_runs else []
+
+    print(f"jobs:          {len(latencies)} ({', '.join(f'{status} {n}' for status, n in sorted(statuses.items()))})")
+    print(f"concurrency:   {args.concurrency}")
+    print(f"throughput:    {len(latencies) / elapsed:,.1f} jobs/s")
+    print(f"latency p50:   {percentile(latencies, 0.5) * 1e3:.2f} ms")
+    print(f"latency p99:   {percentile(latencies, 0.99) * 1e3:.2f} ms")
+    if fresh:
+        print(f"fresh process: {percentile(fresh, 0.5) * 1e3:.2f} ms per program (median of {len(fresh)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark.decode_benchmark import write_program
+from benchmark.parallel_decode_benchmark import write_varied_program
+from decode_cache import DecodeCache
+from main import MIPS
+
+
+def startup(path, directory, decode_cache):
+    # Load plus a one-instruction run, so the time is almost all parsing, decoding and the listing.
+    mips = MIPS()
+    start = time.perf_counter()
+    mips.simulate(path, os.path.join(directory, "output.txt"), trace="off", max_steps=1,
+                  assembly_path=os.path.join(directory, "assembly_code.txt"), decode_cache=decode_cache)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(directory, "assembly_code.txt"), "r") as file:
+        return elapsed, file.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare startup without the decode cache, cold and warm.")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs; the fastest is kept")
+    parser.add_argument("--repeated", action="store_true",
+                        help="repeat the sample program verbatim (few distinct words, so a warm load decodes "
+                             "almost nothing) instead of varying its fields")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.txt")
+        (write_program if args.repeated else write_varied_program)(path, args.count)
+        cache = DecodeCache(os.path.join(directory, "cache"))
+
+        plain_time, reference = startup(path, directory, None)
+        cold_time, cold_listing = startup(path, directory, cache)
+        warm_time = None
+        for _ in range(args.repeat):
+            elapsed, warm_listing = startup(path, directory, cache)
+            warm_time = elapsed if warm_time is None else min(warm_time, elapsed)
+            assert warm_listing == reference
+        assert cold_listing == reference
+        assert cache.misses == 1 and cache.hits == args.repeat
+        entry_size = sum(os.path.getsize(os.path.join(cache.directory, name)) for name in os.listdir(cache.directory))
+
+    print(f"instructions:  {args.count}")
+    print(f"cache entry:   {entry_size / 1e6:.1f} MB")
+    print(f"no cache:      {plain_time:.3f}s")
+    print(f"cold cache:    {cold_time:.3f}s")
+    print(f"warm cache:    {warm_time:.3f}s")
+    print(f"warm speedup:  {plain_time / warm_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
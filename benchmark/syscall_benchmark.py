@@ -0,0 +1,59 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark.workloads import i_type, load_immediate, r_type, write_hex
+from main import MIPS
+from syscalls import EXIT, PRINT_CHAR, PRINT_INT, HostIO
+
+
+def print_program(count):
+    # Prints count, count - 1, ..., 1, one number per line, then exits.
+    def service(code):
+        return [i_type("addi", 2, 0, code), r_type("syscall")]
+
+    words = load_immediate(8, count)
+    loop = len(words)
+    words += [r_type("add", 4, 8, 0)] + service(PRINT_INT)
+    words += [i_type("addi", 4, 0, ord("\n"))] + service(PRINT_CHAR)
+    words.append(i_type("addi", 8, 8, -1))
+    words.append(i_type("bne", 0, 8, loop - len(words)))
+    return words + service(EXIT)
+
+
+def run(path, directory, batch):
+    console = os.path.join(directory, f"console_{batch}.txt")
+    mips = MIPS()
+    start = time.perf_counter()
+    with open(console, "w") as file:
+        mips.simulate(path, os.path.join(directory, "output.txt"), trace="off", assembly_path=None,
+                      host=HostIO(file, batch=batch))
+    seconds = time.perf_counter() - start
+    with open(console, "r") as file:
+        return seconds, mips.instruction_count, file.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare buffered and unbuffered syscall output.")
+    parser.add_argument("--count", type=int, default=50000, help="numbers the program prints")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "print.txt")
+        write_hex(path, print_program(args.count))
+
+        results = [(name, batch, run(path, directory, batch)) for name, batch in
+                   [("unbuffered", 1), ("batch 4KiB", 1 << 12), ("batch 64KiB", 1 << 16)]]
+        consoles = {console for _, _, (_, _, console) in results}
+        if len(consoles) != 1:
+            raise RuntimeError("console output differs between batch sizes")
+
+        base = results[0][2][0]
+        print(f"{'mode':<14}{'seconds':>10}{'instr/s':>14}{'speedup':>10}")
+        for name, _, (seconds, instructions, _) in results:
+            print(f"{name:<14}{seconds:>10.3f}{instructions / seconds:>14,.0f}{base / seconds:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import tempfile
+import time
+
+from main import MIPS
+
+
+def loop_program(iterations):
+    # $3 = iterations; loop: $1 += 1; MEM[100] = $1; $5 += $1; until $1 == $3.
+    return [
+        0x20030000 | iterations,  # addi $3, $0, iterations
+        0x20210001,               # addi $1, $1, 1
+        0xac810064,               # sw $1, 100($4)
+        0x10230004,               # beq $1, $3, 4
+        0x00a12820,               # add $5, $5, $1
+        0x00a10018,               # mult $5, $1
+        0x08000001,               # j 1
+        0x8c860064,               # lw $6, 100($4)
+    ]
+
+
+def run(path, directory, mode, every=1):
+    output = os.path.join(directory, f"trace_{mode}_{every}")
+    mips = MIPS()
+    start = time.perf_counter()
+    mips.simulate(path, output, trace=mode, trace_every=every)
+    return time.perf_counter() - start, os.path.getsize(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare trace modes on a loop-heavy program.")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "loop.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(f"0x{word:08x}" for word in loop_program(args.iterations)))
+
+        instructions = 5 * args.iterations + 2
+        full_time, full_size = run(path, directory, "full")
+        print(f"{'mode':<12}{'seconds':>10}{'instr/s':>14}{'bytes':>14}{'size':>8}")
+        for mode, every in [("full", 1), ("delta", 1), ("binary", 1), ("full", 100), ("delta", 100),
+                            ("digest", 1000), ("off", 1)]:
+            seconds, size = (full_time, full_size) if (mode, every) == ("full", 1) else run(path, directory, mode, every)
+            name = mode if every == 1 else f"{mode}/{every}"
+            print(f"{name:<12}{seconds:>10.3f}{instructions / seconds:>14,.0f}{size:>14,}{size / full_size:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import os
+
+from main import MIPS
+
+# Field values by operation name, from the decoder's own tables.
+R_FUNCT = {name: int(bits, 2) for bits, name in MIPS.R_fcode_dict.items()}
+I_OPCODE = {name: int(bits, 2) for bits, name in MIPS.I_opcode_dict.items()}
+J_OPCODE = {name: int(bits, 2) for bits, name in MIPS.J_opcode_dict.items()}
+
+# Word addresses of the data used by the memory and call workloads, far above the code.
+SOURCE = 1 << 20
+DESTINATION = 1 << 21
+STACK = 1 << 22
+
+
+def r_type(operation, rd=0, rs=0, rt=0, shamt=0):
+    return (rs << 21) | (rt << 16) | (rd << 11) | (shamt << 6) | R_FUNCT[operation]
+
+
+def i_type(operation, rt, rs, constant):
+    # lw/sw: rt is the data register and rs the base; beq/bne/bltz branch to pc + constant.
+    return (I_OPCODE[operation] << 26) | (rs << 21) | (rt << 16) | (constant & 0xFFFF)
+
+
+def j_type(operation, target):
+    return (J_OPCODE[operation] << 26) | target
+
+
+def load_immediate(register, value):
+    return [i_type("lui", register, 0, value >> 16), i_type("ori", register, register, value & 0xFFFF)]
+
+
+def count_down(words, counter, loop):
+    # counter -= 1; back to loop while it is not zero.
+    words.append(i_type("addi", counter, counter, -1))
+    words.append(i_type("bne", 0, counter, loop - len(words)))
+
+
+def alu_loop(iterations, unroll=8):
+    # Register-only arithmetic, logic and shifts over $8-$15.
+    body = [
+        r_type("add", 8, 8, 9), r_type("xor", 9, 9, 10), r_type("sub", 10, 10, 11), r_type("or", 11, 11, 12),
+        r_type("sll", 12, rt=13, shamt=3), r_type("srl", 13, rt=8, shamt=5), r_type("slt", 14, 9, 10),
+        r_type("nor", 15, 15, 14), i_type("addiu", 9, 9, 17), r_type("and", 13, 13, 12),
+    ]
+    words = load_immediate(2, iterations) + load_immediate(9, 0x9E3779B9) + load_immediate(10, 0x7F4A7C15)
+    loop = len(words)
+    words += [body[i % len(body)] for i in range(unroll)]
+    count_down(words, 2, loop)
+    return words
+
+
+def memory_stream(count, passes=2):
+    # Copies count words from SOURCE to DESTINATION, adding the index to each, passes times.
+    words = load_immediate(2, passes)
+    outer = len(words)
+    words += load_immediate(6, SOURCE) + load_immediate(7, DESTINATION) + load_immediate(4, count)
+    inner = len(words)
+    words += [
+        i_type("lw", 5, 6, 0),
+        r_type("addu", 5, 5, 4),
+        i_type("sw", 5, 7, 0),
+        i_type("addi", 6, 6, 1),
+        i_type("addi", 7, 7, 1),
+    ]
+    count_down(words, 4, inner)
+    count_down(words, 2, outer)
+    return words
+
+
+def call_chain(iterations):
+    # Every iteration calls a leaf and a function that saves $31 on a stack in memory before calling
+    # the leaf itself.
+    words = load_immediate(2, iterations) + load_immediate(29, STACK)
+    loop = len(words)
+    words += [0, 0]  # jal leaf; jal nested
+    count_down(words, 2, loop)
+    words.append(0)  # j past the end
+
+    leaf = len(words)
+    words += [i_type("addi", 8, 8, 1), r_type("xor", 9, 9, 8), r_type("jr", rs=31)]
+    nested = len(words)
+    words += [
+        i_type("addi", 29, 29, -1),
+        i_type("sw", 31, 29, 0),
+        j_type("jal", leaf),
+        i_type("lw", 31, 29, 0),
+        i_type("addi", 29, 29, 1),
+        r_type("jr", rs=31),
+    ]
+
+    words[loop] = j_type("jal", leaf)
+    words[loop + 1] = j_type("jal", nested)
+    words[loop + 4] = j_type("j", len(words))
+    return words
+
+
+def branchy(iterations):
+    # Data-dependent branches driven by a linear congruential generator in $10.
+    words = load_immediate(2, iterations) + load_immediate(10, 12345) + load_immediate(12, 1103515245)
+    loop = len(words)
+    words += [
+        r_type("mult", rs=10, rt=12),
+        r_type("mflo", 10),
+        i_type("addiu", 10, 10, 12345),
+        i_type("andi", 11, 10, 0x100),
+        i_type("beq", 0, 11, 2),
+        i_type("addi", 13, 13, 1),
+        i_type("bltz", 0, 10, 3),
+        r_type("xor", 14, 14, 10),
+        i_type("addi", 15, 15, 1),
+        r_type("slt", 11, 13, 15),
+        i_type("bne", 0, 11, 2),
+        r_type("sub", 13, 13, 15),
+    ]
+    count_down(words, 2, loop)
+    return words
+
+
+def muldiv(iterations):
+    words = load_immediate(2, iterations) + load_immediate(8, 7919) + load_immediate(9, 104729)
+    loop = len(words)
+    words += [
+        r_type("mult", rs=8, rt=9),
+        r_type("mfhi", 10),
+        r_type("mflo", 11),
+        r_type("div", rs=11, rt=8),
+        r_type("mflo", 12),
+        r_type("mfhi", 13),
+        r_type("multu", rs=12, rt=9),
+        r_type("mflo", 14),
+        r_type("divu", rs=14, rt=9),
+        r_type("mfhi", 15),
+        i_type("addi", 8, 8, 3),
+    ]
+    count_down(words, 2, loop)
+    return words
+
+
+# Generator and default size (loop iterations, or words copied per pass for memory) of each workload.
+WORKLOADS = {
+    "alu": (alu_loop, 2000),
+    # The full trace prints every non-zero word after each step, so this one stays small.
+    "memory": (memory_stream, 500),
+    "calls": (call_chain, 2000),
+    "branchy": (branchy, 2000),
+    "muldiv": (muldiv, 2000),
+}
+
+
+def generate(name, scale=1.0):
+    function, size = WORKLOADS[name]
+    return function(max(1, int(size * scale)))
+
+
+def write_hex(path, words):
+    # One 0x-prefixed word per line, like input/input.txt.
+    with open(path, "w") as file:
+        file.write("\n".join(f"0x{word:08x}" for word in words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the synthetic benchmark workloads as hex programs.")
+    parser.add_argument("--output-dir", default="output/workloads")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every workload's default size")
+    parser.add_argument("workloads", nargs="*", help=f"any of {', '.join(WORKLOADS)} (default: all)")
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload: {name}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name in args.workloads or WORKLOADS:
+        path = os.path.join(args.output_dir, f"{name}.txt")
+        write_hex(path, generate(name, args.scale))
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+import json
+
+from alu import sign_extend16
+
+control_instructions = {"beq", "bne", "bltz", "j", "jal", "jr"}
+conditional_branches = {"beq", "bne", "bltz"}
+
+
+def branch_targets(instruction, pc):
+    # Static successors of a control instruction, following the program_counter arithmetic of the
+    # reference methods (the loop adds 1 after every step).
+    if instruction.operation in conditional_branches:
+        return [pc + sign_extend16(instruction.constant), pc + 1]
+    if instruction.operation in ("j", "jal"):
+        return [instruction.constant]
+    return []
+
+
+def find_leaders(instructions):
+    # First addresses of the basic blocks: the entry, every branch and jump target and every address
+    # after a control instruction. None slots (overwritten code) start nothing.
+    leaders = {0}
+    for pc, instruction in enumerate(instructions):
+        if instruction is not None and instruction.operation in control_instructions:
+            leaders.add(pc + 1)
+            leaders.update(branch_targets(instruction, pc))
+    return leaders
+
+
+class BasicBlock:
+    def __init__(self, start, end):
+        # Addresses start..end-1; the last one is the only control instruction.
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+        # The block can leave the program: run past its end, into a None slot or out of range, or by
+        # the exit syscall.
+        self.exits = False
+        # Ends in jr; its successors are every jal return site (see ControlFlowGraph), and with no jal in
+        # the program it exits.
+        self.indirect = False
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class ControlFlowGraph:
+    # Static control-flow graph of a decoded program (MIPS.instructions or assembly_instructions), with
+    # blocks named by their start address. The target of jr is only known at run time; it is taken to
+    # be one of the addresses after a jal, which holds for programs that use jr only to return.
+    #
+    # block_index maps each address to the start of its block (None for None slots), so a successor
+    # address resolves to its block without a search. dominators() and loops() cover the blocks
+    # reachable from address 0; calls maps every jal target to its call sites.
+
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.length = len(instructions)
+        self.leaders = find_leaders(instructions)
+        self.blocks = {}
+        self.block_index = [None] * self.length
+        self.calls = {}
+        self.return_sites = []
+
+        # Blocks holding a syscall, which may be an exit.
+        syscall_blocks = set()
+        start = None
+        for pc, instruction in enumerate(instructions):
+            if instruction is None:
+                if start is not None:
+                    self.close_block(start, pc)
+                start = None
+                continue
+            if start is not None and pc in self.leaders:
+                self.close_block(start, pc)
+                start = None
+            if start is None:
+                start = pc
+            self.block_index[pc] = start
+            if instruction.operation == "syscall":
+                syscall_blocks.add(start)
+            if instruction.operation == "jal":
+                self.calls.setdefault(instruction.constant, []).append(pc)
+                self.return_sites.append(pc + 1)
+            if instruction.operation in control_instructions:
+                self.close_block(start, pc + 1)
+                start = None
+        if start is not None:
+            self.close_block(start, self.length)
+
+        for block in self.blocks.values():
+            block.exits = block.start in syscall_blocks
+            last = instructions[block.end - 1]
+            if last.operation == "jr":
+                block.indirect = True
+                targets = self.return_sites
+                # Without a jal there is no return site to assume, and the jump may go anywhere.
+                if not targets:
+                    block.exits = True
+            elif last.operation in control_instructions:
+                targets = branch_targets(last, block.end - 1)
+            else:
+                targets = [block.end]
+            for target in dict.fromkeys(targets):
+                if 0 <= target < self.length and self.block_index[target] == target:
+                    block.successors.append(target)
+                    self.blocks[target].predecessors.append(block.start)
+                else:
+                    block.exits = True
+
+        self.order = self.reverse_postorder()
+        self.idom = self.dominators()
+
+    def close_block(self, start, end):
+        self.blocks[start] = BasicBlock(start, end)
+
+    def block_at(self, pc):
+        start = self.block_index[pc] if 0 <= pc < self.length else None
+        return self.blocks[start] if start is not None else None
+
+    def reverse_postorder(self):
+        # Blocks reachable from address 0, each before its successors except along back edges.
+        if 0 not in self.blocks:
+            return []
+        postorder = []
+        visited = {0}
+        stack = [(0, iter(self.blocks[0].successors))]
+        while stack:
+            start, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                postorder.append(start)
+        postorder.reverse()
+        return postorder
+
+    def dominators(self):
+        # Immediate dominator of every reachable block (the entry is its own), by the iterative
+        # algorithm of Cooper, Harvey and Kennedy over the reverse postorder.
+        if not self.order:
+            return {}
+        number = {start: index for index, start in enumerate(self.order)}
+        idom = {self.order[0]: self.order[0]}
+
+        def intersect(first, second):
+            while first != second:
+                while number[first] > number[second]:
+                    first = idom[first]
+                while number[second] > number[first]:
+                    second = idom[second]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for start in self.order[1:]:
+                new = None
+                for predecessor in self.blocks[start].predecessors:
+                    if predecessor in idom:
+                        new = predecessor if new is None else intersect(predecessor, new)
+                if idom.get(start) != new:
+                    idom[start] = new
+                    changed = True
+        return idom
+
+    def dominates(self, first, second):
+        if second not in self.idom:
+            return False
+        while second != first:
+            if self.idom[second] == second:
+                return False
+            second = self.idom[second]
+        return True
+
+    def loops(self):
+        # Natural loops: header -> sorted starts of the blocks in its body. A header is the target of a
+        # back edge, an edge whose target dominates its source.
+        loops = {}
+        reachable = set(self.order)
+        for start in self.order:
+            for successor in self.blocks[start].successors:
+                if self.dominates(successor, start):
+                    body = loops.setdefault(successor, {successor})
+                    pending = [start]
+                    while pending:
+                        block = pending.pop()
+                        if block not in body and block in reachable:
+                            body.add(block)
+                            pending.extend(self.blocks[block].predecessors)
+        return {header: sorted(body) for header, body in sorted(loops.items())}
+
+    def unreachable(self):
+        reachable = set(self.order)
+        return [start for start in sorted(self.blocks) if start not in reachable]
+
+    def to_json(self):
+        loops = self.loops()
+        return {
+            "length": self.length,
+            "entry": 0 if 0 in self.blocks else None,
+            "blocks": [{
+                "start": block.start,
+                "end": block.end,
+                "successors": block.successors,
+                "predecessors": sorted(block.predecessors),
+                "exits": block.exits,
+                "indirect": block.indirect,
+                "idom": self.idom.get(block.start),
+            } for _, block in sorted(self.blocks.items())],
+            "loops": {str(header): body for header, body in loops.items()},
+            "calls": {str(target): sites for target, sites in sorted(self.calls.items())},
+            "unreachable": self.unreachable(),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.to_json(), file, indent=2)
+            file.write("\n")
+
+    def to_dot(self, listing=True):
+        # Graphviz source. Loop headers are drawn bold, unreachable blocks dashed and jr edges dotted;
+        # listing=False leaves the instructions out of the labels.
+        headers = self.loops()
+        reachable = set(self.order)
+        lines = ["digraph cfg {", '    node [shape=box, fontname="monospace"];']
+        for start, block in sorted(self.blocks.items()):
+            label = f"{start}-{block.end - 1}\\l"
+            if listing:
+                label += "".join(str(self.instructions[pc]).replace('"', '\\"') + "\\l"
+                                 for pc in range(start, block.end))
+            styles = []
+            if start in headers:
+                styles.append("bold")
+            if start not in reachable:
+                styles.append("dashed")
+            style = f', style="{",".join(styles)}"' if styles else ""
+            lines.append(f'    b{start} [label="{label}"{style}];')
+        if any(block.exits for block in self.blocks.values()):
+            lines.append('    exit [shape=oval, label="exit"];')
+        for start, block in sorted(self.blocks.items()):
+            style = " [style=dotted]" if block.indirect else ""
+            for successor in block.successors:
+                lines.append(f"    b{start} -> b{successor}{style};")
+            if block.exits:
+                lines.append(f"    b{start} -> exit;")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def write_dot(self, path, listing=True):
+        with open(path, "w") as file:
+            file.write(self.to_dot(listing))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from main import MIPS
+
+    parser = argparse.ArgumentParser(description="Build the control-flow graph of a hex program.")
+    parser.add_argument("input", nargs="?", default="input/input.txt")
+    parser.add_argument("--json", default="output/cfg.json")
+    parser.add_argument("--dot", default="output/cfg.dot")
+    parser.add_argument("--no-listing", action="store_true", help="leave the instructions out of the DOT labels")
+    args = parser.parse_args()
+
+    mips = MIPS()
+    graph = ControlFlowGraph(mips.decode_words(mips.hex_to_words(args.input)))
+    graph.write_json(args.json)
+    graph.write_dot(args.dot, not args.no_listing)
+    print(f"{len(graph.blocks)} blocks, {len(graph.order)} reachable, {len(graph.loops())} loops, "
+          f"{len(graph.calls)} call targets")
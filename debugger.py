@@ -0,0 +1,245 @@
+from alu import sign_extend16
+from isa import register_index, written_registers
+from memory import WORD_ADDRESS_MASK
+
+# Operations that write data memory: a store writes one word, syscall (read_string) any number.
+store_instructions = {"sw", "sb"}
+
+
+def condition_from(expression):
+    # Condition from a Python expression over regs (the register slots) and mem(address) (a word load),
+    # e.g. "regs[8] > 100 and mem(64) == 0".
+    code = compile(expression, f"<condition {expression}>", "eval")
+    return lambda mips: eval(code, {"regs": mips.regs, "mem": mips.load_word})
+
+
+class DebugStop(Exception):
+    # Why Debugger.run stopped. reason is "breakpoint" (the instruction at pc has not run yet), "register"
+    # or "memory" (the instruction at pc changed the watched register slot or word address target from
+    # old to new), "budget" (max_steps ran out) or "halted".
+
+    def __init__(self, reason, pc, target=None, old=None, new=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.pc = pc
+        self.target = target
+        self.old = old
+        self.new = new
+
+    def __str__(self):
+        if self.reason == "register":
+            return f"register ${self.target} changed at {self.pc}: {self.old} -> {self.new}"
+        if self.reason == "memory":
+            return f"memory[{self.target}] changed at {self.pc}: {self.old} -> {self.new}"
+        return f"{self.reason} at {self.pc}"
+
+
+class Debugger:
+    # Breakpoints and watchpoints for MIPS.run(debugger=...). run() is a copy of MIPS.run_table whose
+    # handler table wraps only the instructions that need a check: the ones at a breakpoint, the ones
+    # writing a watched register and the stores (sw, sb, syscall) while memory is watched. Every other
+    # instruction keeps its plain handler, and with nothing set run() is run_table itself.
+    #
+    # A condition is a function of the machine (see condition_from); the stop only happens when it is
+    # true. Watchpoints stop after a change of value, not on every write. Running again from a
+    # breakpoint steps over it first.
+
+    def __init__(self):
+        self.breakpoints = {}
+        self.watched_registers = {}
+        self.registers = {}
+        self.memory = {}
+        self.stop = None
+        self.resume_pc = None
+
+    def break_at(self, pc, condition=None):
+        self.breakpoints[pc] = condition
+
+    def watch_register(self, register, condition=None):
+        # register: a slot number or a name as register_index takes it, resolved when run() starts.
+        self.watched_registers[register] = condition
+
+    def watch_memory(self, address, condition=None):
+        self.memory[address & WORD_ADDRESS_MASK] = condition
+
+    def clear(self):
+        self.breakpoints.clear()
+        self.watched_registers.clear()
+        self.memory.clear()
+
+    def run(self, mips, tracer, max_steps=None):
+        # Same loop, budget and trace calls as MIPS.run_table; returns the DebugStop, also kept in stop.
+        stop = self.stop
+        self.resume_pc = stop.pc if stop is not None and stop.reason == "breakpoint" else None
+        self.registers = {register_index(register, mips.register_table): condition
+                          for register, condition in self.watched_registers.items()}
+        if not (self.breakpoints or self.registers or self.memory):
+            mips.run_table(tracer, max_steps)
+            return self.finish(mips)
+
+        handlers = mips.bind_instructions()
+        count = len(handlers)
+        step = tracer.step
+        skip = tracer.skip
+        budget = remaining = -1 if max_steps is None else max_steps
+        line = pc = None
+
+        try:
+            while remaining and 0 <= mips.program_counter < count:
+                bound = handlers[mips.program_counter] or self.bind_at(mips, mips.program_counter)
+                if bound is None: break
+                remaining -= 1
+                line, handler = bound
+                pc = mips.program_counter
+
+                if handler is None:
+                    # Instructions without a handler are not wrapped; their breakpoints are checked here.
+                    if pc in self.breakpoints and self.breaks(mips, pc):
+                        raise DebugStop("breakpoint", pc)
+                    mips.program_counter += 1
+                    skip(line, pc)
+                    continue
+
+                handler()
+
+                mips.program_counter += 1
+                step(line, pc)
+                line = None
+        except DebugStop as stop:
+            if stop.reason == "breakpoint":
+                remaining += 1
+            else:
+                mips.program_counter += 1
+                step(line, pc)
+            self.stop = stop
+            return stop
+        except BaseException:
+            if line is not None:
+                tracer.interrupted(line, pc)
+            raise
+        finally:
+            mips.instruction_count += budget - remaining
+        return self.finish(mips)
+
+    def finish(self, mips):
+        pc = mips.program_counter
+        self.stop = DebugStop("halted" if mips.instruction_at(pc) is None else "budget", pc)
+        return self.stop
+
+    def bind_at(self, mips, address):
+        bound = mips.bind_at(address)
+        if bound is None or bound[1] is None:
+            return bound
+
+        line, handler = bound
+        instruction = mips.instructions[address]
+        codes = [code for code in written_registers(mips, instruction) if code in self.registers]
+        if codes:
+            handler = self.register_check(mips, address, handler, codes)
+        if self.memory and (instruction.operation in store_instructions or instruction.operation == "syscall"):
+            handler = self.memory_check(mips, address, handler, instruction)
+        if address in self.breakpoints:
+            handler = self.breakpoint_check(mips, address, handler)
+        bound = mips.handlers[address] = line, handler
+        return bound
+
+    def breaks(self, mips, pc):
+        if self.resume_pc == pc:
+            self.resume_pc = None
+            return False
+        condition = self.breakpoints[pc]
+        return condition is None or condition(mips)
+
+    def breakpoint_check(self, mips, pc, handler):
+        def check():
+            if self.breaks(mips, pc):
+                raise DebugStop("breakpoint", pc)
+            handler()
+        return check
+
+    def register_check(self, mips, pc, handler, codes):
+        regs = mips.regs
+        conditions = self.registers
+
+        def check():
+            old = [regs[code] for code in codes]
+            handler()
+            for code, value in zip(codes, old):
+                if regs[code] != value:
+                    condition = conditions[code]
+                    if condition is None or condition(mips):
+                        raise DebugStop("register", pc, code, value, regs[code])
+        return check
+
+    def memory_check(self, mips, pc, handler, instruction):
+        conditions = self.memory
+        load_word = mips.load_word
+
+        if instruction.operation in store_instructions:
+            # Only the word the store hits is compared.
+            base, offset = instruction.second_reg, sign_extend16(instruction.constant)
+
+            def check():
+                address = (base.value + offset) & WORD_ADDRESS_MASK
+                if address not in conditions:
+                    handler()
+                    return
+                old = load_word(address)
+                handler()
+                self.memory_changed(mips, pc, address, old)
+            return check
+
+        def check():
+            old = [(address, load_word(address)) for address in conditions]
+            handler()
+            for address, value in old:
+                self.memory_changed(mips, pc, address, value)
+        return check
+
+    def memory_changed(self, mips, pc, address, old):
+        new = mips.load_word(address)
+        if new != old:
+            condition = self.memory[address]
+            if condition is None or condition(mips):
+                raise DebugStop("memory", pc, address, old, new)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    from main import MIPS
+
+    def breakpoint_argument(text):
+        pc, _, expression = text.partition(":")
+        return int(pc, 0), condition_from(expression) if expression else None
+
+    parser = argparse.ArgumentParser(description="Run a hex program and report where it stops.")
+    parser.add_argument("input", nargs="?", default="input/input.txt")
+    parser.add_argument("--break", dest="breakpoints", action="append", default=[], type=breakpoint_argument,
+                        metavar="PC[:CONDITION]", help="stop before PC, when the Python CONDITION over regs "
+                        "and mem(address) holds")
+    parser.add_argument("--watch-reg", action="append", default=[], metavar="REGISTER")
+    parser.add_argument("--watch-mem", action="append", default=[], type=lambda text: int(text, 0),
+                        metavar="ADDRESS", help="word address")
+    parser.add_argument("--max-steps", type=int, default=None, help="instruction budget of the whole run")
+    parser.add_argument("--max-stops", type=int, default=100)
+    args = parser.parse_args()
+
+    debugger = Debugger()
+    for pc, condition in args.breakpoints:
+        debugger.break_at(pc, condition)
+    for register in args.watch_reg:
+        debugger.watch_register(register)
+    for address in args.watch_mem:
+        debugger.watch_memory(address)
+
+    mips = MIPS()
+    mips.simulate(args.input, os.devnull, trace="off", max_steps=0, assembly_path=None)
+    for _ in range(args.max_stops):
+        budget = None if args.max_steps is None else args.max_steps - mips.instruction_count
+        mips.run(os.devnull, trace="off", max_steps=budget, debugger=debugger)
+        stop = debugger.stop
+        print(f"{mips.instruction_count:>10}  {stop}")
+        if stop.reason in ("halted", "budget"):
+            break
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import sys
+import tempfile
+from array import array
+from struct import Struct
+
+CACHE_MAGIC = b"MDEC\x01"
+# distinct words, program words, listing bytes
+cache_header = Struct(">III")
+CACHE_SUFFIX = ".dec"
+
+
+def word_array(values):
+    # Little-endian 32-bit words, whatever the host order.
+    words = array("I", values)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+class DecodeCache:
+    # On-disk cache of decoded programs, keyed by the SHA-256 of the hex file and the decoder version
+    # (MIPS.decoder_version). An entry holds the program as indices into its distinct words, plus the
+    # assembly listing, so a warm load is one read, a decode of the distinct words only and a bulk
+    # write of the listing. Decoded instructions are never modified, so equal words share one
+    # AssemblyInstruction. Entries beyond max_bytes are evicted least recently used first.
+    #
+    # Entries hold raw words, not decoded fields: decode_word is a few shifts and masks, and building
+    # the AssemblyInstruction objects costs the same from stored fields, so a warm load still pays for
+    # decoding each distinct word. On programs of mostly distinct words that keeps the warm speedup at
+    # 2-3x (benchmark/startup_benchmark.py); the gain is in skipping the hex parsing and listing.
+
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, mips, input_path, assembly_path=None):
+        # Fills mips.assembly_instructions like hex_to_words + words_to_assembly would, and writes the
+        # listing to assembly_path unless it is None.
+        with open(input_path, "rb") as file:
+            data = file.read()
+        key = hashlib.sha256(f"{mips.decoder_version}:".encode() + data).hexdigest()
+
+        entry = self.read(key)
+        if entry is None:
+            self.misses += 1
+            words = [int(line, 16) for line in data.decode().splitlines()]
+            instructions = mips.decode_words(words)
+            listing = "".join([str(instruction) + "\n" for instruction in instructions]).encode()
+            self.write(key, words, listing)
+        else:
+            self.hits += 1
+            distinct, indices, listing = entry
+            decoded = mips.decode_words(distinct)
+            instructions = [decoded[index] for index in indices]
+
+        mips.assembly_instructions.extend(instructions)
+        if assembly_path is not None:
+            with open(assembly_path, "wb") as file:
+                file.write(listing)
+        return instructions
+
+    def read(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        offset = len(CACHE_MAGIC) + cache_header.size
+        if not data.startswith(CACHE_MAGIC) or len(data) < offset:
+            return self.discard(path)
+
+        distinct_count, word_count, listing_length = cache_header.unpack_from(data, len(CACHE_MAGIC))
+        # A truncated or otherwise damaged entry is a miss, never a shorter program.
+        if len(data) != offset + 4 * (distinct_count + word_count) + listing_length:
+            return self.discard(path)
+        distinct = array("I")
+        distinct.frombytes(data[offset:offset + 4 * distinct_count])
+        offset += 4 * distinct_count
+        indices = array("I")
+        indices.frombytes(data[offset:offset + 4 * word_count])
+        offset += 4 * word_count
+        if sys.byteorder == "big":
+            distinct.byteswap()
+            indices.byteswap()
+        if indices and max(indices) >= distinct_count:
+            return self.discard(path)
+
+        # Marks the entry as recently used for evict(). Another process's evict() may have removed it
+        # since it was read; that counts as a miss, as if it had gone a moment earlier.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return distinct.tolist(), indices, data[offset:offset + listing_length]
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+
+    def write(self, key, words, listing):
+        positions = {}
+        for word in words:
+            if word not in positions:
+                positions[word] = len(positions)
+        distinct = word_array(positions)
+        indices = word_array([positions[word] for word in words])
+
+        # Written under a temporary name and renamed, so concurrent runs never read half an entry.
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as file:
+            file.write(CACHE_MAGIC + cache_header.pack(len(distinct), len(indices), len(listing)))
+            file.write(distinct.tobytes())
+            file.write(indices.tobytes())
+            file.write(listing)
+        os.replace(temporary, self.path_for(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                # Entries other processes evict between listdir and stat are skipped.
+                try:
+                    status = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
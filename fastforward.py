@@ -0,0 +1,196 @@
+import re
+import sys
+from math import gcd
+
+from alu import divide, sign_extend16, split_product, to_signed
+from cfg import control_instructions
+from jit import inline_templates, read_source, write_target
+
+# Register-only operations a fast-forwarded loop body may contain. Loads and stores are left out: a
+# body with memory side effects is stepped as usual.
+loop_templates = {operation: template for operation, template in inline_templates.items()
+                  if operation not in ("lw", "lb")}
+loop_templates.update({
+    "mult": "regs[32], regs[33] = split_product({A} * {B})",
+    "multu": "regs[32], regs[33] = split_product(({A} & 0xFFFFFFFF) * ({B} & 0xFFFFFFFF))",
+    "div": "regs[33], regs[32] = divide({A}, {B}) if {B} else (0, 0)",
+    "divu": "regs[33], regs[32] = divide({A} & 0xFFFFFFFF, {B} & 0xFFFFFFFF) if {B} else (0, 0)",
+})
+
+branch_conditions = {"bne": "{A} != {B}", "beq": "{A} == {B}", "bltz": "{A} < 0"}
+induction_instructions = {"addi", "addiu"}
+register_reference = re.compile(r"regs\[(\d+)\]")
+
+
+def first_return(difference, step):
+    # Smallest n >= 1 with difference + n * step == 0 (mod 2**32), or None if there is none.
+    modulus = 1 << 32
+    target = -difference % modulus
+    step %= modulus
+    if not step:
+        return 1 if not target else None
+    common = gcd(step, modulus)
+    if target % common:
+        return None
+    period = modulus // common
+    n = target // common * pow(step // common, -1, period) % period
+    return n or period
+
+
+class Loop:
+    # A single-block loop: start..end-1 hold register-only instructions and end holds a conditional
+    # branch back to start. run(limit) performs up to limit whole iterations at once and returns
+    # (iterations, next pc): start if it stopped at the limit, end + 1 if the branch fell through.
+    #
+    # When every instruction of the body adds a constant to its own register (addi/addiu r, r, k) and
+    # the branch is a bne, the iteration count and the final registers are computed in closed form.
+    # Any other body is compiled into a function that runs the iterations over local variables.
+
+    def __init__(self, regs, instructions, start, end):
+        self.regs = regs
+        self.start = start
+        self.end = end
+        self.length = end - start + 1
+        self.branch = instructions[-1]
+        self.steps = self.induction_steps(instructions)
+        self.function = self.compile(instructions) if self.steps is None else None
+
+    def induction_steps(self, instructions):
+        if self.branch.operation != "bne":
+            return None
+        steps = {}
+        for instruction in instructions[:-1]:
+            if instruction.operation not in induction_instructions or instruction.first_reg is not instruction.dest_reg:
+                return None
+            code = instruction.dest_reg.code
+            if code:
+                steps[code] = steps.get(code, 0) + sign_extend16(instruction.constant)
+        return steps
+
+    def compile(self, instructions):
+        lines = []
+        for instruction in instructions[:-1]:
+            c = instruction.constant
+            lines.append(loop_templates[instruction.operation].format(
+                D=write_target(instruction.dest_reg), AW=write_target(instruction.first_reg),
+                A=read_source(instruction.first_reg), B=read_source(instruction.second_reg),
+                c=c, s=instruction.shamt,
+                sc=sign_extend16(c) if c is not None else None,
+                lui_c=to_signed(c << 16) if c is not None else None,
+            ))
+        condition = branch_conditions[self.branch.operation].format(
+            A=read_source(self.branch.first_reg), B=read_source(self.branch.second_reg))
+
+        body = "\n".join(lines + [f"if not ({condition}): break"])
+        used = sorted({int(code) for code in register_reference.findall(body)})
+        body = register_reference.sub(r"r\1", body)
+        load = [f"r{code} = regs[{code}]" for code in used]
+        store = [f"regs[{code}] = r{code}" for code in used if code]
+
+        source = "\n".join(
+            [f"def loop_{self.start}(limit):"]
+            + [f"    {line}" for line in load]
+            + ["    n = 0", "    while n < limit:", "        n += 1"]
+            + [f"        {line}" for line in body.split("\n")]
+            + ["    else:"]
+            + [f"        {line}" for line in store]
+            + [f"        return n, {self.start}"]
+            + [f"    {line}" for line in store]
+            + [f"    return n, {self.end + 1}"]
+        ) + "\n"
+        namespace = {"regs": self.regs, "split_product": split_product, "divide": divide}
+        exec(compile(source, f"<loop {self.start}>", "exec"), namespace)
+        return namespace[f"loop_{self.start}"]
+
+    def run(self, limit):
+        if self.function is not None:
+            return self.function(limit)
+
+        regs = self.regs
+        steps = self.steps
+        first, second = self.branch.first_reg.code, self.branch.second_reg.code
+        iterations = first_return(regs[first] - regs[second], steps.get(first, 0) - steps.get(second, 0))
+        # A loop that never exits runs until the budget ends it.
+        done = iterations is not None and iterations <= limit
+        if not done:
+            iterations = limit
+        for code, step in steps.items():
+            regs[code] = to_signed(regs[code] + iterations * step)
+        return iterations, self.end + 1 if done else self.start
+
+
+def analyze(mips, start, end):
+    # The Loop for the backward branch at end, or None when start..end is not a register-only body.
+    instructions = [mips.instruction_at(pc) for pc in range(start, end + 1)]
+    if any(instruction is None for instruction in instructions):
+        return None
+    branch = instructions[-1]
+    if branch.operation not in branch_conditions:
+        return None
+    for instruction in instructions[:-1]:
+        if instruction.operation in control_instructions or instruction.operation not in loop_templates:
+            return None
+    return Loop(mips.regs, instructions, start, end)
+
+
+class LoopForwarder:
+    # Interpreter with loop fast-forward, used by MIPS.run for fast_forward=True with the trace off. It
+    # steps like run_table; when a conditional branch jumps back, the code between its target and the
+    # branch is analyzed once, and if it is a Loop, later arrivals at the target run whole iterations
+    # at a time (as many as the budget allows; the rest is stepped). Stores over a loop's code drop it.
+
+    def __init__(self, mips):
+        self.mips = mips
+        self.loops = {}
+        self.analyzed = set()
+        self.covering = {}
+        self.forwarded = 0
+
+    def run(self, max_steps=None):
+        mips = self.mips
+        handlers = mips.bind_instructions()
+        count = len(handlers)
+        loops = self.loops
+        analyzed = self.analyzed
+        budget = remaining = sys.maxsize if max_steps is None else max_steps
+
+        pc = mips.program_counter
+        try:
+            while remaining and 0 <= pc < count:
+                loop = loops.get(pc)
+                if loop is not None and loop.length <= remaining:
+                    iterations, pc = loop.run(remaining // loop.length)
+                    remaining -= iterations * loop.length
+                    self.forwarded += iterations * loop.length
+                    continue
+
+                bound = handlers[pc] or mips.bind_at(pc)
+                if bound is None: break
+                remaining -= 1
+                handler = bound[1]
+                if handler is not None:
+                    mips.program_counter = pc
+                    handler()
+                    # A jump back to program_counter + 1 <= pc; analyze rejects all but conditional branches.
+                    if mips.program_counter < pc and (mips.program_counter + 1, pc) not in analyzed:
+                        analyzed.add((mips.program_counter + 1, pc))
+                        self.add(analyze(mips, mips.program_counter + 1, pc))
+                    pc = mips.program_counter
+                pc += 1
+        finally:
+            mips.program_counter = pc
+            mips.instruction_count += budget - remaining
+
+    def add(self, loop):
+        if loop is None or loop.start in self.loops:
+            return
+        self.loops[loop.start] = loop
+        for address in range(loop.start, loop.end + 1):
+            self.covering[address] = loop.start
+
+    def invalidate(self, address):
+        start = self.covering.pop(address, None)
+        if start is not None:
+            loop = self.loops.pop(start)
+            for covered in range(loop.start, loop.end + 1):
+                self.covering.pop(covered, None)
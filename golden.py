@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+import tempfile
+
+from main import MIPS
+from syscalls import HostIO
+from tracing import read_digests
+
+
+def record(input_path, golden_path, every=1000, start=0, end=None, dispatch="table"):
+    # Writes the digest trace of a program: a checkpoint every `every` instructions, from instruction
+    # start (run untraced up to there) to end or the end of the program.
+    with open(os.devnull, "w") as console:
+        mips = MIPS()
+        host = HostIO(console)
+        mips.simulate(input_path, os.devnull, dispatch, trace="off", max_steps=start, assembly_path=None, host=host)
+        mips.run(golden_path, dispatch, trace="digest", trace_every=every,
+                 max_steps=None if end is None else end - start, host=host)
+    return mips
+
+
+def read_golden(path):
+    with open(path, "rb") as file:
+        return read_digests(file.read())[1]
+
+
+def first_divergence(golden, candidate):
+    # Binary search over the checkpoints both traces have (same instruction count) for the first one
+    # that differs; a run's state only depends on the state before, so once two runs differ the later
+    # checkpoints are taken to differ too. Returns None when the traces agree, otherwise (good, bad):
+    # the states agree after `good` instructions (None if they already differ at the first shared
+    # checkpoint) and differ after `bad`.
+    by_step = {steps: checkpoint for steps, *checkpoint in candidate}
+    common = [(steps, checkpoint) for steps, *checkpoint in golden if steps in by_step]
+    if not common:
+        raise ValueError("the traces have no checkpoint in common")
+    low, high = 0, len(common)
+    while low < high:
+        middle = (low + high) // 2
+        steps, checkpoint = common[middle]
+        if by_step[steps] == checkpoint:
+            low = middle + 1
+        else:
+            high = middle
+    good = common[low - 1][0] if low else None
+    if low < len(common):
+        return good, common[low][0]
+    # Every shared checkpoint agrees; the runs can still end differently.
+    if golden[-1] == candidate[-1]:
+        return None
+    later = [steps for steps, *_ in golden + candidate if steps > good]
+    return good, min(later)
+
+
+def write_window(input_path, output_path, start, end, dispatch="table"):
+    # Full text trace of instructions start + 1 .. end only, to compare against the reference's.
+    with open(os.devnull, "w") as console:
+        mips = MIPS()
+        host = HostIO(console)
+        mips.simulate(input_path, os.devnull, dispatch, trace="off", max_steps=start, assembly_path=None, host=host)
+        mips.run(output_path, dispatch, trace="full", max_steps=end - start, host=host)
+
+
+def report(golden, candidate):
+    window = first_divergence(golden, candidate)
+    if window is None:
+        print(f"identical: {len(golden)} checkpoints, {golden[-1][0]} instructions")
+        return None
+    if window[0] is None:
+        print(f"the states differ at the first shared checkpoint, after instruction {window[1]}")
+    else:
+        print(f"first divergence after instruction {window[0]}, by instruction {window[1]}")
+    return window
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and compare state digest golden traces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="write the digest trace of a program")
+    record_parser.add_argument("input")
+    record_parser.add_argument("golden")
+    record_parser.add_argument("--every", type=int, default=1000, help="instructions between checkpoints")
+    record_parser.add_argument("--start", type=int, default=0, help="run this many instructions untraced first")
+    record_parser.add_argument("--end", type=int, default=None, help="stop after this many instructions")
+
+    diff_parser = commands.add_parser("diff", help="find the first divergence between two digest traces")
+    diff_parser.add_argument("golden")
+    diff_parser.add_argument("candidate")
+
+    check_parser = commands.add_parser("check", help="run a program and compare it with its golden trace")
+    check_parser.add_argument("input")
+    check_parser.add_argument("golden")
+    check_parser.add_argument("--window-trace", default=None,
+                              help="write the full trace of the diverging window here")
+
+    for command in (record_parser, check_parser):
+        command.add_argument("--dispatch", choices=["table", "jit"], default="table")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        mips = record(args.input, args.golden, args.every, args.start, args.end, args.dispatch)
+        print(f"{len(read_golden(args.golden))} checkpoints, {mips.instruction_count} instructions")
+        return 0
+
+    if args.command == "diff":
+        return 1 if report(read_golden(args.golden), read_golden(args.candidate)) else 0
+
+    with open(args.golden, "rb") as file:
+        every, golden = read_digests(file.read())
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "candidate.dig")
+        record(args.input, path, every, dispatch=args.dispatch)
+        window = report(golden, read_golden(path))
+    if window is not None and window[0] is not None and args.window_trace:
+        write_window(args.input, args.window_trace, window[0], window[1], args.dispatch)
+        print(f"window trace: {args.window_trace}")
+    return 1 if window else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+def register_index(name, table):
+    # Register slot of a name: a number (8, "8", "$8") or a name ("t0", "$t0", "hi", "lo").
+    if isinstance(name, int):
+        index = name
+    else:
+        name = name.lstrip("$")
+        index = int(name) if name.isdigit() else next(
+            (i for i, entry in enumerate(table) if entry[1] == name), None)
+    if index is None or not 0 <= index < len(table):
+        raise ValueError(f"unknown register: {name}")
+    return index
+
+
+def written_registers(mips, instruction):
+    # Register slots the instruction may change.
+    operation = instruction.operation
+    if operation in ("lw", "lb"):
+        return [instruction.first_reg.code]
+    if operation in ("mult", "multu", "div", "divu"):
+        return [mips.HI, mips.LO]
+    if operation == "jal":
+        return [31]
+    if operation == "syscall":
+        return [2]
+    if operation in mips.dispatch_operands and "dest_reg" in mips.dispatch_operands[operation][1]:
+        return [instruction.dest_reg.code]
+    return []
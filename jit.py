@@ -0,0 +1,211 @@
+import sys
+
+from alu import sign_extend16, to_signed
+from cfg import control_instructions, find_leaders
+
+# Operations compiled to a call of the reference method instead of inline code.
+helper_instructions = {"mult", "multu", "div", "divu"}
+
+# Operations always left to the interpreter: syscall does host I/O and may end the run.
+interpreted_instructions = {"syscall"}
+
+# Inline templates over the register file: {D} destination, {A}/{B} first and second operand, {AW} the
+# first operand as a destination (lw, lb), {c} constant, {sc} sign-extended constant, {s} shamt.
+# Results wrap to signed 32 bits with the same arithmetic as alu.to_signed.
+WRAP = "(({}) + 0x80000000 & 0xFFFFFFFF) - 0x80000000"
+
+inline_templates = {
+    "add": "{D} = " + WRAP.format("{A} + {B}"),
+    "sub": "{D} = " + WRAP.format("{A} - {B}"),
+    "slt": "{D} = 1 if {A} < {B} else 0",
+    "and": "{D} = {A} & {B}",
+    "or": "{D} = {A} | {B}",
+    "xor": "{D} = {A} ^ {B}",
+    "nor": "{D} = ~({A} | {B})",
+    "mfhi": "{D} = regs[32]",
+    "mflo": "{D} = regs[33]",
+    "addu": "{D} = " + WRAP.format("{A} + {B}"),
+    "subu": "{D} = " + WRAP.format("{A} - {B}"),
+    "sll": "{D} = " + WRAP.format("{A} << {s}"),
+    "srl": "{D} = " + WRAP.format("({A} & 0xFFFFFFFF) >> {s}"),
+    "sra": "{D} = {A} >> {s}",
+    "sllv": "{D} = " + WRAP.format("{A} << ({B} & 31)"),
+    "srlv": "{D} = " + WRAP.format("({A} & 0xFFFFFFFF) >> ({B} & 31)"),
+    "srav": "{D} = {A} >> ({B} & 31)",
+    "addi": "{D} = " + WRAP.format("{A} + {sc}"),
+    "slti": "{D} = 1 if {A} < {sc} else 0",
+    "andi": "{D} = {A} & {c}",
+    "ori": "{D} = {A} | {c}",
+    "xori": "{D} = {A} ^ {c}",
+    "addiu": "{D} = " + WRAP.format("{A} + {sc}"),
+    "lui": "{D} = {lui_c}",
+    "lw": "{AW} = load_word({B} + {sc})",
+    "lb": "{AW} = load_byte({B} + {sc})",
+}
+
+
+def read_source(register):
+    return f"regs[{register.code}]" if register is not None else None
+
+
+def write_target(register):
+    # Writes to $zero are evaluated and dropped.
+    if register is None:
+        return None
+    return f"regs[{register.code}]" if register.code else "_"
+
+
+class BlockCompiler:
+    def __init__(self, mips, threshold=50):
+        self.mips = mips
+        self.threshold = threshold
+        self.blocks = {}
+        self.sizes = {}
+        self.counts = {}
+        self.covering = {}
+        self.uncompilable = set()
+        self.compiled = 0
+
+        # A lazily loaded program (loader.LazyProgram) is not scanned ahead, which would decode all of
+        # it; its leaders are found as control instructions run.
+        self.leaders = find_leaders(mips.instructions) if isinstance(mips.instructions, list) else {0}
+
+        self.namespace = {
+            "regs": mips.regs,
+            "load_word": mips.load_word,
+            "load_byte": mips.load_byte,
+            "store_word": mips.store_word,
+            "store_byte": mips.store_byte,
+        }
+        for name in helper_instructions:
+            self.namespace[name] = getattr(mips, name)
+        # Helper calls take the Register views the reference methods expect.
+        for register in mips.Reg_dict.values():
+            if register.code is not None:
+                self.namespace[f"r{register.code}"] = register
+
+    def run(self, max_steps=None):
+        # Blocks return (next pc, instructions executed). With a budget, a block that could overrun it
+        # is interpreted instead, so the run stops exactly after max_steps instructions.
+        mips = self.mips
+        instructions = mips.instructions
+        handlers = mips.bind_instructions()
+        blocks = self.blocks
+        sizes = self.sizes
+        counts = self.counts
+        leaders = self.leaders
+        threshold = self.threshold
+        remaining = sys.maxsize if max_steps is None else max_steps
+
+        pc = mips.program_counter
+        while remaining and mips.instruction_at(pc) is not None:
+            block = blocks.get(pc)
+            if block is not None and sizes[pc] <= remaining:
+                pc, executed = block()
+                remaining -= executed
+                mips.instruction_count += executed
+                leaders.add(pc)
+                continue
+
+            if block is None and pc in leaders and pc not in self.uncompilable:
+                counts[pc] = counts.get(pc, 0) + 1
+                if counts[pc] >= threshold and self.compile(pc) is not None:
+                    continue
+
+            remaining -= 1
+            mips.instruction_count += 1
+            handler = (handlers[pc] or mips.bind_at(pc))[1]
+            if handler is not None:
+                operation = instructions[pc].operation
+                mips.program_counter = pc
+                handler()
+                if operation in control_instructions or operation in interpreted_instructions:
+                    leaders.add(mips.program_counter + 1)
+                pc = mips.program_counter
+            pc += 1
+
+        mips.program_counter = pc
+
+    def compile(self, start):
+        mips = self.mips
+        lines = []
+        pc = start
+        while True:
+            instruction = mips.instruction_at(pc)
+            if instruction is None or (pc != start and pc in self.leaders):
+                lines.append(f"return {pc}, {pc - start}")
+                break
+            if not self.compilable(instruction):
+                if pc == start:
+                    self.uncompilable.add(start)
+                    return None
+                lines.append(f"return {pc}, {pc - start}")
+                break
+
+            lines.extend(self.translate(instruction, pc, pc + 1 - start))
+            pc += 1
+            if instruction.operation in control_instructions:
+                break
+
+        source = f"def block_{start}():\n" + "".join(f"    {line}\n" for line in lines)
+        exec(compile(source, f"<block {start}>", "exec"), self.namespace)
+        block = self.namespace.pop(f"block_{start}")
+
+        self.blocks[start] = block
+        self.sizes[start] = pc - start
+        for address in range(start, pc):
+            self.covering.setdefault(address, set()).add(start)
+        self.compiled += 1
+        return block
+
+    def compilable(self, instruction):
+        return instruction.operation not in interpreted_instructions
+
+    def translate(self, instruction, pc, executed):
+        # executed: instructions run by the block once this one completes.
+        operation = instruction.operation
+        c = instruction.constant
+
+        if operation in inline_templates:
+            source = inline_templates[operation].format(
+                D=write_target(instruction.dest_reg), AW=write_target(instruction.first_reg),
+                A=read_source(instruction.first_reg), B=read_source(instruction.second_reg),
+                c=c, s=instruction.shamt,
+                sc=sign_extend16(c) if c is not None else None,
+                lui_c=to_signed(c << 16) if c is not None else None,
+            )
+            return source.split("\n")
+
+        a = read_source(instruction.first_reg)
+        b = read_source(instruction.second_reg)
+        if operation in helper_instructions:
+            return [f"{operation}(r{instruction.first_reg.code}, r{instruction.second_reg.code})"]
+
+        # A store over a compiled instruction ends the block so the next fetch sees the new contents.
+        if operation == "sw":
+            return [f"if store_word({b} + {sign_extend16(c)}, {a}):", f"    return {pc + 1}, {executed}"]
+        if operation == "sb":
+            return [f"if store_byte({b} + {sign_extend16(c)}, {a}):", f"    return {pc + 1}, {executed}"]
+        if operation == "bltz":
+            return [f"return ({pc + sign_extend16(c)} if {a} < 0 else {pc + 1}), {executed}"]
+        if operation == "beq":
+            return [f"return ({pc + sign_extend16(c)} if {a} == {b} else {pc + 1}), {executed}"]
+        if operation == "bne":
+            return [f"return ({pc + sign_extend16(c)} if {a} != {b} else {pc + 1}), {executed}"]
+        if operation == "j":
+            return [f"return {c}, {executed}"]
+        if operation == "jal":
+            return [f"regs[31] = {pc + 1}", f"return {c}, {executed}"]
+        if operation == "jr":
+            return [f"return {a}, {executed}"]
+
+        # Operations without a handler (lbu) are skipped, as in run_table.
+        return []
+
+    def invalidate(self, address):
+        starts = self.covering.pop(address, ())
+        for start in starts:
+            self.blocks.pop(start, None)
+            self.sizes.pop(start, None)
+            self.counts.pop(start, None)
+        return bool(starts)
@@ -0,0 +1,101 @@
+import mmap
+from array import array
+
+
+class LazyProgram:
+    # Program store for large hex images: the file is memory-mapped and each word is parsed and decoded
+    # the first time the program counter (or a store over it) reaches it. Line offsets are found on
+    # demand, so startup only counts the lines. Indexed like MIPS.instructions.
+
+    def __init__(self, path, decode_word, batch=4096):
+        self.decode_word = decode_word
+        self.batch = batch
+        with open(path, "rb") as file:
+            # mmap refuses empty files.
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file.seek(0, 2) else b""
+        # mmap has no count(); newlines are counted a chunk at a time.
+        size = len(self.data)
+        self.length = sum(self.data[start:start + (1 << 20)].count(b"\n") for start in range(0, size, 1 << 20))
+        if size and self.data[size - 1:] != b"\n":
+            self.length += 1
+        # Start offset of every line scanned so far.
+        self.offsets = array("q", [0])
+        self.decoded = {}
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, address):
+        try:
+            return self.decoded[address]
+        except KeyError:
+            instruction = self.decoded[address] = self.decode_word(self.word(address))
+            return instruction
+
+    def __setitem__(self, address, instruction):
+        # Stores over code replace the instruction with None, as in the list-backed store.
+        self.decoded[address] = instruction
+
+    def word(self, address):
+        if not 0 <= address < self.length:
+            raise IndexError(address)
+        offsets = self.offsets
+        data = self.data
+        while len(offsets) <= address:
+            offsets.append(data.find(b"\n", offsets[-1]) + 1)
+        end = data.find(b"\n", offsets[address])
+        return int(data[offsets[address]:end if end >= 0 else len(data)], 16)
+
+    def decoded_count(self):
+        return len(self.decoded)
+
+    def write_listing(self, path):
+        # The assembly listing of the whole image, as write_assembly_code writes it for the eager loader.
+        # Lines are read through again and decoded without the cache, so the listing shows the loaded
+        # program even after stores replaced some of it.
+        decode_word = self.decode_word
+        with open(path, "w") as file:
+            if not self.data:
+                return
+            self.data.seek(0)
+            lines = []
+            for line in iter(self.data.readline, b""):
+                lines.append(str(decode_word(int(line, 16))) + "\n")
+                if len(lines) >= self.batch:
+                    file.write("".join(lines))
+                    lines.clear()
+            file.write("".join(lines))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class WordProgram:
+    # Program store over a sequence of words, None marking an overwritten slot. Like LazyProgram, each
+    # word is decoded on its first fetch; used to restore snapshots.
+
+    def __init__(self, words, decode_word):
+        self.words = words
+        self.decode_word = decode_word
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, address):
+        try:
+            return self.decoded[address]
+        except KeyError:
+            word = self.words[address]
+            instruction = self.decoded[address] = self.decode_word(word) if word is not None else None
+            return instruction
+
+    def __setitem__(self, address, instruction):
+        self.decoded[address] = instruction
+
+    def word(self, address):
+        return self.words[address]
+
+    def decoded_count(self):
+        return len(self.decoded)
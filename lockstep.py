@@ -0,0 +1,334 @@
+import numpy as np
+
+from alu import sign_extend16, to_signed
+from cfg import control_instructions
+from memory import WORD_ADDRESS_MASK
+from syscalls import EXIT, EXIT2, HEAP_START, READ_CHAR, READ_INT, READ_STRING, SBRK
+
+HI = 32
+LO = 33
+
+
+def wrap(values):
+    # alu.to_signed over an int64 array.
+    return ((values + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class LockstepEngine:
+    # Runs one decoded program over N machine states at once. Lane i has the register file regs[i]
+    # (34 slots, HI=32 and LO=33, as MIPS.regs) and the data words memory[i], indexed by word address
+    # like MIPS.load_word; the program is loaded at address 0, as simulate() does.
+    #
+    # Every step picks the lowest pc among the running lanes and executes that instruction as array
+    # operations over the lanes sitting on it, so lanes that split on a branch run their paths one
+    # after the other and join again where the paths meet.
+
+    # Method and instruction fields per operation, as MIPS.dispatch_operands.
+    operations = {
+        "add": ("add", ("first_reg", "second_reg", "dest_reg")),
+        "sub": ("sub", ("first_reg", "second_reg", "dest_reg")),
+        "slt": ("slt", ("first_reg", "second_reg", "dest_reg")),
+        "and": ("AND", ("first_reg", "second_reg", "dest_reg")),
+        "or": ("OR", ("first_reg", "second_reg", "dest_reg")),
+        "xor": ("XOR", ("first_reg", "second_reg", "dest_reg")),
+        "nor": ("NOR", ("first_reg", "second_reg", "dest_reg")),
+        "mfhi": ("mfhi", ("dest_reg",)),
+        "mflo": ("mflo", ("dest_reg",)),
+        "addu": ("add", ("first_reg", "second_reg", "dest_reg")),
+        "subu": ("sub", ("first_reg", "second_reg", "dest_reg")),
+        "mult": ("mult", ("first_reg", "second_reg")),
+        "multu": ("multu", ("first_reg", "second_reg")),
+        "div": ("div", ("first_reg", "second_reg")),
+        "divu": ("divu", ("first_reg", "second_reg")),
+        "sll": ("sll", ("first_reg", "dest_reg", "shamt")),
+        "srl": ("srl", ("first_reg", "dest_reg", "shamt")),
+        "sra": ("sra", ("first_reg", "dest_reg", "shamt")),
+        "sllv": ("sllv", ("first_reg", "second_reg", "dest_reg")),
+        "srlv": ("srlv", ("first_reg", "second_reg", "dest_reg")),
+        "srav": ("srav", ("first_reg", "second_reg", "dest_reg")),
+        "addi": ("addi", ("first_reg", "constant", "dest_reg")),
+        "slti": ("slti", ("first_reg", "constant", "dest_reg")),
+        "andi": ("andi", ("first_reg", "constant", "dest_reg")),
+        "ori": ("ori", ("first_reg", "constant", "dest_reg")),
+        "xori": ("xori", ("first_reg", "constant", "dest_reg")),
+        "addiu": ("addi", ("first_reg", "constant", "dest_reg")),
+        "jr": ("jr", ("first_reg",)),
+        "lui": ("lui", ("dest_reg", "constant")),
+        "lw": ("lw", ("first_reg", "second_reg", "constant")),
+        "sw": ("sw", ("first_reg", "second_reg", "constant")),
+        "bltz": ("bltz", ("first_reg", "constant")),
+        "beq": ("beq", ("first_reg", "second_reg", "constant")),
+        "bne": ("bne", ("first_reg", "second_reg", "constant")),
+        "lb": ("lb", ("first_reg", "second_reg", "constant")),
+        "sb": ("sb", ("first_reg", "second_reg", "constant")),
+        "j": ("j", ("constant",)),
+        "jal": ("jal", ("constant",)),
+        "syscall": ("syscall", ()),
+    }
+
+    def __init__(self, instructions, registers, memory=None, memory_words=1024):
+        # registers: N x 34 initial register files; $0 is forced to 0. memory: N x M initial data
+        # words, or None for M = memory_words zeroed words per lane. Every load and store of the program
+        # must stay below M, otherwise run() raises IndexError.
+        self.instructions = list(instructions)
+        self.regs = wrap(np.array(registers, dtype=np.int64))
+        if self.regs.ndim != 2 or self.regs.shape[1] != LO + 1:
+            raise ValueError(f"registers must be N x {LO + 1}, got {self.regs.shape}")
+        self.regs[:, 0] = 0
+        self.lanes = self.regs.shape[0]
+
+        if memory is None:
+            memory = np.zeros((self.lanes, memory_words), dtype=np.int64)
+        self.memory = wrap(np.array(memory, dtype=np.int64))
+        if self.memory.ndim != 2 or self.memory.shape[0] != self.lanes:
+            raise ValueError(f"memory must be {self.lanes} x M, got {self.memory.shape}")
+
+        self.program_counter = np.zeros(self.lanes, dtype=np.int64)
+        self.instruction_count = np.zeros(self.lanes, dtype=np.int64)
+        self.halted = np.zeros(self.lanes, dtype=bool)
+        self.heap_pointer = np.full(self.lanes, HEAP_START, dtype=np.int64)
+        self.lane_index = np.arange(self.lanes)
+        # Instructions present at each address; becomes a per-lane N x P table on the first store over
+        # the program, since sw/sb replace the instruction they hit in that lane only.
+        self.code = np.array([instruction is not None for instruction in self.instructions] + [False])
+        self.handlers = [self.bind(instruction) for instruction in self.instructions]
+
+    def bind(self, instruction):
+        if instruction is None or instruction.operation not in LockstepEngine.operations:
+            return self.skip
+        method, operands = LockstepEngine.operations[instruction.operation]
+        fields = [getattr(instruction, operand) for operand in operands]
+        fields = [field.code if operand.endswith("_reg") else field for operand, field in zip(operands, fields)]
+        handler = getattr(self, method)
+        if instruction.operation in control_instructions or instruction.operation == "syscall":
+            return lambda address, lanes: handler(address, lanes, *fields)
+
+        def step(address, lanes):
+            handler(lanes, *fields)
+            self.program_counter[lanes] = address + 1
+        return step
+
+    def run(self, max_steps=None):
+        # Runs every lane until it leaves the program or, with max_steps, after that many instructions.
+        # Afterwards halted tells, per lane, whether the program ran to its end.
+        idle = np.iinfo(np.int64).max
+        start = self.instruction_count.copy()
+        stopped = self.stopped(slice(None))
+        if max_steps is not None and max_steps <= 0:
+            stopped[:] = True
+        waiting = np.where(stopped, idle, self.program_counter)
+
+        while True:
+            address = int(waiting.min())
+            if address == idle: break
+            selected = np.flatnonzero(waiting == address)
+            lanes = slice(None) if len(selected) == self.lanes else selected
+
+            self.handlers[address](address, lanes)
+            self.instruction_count[lanes] += 1
+
+            stopped = self.stopped(lanes)
+            if max_steps is not None:
+                stopped |= self.instruction_count[lanes] - start[lanes] >= max_steps
+            waiting[lanes] = np.where(stopped, idle, self.program_counter[lanes])
+
+        self.halted = self.stopped(slice(None))
+
+    def stopped(self, lanes):
+        # Lanes whose pc is outside the program or on an instruction overwritten by data.
+        pc = self.program_counter[lanes]
+        outside = (pc < 0) | (pc >= len(self.instructions))
+        pc = np.where(outside, len(self.instructions), pc)
+        if self.code.ndim == 1:
+            return ~self.code[pc]
+        return ~self.code[self.lane_index[lanes], pc]
+
+    def registers(self, lane):
+        return [int(value) for value in self.regs[lane]]
+
+    def words(self, lane):
+        # {word address: value} of the non-zero data words of a lane.
+        return {int(address): int(self.memory[lane, address]) for address in np.flatnonzero(self.memory[lane])}
+
+    def render(self, lane):
+        # The lane's state in the MIPS.__str__ format, as the last line pair of a simulate() trace.
+        memory = ";".join(f"{address}:{value}" for address, value in sorted(self.words(lane).items()))
+        registers = ";".join(f"${i}={v}" for i, v in enumerate(self.registers(lane)[:HI]))
+        return f"MEM[{memory}]\nREGS[{registers}]"
+
+    def set(self, lanes, code, values):
+        # Writes to $zero are dropped.
+        if code:
+            self.regs[lanes, code] = values
+
+    def addresses(self, lanes, base, constant):
+        address = (self.regs[lanes, base] + sign_extend16(constant)) & WORD_ADDRESS_MASK
+        if len(address) and address.max() >= self.memory.shape[1]:
+            lane = self.lane_index[lanes][int(np.argmax(address >= self.memory.shape[1]))]
+            raise IndexError(f"lane {lane} accessed word {int(address.max())} beyond the "
+                             f"{self.memory.shape[1]} words of lockstep memory")
+        return self.lane_index[lanes], address
+
+    def invalidate_code(self, lanes, address):
+        # Stores over the program drop the instruction in the lanes that made them.
+        hit = address < len(self.instructions)
+        if not hit.any():
+            return
+        if self.code.ndim == 1:
+            self.code = np.tile(self.code, (self.lanes, 1))
+        self.code[lanes[hit], address[hit]] = False
+
+    def skip(self, address, lanes):
+        # Operations without a handler in MIPS (lbu) only advance the pc.
+        self.program_counter[lanes] = address + 1
+
+    def add(self, lanes, a, b, d):
+        self.set(lanes, d, wrap(self.regs[lanes, a] + self.regs[lanes, b]))
+
+    def sub(self, lanes, a, b, d):
+        self.set(lanes, d, wrap(self.regs[lanes, a] - self.regs[lanes, b]))
+
+    def slt(self, lanes, a, b, d):
+        self.set(lanes, d, self.regs[lanes, a] < self.regs[lanes, b])
+
+    def AND(self, lanes, a, b, d):
+        self.set(lanes, d, self.regs[lanes, a] & self.regs[lanes, b])
+
+    def OR(self, lanes, a, b, d):
+        self.set(lanes, d, self.regs[lanes, a] | self.regs[lanes, b])
+
+    def XOR(self, lanes, a, b, d):
+        self.set(lanes, d, self.regs[lanes, a] ^ self.regs[lanes, b])
+
+    def NOR(self, lanes, a, b, d):
+        self.set(lanes, d, ~(self.regs[lanes, a] | self.regs[lanes, b]))
+
+    def mfhi(self, lanes, d):
+        self.set(lanes, d, self.regs[lanes, HI])
+
+    def mflo(self, lanes, d):
+        self.set(lanes, d, self.regs[lanes, LO])
+
+    def mult(self, lanes, a, b):
+        # Signed 32 x 32 products fit in int64.
+        product = self.regs[lanes, a] * self.regs[lanes, b]
+        self.regs[lanes, HI] = product >> 32
+        self.regs[lanes, LO] = wrap(product)
+
+    def multu(self, lanes, a, b):
+        product = (self.regs[lanes, a] & 0xFFFFFFFF).astype(np.uint64) * (self.regs[lanes, b] & 0xFFFFFFFF).astype(np.uint64)
+        self.regs[lanes, HI] = wrap((product >> np.uint64(32)).astype(np.int64))
+        self.regs[lanes, LO] = wrap((product & np.uint64(0xFFFFFFFF)).astype(np.int64))
+
+    def divide(self, lanes, dividend, divisor):
+        # alu.divide per lane; a zero divisor leaves 0 in HI and LO, as MIPS.div does.
+        zero = divisor == 0
+        divisor = np.where(zero, 1, divisor)
+        quotient = np.abs(dividend) // np.abs(divisor)
+        quotient = np.where((dividend < 0) != (divisor < 0), -quotient, quotient)
+        remainder = dividend - quotient * divisor
+        self.regs[lanes, HI] = np.where(zero, 0, wrap(remainder))
+        self.regs[lanes, LO] = np.where(zero, 0, wrap(quotient))
+
+    def div(self, lanes, a, b):
+        self.divide(lanes, self.regs[lanes, a], self.regs[lanes, b])
+
+    def divu(self, lanes, a, b):
+        self.divide(lanes, self.regs[lanes, a] & 0xFFFFFFFF, self.regs[lanes, b] & 0xFFFFFFFF)
+
+    def sll(self, lanes, a, d, shamt):
+        self.set(lanes, d, wrap(self.regs[lanes, a] << shamt))
+
+    def srl(self, lanes, a, d, shamt):
+        self.set(lanes, d, wrap((self.regs[lanes, a] & 0xFFFFFFFF) >> shamt))
+
+    def sra(self, lanes, a, d, shamt):
+        self.set(lanes, d, self.regs[lanes, a] >> shamt)
+
+    def sllv(self, lanes, a, b, d):
+        self.set(lanes, d, wrap(self.regs[lanes, a] << (self.regs[lanes, b] & 0x1F)))
+
+    def srlv(self, lanes, a, b, d):
+        self.set(lanes, d, wrap((self.regs[lanes, a] & 0xFFFFFFFF) >> (self.regs[lanes, b] & 0x1F)))
+
+    def srav(self, lanes, a, b, d):
+        self.set(lanes, d, self.regs[lanes, a] >> (self.regs[lanes, b] & 0x1F))
+
+    def addi(self, lanes, a, constant, d):
+        self.set(lanes, d, wrap(self.regs[lanes, a] + sign_extend16(constant)))
+
+    def slti(self, lanes, a, constant, d):
+        self.set(lanes, d, self.regs[lanes, a] < sign_extend16(constant))
+
+    def andi(self, lanes, a, constant, d):
+        self.set(lanes, d, self.regs[lanes, a] & constant)
+
+    def ori(self, lanes, a, constant, d):
+        self.set(lanes, d, self.regs[lanes, a] | constant)
+
+    def xori(self, lanes, a, constant, d):
+        self.set(lanes, d, self.regs[lanes, a] ^ constant)
+
+    def lui(self, lanes, d, constant):
+        self.set(lanes, d, to_signed(constant << 16))
+
+    def lw(self, lanes, a, b, constant):
+        rows, address = self.addresses(lanes, b, constant)
+        self.set(lanes, a, self.memory[rows, address])
+
+    def lb(self, lanes, a, b, constant):
+        # lb reads the most significant byte of the word, as MIPS.load_byte does.
+        rows, address = self.addresses(lanes, b, constant)
+        self.set(lanes, a, ((self.memory[rows, address] >> 24) + 0x80 & 0xFF) - 0x80)
+
+    def sw(self, lanes, a, b, constant):
+        rows, address = self.addresses(lanes, b, constant)
+        self.memory[rows, address] = self.regs[lanes, a]
+        self.invalidate_code(rows, address)
+
+    def sb(self, lanes, a, b, constant):
+        rows, address = self.addresses(lanes, b, constant)
+        self.memory[rows, address] = wrap((self.memory[rows, address] & 0xFFFFFF) | (self.regs[lanes, a] & 0xFF) << 24)
+        self.invalidate_code(rows, address)
+
+    def jr(self, address, lanes, a):
+        self.program_counter[lanes] = self.regs[lanes, a]
+
+    def bltz(self, address, lanes, a, constant):
+        taken = self.regs[lanes, a] < 0
+        self.program_counter[lanes] = np.where(taken, address + sign_extend16(constant), address + 1)
+
+    def beq(self, address, lanes, a, b, constant):
+        taken = self.regs[lanes, a] == self.regs[lanes, b]
+        self.program_counter[lanes] = np.where(taken, address + sign_extend16(constant), address + 1)
+
+    def bne(self, address, lanes, a, b, constant):
+        taken = self.regs[lanes, a] != self.regs[lanes, b]
+        self.program_counter[lanes] = np.where(taken, address + sign_extend16(constant), address + 1)
+
+    def j(self, address, lanes, constant):
+        self.program_counter[lanes] = constant
+
+    def jal(self, address, lanes, constant):
+        self.regs[lanes, 31] = address + 1
+        self.program_counter[lanes] = constant
+
+    def syscall(self, address, lanes):
+        # Lanes have no console: output is dropped and input is empty, as in a simulate() run with the
+        # default syscalls.HostIO. sbrk and exit work as in syscalls.handle_syscall.
+        service = self.regs[lanes, 2]
+        growing = service == SBRK
+        if growing.any():
+            heap = self.heap_pointer[lanes]
+            self.regs[lanes, 2] = np.where(growing, heap, service)
+            self.heap_pointer[lanes] = np.where(growing, wrap(heap + self.regs[lanes, 4]), heap)
+        # At the end of the input read_int gives 0, read_char -1 and read_string an empty string.
+        self.regs[lanes, 2] = np.where(service == READ_INT, 0, np.where(service == READ_CHAR, -1, self.regs[lanes, 2]))
+        reading = (service == READ_STRING) & (self.regs[lanes, 5] > 0)
+        if reading.any():
+            selected = self.lane_index[lanes][reading]
+            rows, words = self.addresses(selected, 4, 0)
+            self.memory[rows, words] &= 0xFFFFFF
+            self.invalidate_code(rows, words)
+        leaving = (service == EXIT) | (service == EXIT2)
+        self.program_counter[lanes] = np.where(leaving, len(self.instructions), address + 1)
@@ -1,5 +1,36 @@
+import gc
+from array import array
+from contextlib import nullcontext
+from functools import partial
 from operator import xor
 
+from alu import divide, sign_extend16, split_product, to_signed, to_unsigned
+from debugger import Debugger
+from fastforward import LoopForwarder
+from jit import BlockCompiler
+from loader import LazyProgram, WordProgram
+from memory import PagedMemory, WORD_ADDRESS_MASK
+from parallel_decode import decode_parallel
+from profiler import Profiler
+from snapshot import Snapshot
+from syscalls import HEAP_START, handle_syscall
+from timing import TimingModel
+from tracing import BINARY_TRACE_MODES, open_trace
+
+
+def int_table(binary_dict, width):
+    # Converte um dicionário indexado por strings binárias numa lista indexada pelo valor inteiro do campo.
+    table = [None] * (1 << width)
+    for key, value in binary_dict.items():
+        table[int(key, 2)] = value
+    return table
+
+
+def code_table(binary_dict):
+    # O inverso: o valor inteiro do campo indexado pelo nome da operação.
+    return {value: int(key, 2) for key, value in binary_dict.items()}
+
+
 class AssemblyInstruction:
     def __init__(self, operation, reg_first=None, reg_second=None, reg_dest=None, constant=None, shamt=None):
         self.operation = operation
@@ -13,26 +44,26 @@ class AssemblyInstruction:
         address_access_instructions = ["lb", "lbu", "sb", "lw", "sw"]
         representation = f"{self.operation}"
         if representation in address_access_instructions:
-            if self.first_reg is not None:
+            if self.first_reg is not None and self.first_reg.code:
                 representation = representation + f" ${self.first_reg.code},"
 
             if self.constant is not None:
                 representation = representation + f" {self.constant}"
 
-            if self.second_reg is not None:
+            if self.second_reg is not None and self.second_reg.code:
                 representation = representation + f"(${self.second_reg.code})"
 
         else:
-            if self.dest_reg is not None:
+            if self.dest_reg is not None and self.dest_reg.code:
                 representation = representation + f" ${self.dest_reg.code},"
 
-            if self.first_reg is not None:
+            if self.first_reg is not None and self.first_reg.code:
                 representation = representation + f" ${self.first_reg.code},"
 
-            if self.second_reg is not None:
+            if self.second_reg is not None and self.second_reg.code:
                 representation = representation + f" ${self.second_reg.code},"
 
-            if self.shamt is not None:
+            if self.shamt:
                 representation = representation + f" {self.shamt},"
 
             if self.constant is not None:
@@ -45,59 +76,142 @@ class AssemblyInstruction:
 
 class MIPS:
 
+    # Register file layout: general purpose registers 0-31, then HI and LO in fixed slots.
+    HI = 32
+    LO = 33
+
+    # Bumped whenever decode_word or AssemblyInstruction.__str__ changes; part of the decode_cache key.
+    decoder_version = 1
+
+    # (Reg_dict key, assembly_name, preserveValue, reserved) for each register file slot.
+    register_table = [
+        ("00000", "zero", None, False),
+        ("00001", "at", False, False),
+        ("00010", "v0", False, False),
+        ("00011", "v1", False, False),
+        ("00100", "a0", False, False),
+        ("00101", "a1", False, False),
+        ("00110", "a2", False, False),
+        ("00111", "a3", False, False),
+        ("01000", "t0", False, False),
+        ("01001", "t1", False, False),
+        ("01010", "t2", False, False),
+        ("01011", "t3", False, False),
+        ("01100", "t4", False, False),
+        ("01101", "t5", False, False),
+        ("01110", "t6", False, False),
+        ("01111", "t7", False, False),
+        ("10000", "s0", True, False),
+        ("10001", "s1", True, False),
+        ("10010", "s2", True, False),
+        ("10011", "s3", True, False),
+        ("10100", "s4", True, False),
+        ("10101", "s5", True, False),
+        ("10110", "s6", True, False),
+        ("10111", "s7", True, False),
+        ("11000", "t8", False, False),
+        ("11001", "t9", False, False),
+        ("11010", "k0", False, True),
+        ("11011", "k1", False, True),
+        ("11100", "gp", True, False),
+        ("11101", "sp", True, False),
+        ("11110", "fp", True, False),
+        ("11111", "ra", False, False),
+        ("HI", "hi", True, True),
+        ("LO", "lo", True, True),
+    ]
+
     class Register:
-        def __init__(self, assembly_name, code, preserve_value, reserved):
-            self.assembly_name = assembly_name
-            self.code = code
-            self.value = 0
-            self.preserveValue = preserve_value
-            self.reserved = reserved
+        # View of one slot of MIPS.regs; the name and flags come from MIPS.register_table.
+        __slots__ = ("regs", "index")
+
+        def __init__(self, regs, index):
+            self.regs = regs
+            self.index = index
+
+        @property
+        def value(self):
+            return self.regs[self.index]
+
+        @value.setter
+        def value(self, value):
+            self.regs[self.index] = value
+
+        @property
+        def code(self):
+            return self.index if self.index < MIPS.HI else None
+
+        @property
+        def assembly_name(self):
+            return MIPS.register_table[self.index][1]
+
+        @property
+        def preserveValue(self):
+            return MIPS.register_table[self.index][2]
+
+        @property
+        def reserved(self):
+            return MIPS.register_table[self.index][3]
 
         def __str__(self):
             representation = f"${self.code}={self.value}"
             return representation
 
+    class ZeroRegister(Register):
+        # $zero is hard-wired: writes are discarded.
+        __slots__ = ()
+
+        @property
+        def value(self):
+            return 0
+
+        @value.setter
+        def value(self, value):
+            pass
+
     def __init__(self):
-        self.Reg_dict = {
-            "00000": MIPS.Register("zero", 0, None, False),
-            "00001": MIPS.Register("at", 1, False, False),
-            "00010": MIPS.Register("v0", 2, False, False),
-            "00011": MIPS.Register("v1", 3, False, False),
-            "00100": MIPS.Register("a0", 4, False, False),
-            "00101": MIPS.Register("a1", 5, False, False),
-            "00110": MIPS.Register("a2", 6, False, False),
-            "00111": MIPS.Register("a3", 7, False, False),
-            "01000": MIPS.Register("t0", 8, False, False),
-            "01001": MIPS.Register("t1", 9, False, False),
-            "01010": MIPS.Register("t2", 10, False, False),
-            "01011": MIPS.Register("t3", 11, False, False),
-            "01100": MIPS.Register("t4", 12, False, False),
-            "01101": MIPS.Register("t5", 13, False, False),
-            "01110": MIPS.Register("t6", 14, False, False),
-            "01111": MIPS.Register("t7", 15, False, False),
-            "10000": MIPS.Register("s0", 16, True, False),
-            "10001": MIPS.Register("s1", 17, True, False),
-            "10010": MIPS.Register("s2", 18, True, False),
-            "10011": MIPS.Register("s3", 19, True, False),
-            "10100": MIPS.Register("s4", 20, True, False),
-            "10101": MIPS.Register("s5", 21, True, False),
-            "10110": MIPS.Register("s6", 22, True, False),
-            "10111": MIPS.Register("s7", 23, True, False),
-            "11000": MIPS.Register("t8", 24, False, False),
-            "11001": MIPS.Register("t9", 25, False, False),
-            "11010": MIPS.Register("k0", 26, False, True),
-            "11011": MIPS.Register("k1", 27, False, True),
-            "11100": MIPS.Register("gp", 28, True, False),
-            "11101": MIPS.Register("sp", 29, True, False),
-            "11110": MIPS.Register("fp", 30, True, False),
-            "11111": MIPS.Register("ra", 31, False, False),
-            "HI": MIPS.Register("hi", None, True, True),
-            "LO": MIPS.Register("lo", None, True, True)
-        }
+        # 34 signed 32-bit slots (HI=32, LO=33); the ALU wraps every result, so each value fits.
+        self.regs = array("i", bytes(4 * 34))
+        self.register_views = None
+        self.register_dict = None
+        self.reset()
+
+    def reset(self):
+        # Back to the state of a new machine. regs is cleared in place, so the register views (and the
+        # decoder using them) survive; the server reuses one machine for many jobs this way.
+        self.regs[:] = array("i", bytes(4 * 34))
         self.assembly_instructions = []
-        self.memory = [0 for i in range(0, 127)]
+        # Data lives in a paged, byte-addressable memory; decoded instructions live in their own store,
+        # indexed like program_counter. Both use word addresses (see load_word).
+        self.memory = PagedMemory()
+        self.instructions = []
         self.memory_pointer = 0
         self.program_counter = 0
+        self.instruction_count = 0
+        # Next address sbrk hands out, and the syscall console (a syscalls.HostIO, made on first use).
+        self.heap_pointer = HEAP_START
+        self.host = None
+        self.halted = False
+        self.handlers = None
+        self.block_compiler = None
+        self.loop_forwarder = None
+        self.profiler = None
+        self.timing = None
+        self.debugger = None
+
+    def build_register_views(self):
+        # The Register views are only built once something asks for them (decoding, Reg_dict users).
+        views = [MIPS.ZeroRegister(self.regs, 0)]
+        views += [MIPS.Register(self.regs, index) for index in range(1, len(MIPS.register_table))]
+        self.register_views = views
+        self.register_dict = {entry[0]: view for entry, view in zip(MIPS.register_table, views)}
+        return views
+
+    @property
+    def Reg_dict(self):
+        if self.register_views is None:
+            self.build_register_views()
+        return self.register_dict
 
     R_fcode_dict = {
         "100000": "add",
@@ -148,17 +262,22 @@ class MIPS:
         "000011": "jal"
     }
 
+    R_funct_table = int_table(R_fcode_dict, 6)
+    I_opcode_table = int_table(I_opcode_dict, 6)
+    J_opcode_table = int_table(J_opcode_dict, 6)
+    R_funct_codes = code_table(R_fcode_dict)
+    I_opcode_codes = code_table(I_opcode_dict)
+    J_opcode_codes = code_table(J_opcode_dict)
+
+    address_access_instructions = {"lb", "lbu", "sb", "lw", "sw"}
+    conditional_instructions = {"bltz", "beq", "bne"}
+    shift_with_regs_instructions = {"sllv", "srlv", "srav"}
+
     def __str__(self):
         representation = "MEM"
-        representation = representation + str([f"{i}:{v}" for i, v in enumerate(self.memory) if v != 0 and not isinstance(v, AssemblyInstruction)]).replace(",", ";").replace(" ", "").replace("'", "") + "\n"
+        representation = representation + "[" + self.memory.dump() + "]\n"
         representation = representation + "REGS["
-
-        for key in self.Reg_dict.keys():
-            if key in ["HI", "LO"]:
-                continue
-            representation = representation + f"{self.Reg_dict[key]};"
-
-        representation = representation[:-1]
+        representation = representation + ";".join([f"${i}={v}" for i, v in enumerate(self.regs[:MIPS.HI])])
         representation = representation + "]"
 
         return representation
@@ -185,6 +304,11 @@ class MIPS:
 
         return binary_instructions
 
+    def hex_to_words(self, path):
+        # Este método retorna uma lista com as instruções do arquivo convertidas para inteiros de 32 bits.
+        with open(path, "r") as file:
+            return [int(instruction, 16) for instruction in file.read().splitlines()]
+
     def binary_to_assembly(self, b_instructions):
         for bin in b_instructions:
             if bin[:6] == "000000":
@@ -193,10 +317,94 @@ class MIPS:
                 self.assembly_instructions.append(self.translate_J_instruction(bin))
             else:
                 self.assembly_instructions.append(self.translate_I_instruction(bin))
-        with open("output/assembly_code.txt", "w") as file:
+        self.write_assembly_code()
+
+    def words_to_assembly(self, words, path="output/assembly_code.txt"):
+        self.assembly_instructions.extend(self.decode_words(words))
+        if path is not None:
+            self.write_assembly_code(path)
+
+    def write_assembly_code(self, path="output/assembly_code.txt"):
+        with open(path, "w") as file:
             for instruction in self.assembly_instructions:
                 file.write(str(instruction) + "\n")
 
+    def decode_words(self, words):
+        # The decoder allocates one object per word and never builds reference cycles, so the cyclic
+        # garbage collector is paused instead of rescanning the growing list on every generation-0 pass.
+        decode_word = self.decode_word
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return [decode_word(word) for word in words]
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def decode_word(self, word):
+        # Same fields as translate_*_instruction, read with shifts and masks instead of slicing a binary
+        # string. Register fields equal to 0 decode to $zero instead of None; __str__ omits them either way.
+        opcode = word >> 26
+        regs = self.register_views or self.build_register_views()
+
+        if opcode == 0:
+            funct = word & 0x3F
+            operation = MIPS.R_funct_table[funct]
+            if operation is None:
+                raise KeyError(f"{funct:06b}")
+
+            rs = regs[(word >> 21) & 0x1F]
+            rt = regs[(word >> 16) & 0x1F]
+            rd = regs[(word >> 11) & 0x1F]
+            shamt = (word >> 6) & 0x1F
+            if operation in MIPS.shift_with_regs_instructions:
+                return AssemblyInstruction(operation, rt, rs, rd)
+            if operation in ("sll", "srl", "sra"):
+                return AssemblyInstruction(operation, rt, rs, rd, shamt=shamt)
+            return AssemblyInstruction(operation, rs, rt, rd, shamt=shamt)
+
+        elif opcode == 2 or opcode == 3:
+            # translate_J_instruction reads bits [7:32], so the target is 25 bits wide.
+            return AssemblyInstruction(MIPS.J_opcode_table[opcode], constant=word & 0x1FFFFFF)
+
+        operation = MIPS.I_opcode_table[opcode]
+        if operation is None:
+            raise KeyError(f"{opcode:06b}")
+
+        rs = regs[(word >> 21) & 0x1F]
+        rt = regs[(word >> 16) & 0x1F]
+        constant = word & 0xFFFF
+        if operation in MIPS.address_access_instructions:
+            return AssemblyInstruction(operation, rt, rs, constant=constant)
+        if operation in MIPS.conditional_instructions:
+            return AssemblyInstruction(operation, rs, rt, constant=constant)
+        return AssemblyInstruction(operation, rs, reg_dest=rt, constant=constant)
+
+    def encode_instruction(self, instruction):
+        # The inverse of decode_word: a word that decodes back to the same instruction.
+        def code(register):
+            return register.code if register is not None else 0
+
+        operation = instruction.operation
+        if operation in MIPS.R_funct_codes:
+            if operation in MIPS.shift_with_regs_instructions or operation in ("sll", "srl", "sra"):
+                rs, rt = code(instruction.second_reg), code(instruction.first_reg)
+            else:
+                rs, rt = code(instruction.first_reg), code(instruction.second_reg)
+            return ((rs << 21) | (rt << 16) | (code(instruction.dest_reg) << 11) | ((instruction.shamt or 0) << 6)
+                    | MIPS.R_funct_codes[operation])
+
+        if operation in MIPS.J_opcode_codes:
+            return (MIPS.J_opcode_codes[operation] << 26) | instruction.constant
+
+        if operation in MIPS.address_access_instructions:
+            rs, rt = code(instruction.second_reg), code(instruction.first_reg)
+        elif operation in MIPS.conditional_instructions:
+            rs, rt = code(instruction.first_reg), code(instruction.second_reg)
+        else:
+            rs, rt = code(instruction.first_reg), code(instruction.dest_reg)
+        return (MIPS.I_opcode_codes[operation] << 26) | (rs << 21) | (rt << 16) | instruction.constant
+
     def translate_J_instruction(self, b_instruction):
         assembly_instruction = AssemblyInstruction(MIPS.J_opcode_dict[b_instruction[0:6]])
         assembly_instruction.constant = int(b_instruction[7:32], 2)
@@ -305,21 +513,242 @@ class MIPS:
 
     def write_in_memory(self, value, address=None):
         if address is None:
-            self.memory[self.memory_pointer] = value
+            address = self.memory_pointer
             self.memory_pointer += 1
-        else:
-            self.memory[address] = value
 
-    def simulate(self, input_path, output_path):
-        binary = self.hex_to_binary_instructions(input_path)
-        self.binary_to_assembly(binary)
-        file = open(output_path, "w")
+        if isinstance(value, AssemblyInstruction):
+            if address >= len(self.instructions):
+                self.instructions.extend([None] * (address + 1 - len(self.instructions)))
+            self.instructions[address] = value
+        else:
+            self.store_word(address, value)
+
+    # Addresses produced by the program (base register + offset, program_counter) count words, as the
+    # original list-backed memory did. Word n occupies bytes 4n..4n+3 of the 32-bit address space and
+    # lb/sb reach its most significant byte.
+    def load_word(self, address):
+        return self.memory.load_word((address & WORD_ADDRESS_MASK) << 2)
+
+    def load_byte(self, address):
+        return self.memory.load_byte((address & WORD_ADDRESS_MASK) << 2)
+
+    def store_word(self, address, value):
+        # Returns True when the store dropped compiled code (see invalidate_code).
+        address &= WORD_ADDRESS_MASK
+        self.memory.store_word(address << 2, value)
+        if address < len(self.instructions) and self.instructions[address] is not None:
+            return self.invalidate_code(address)
+        return False
+
+    def store_byte(self, address, value):
+        address &= WORD_ADDRESS_MASK
+        self.memory.store_byte(address << 2, value)
+        if address < len(self.instructions) and self.instructions[address] is not None:
+            return self.invalidate_code(address)
+        return False
+
+    def simulate(self, input_path, output_path, dispatch="table", trace="full", trace_every=1, hot_threshold=50,
+                 max_steps=None, assembly_path="output/assembly_code.txt", loader="eager", profile=None,
+                 decode_cache=None, timing=None, fast_forward=False, host=None, debugger=None, decode_workers=None):
+        # Loads the program and runs it (see run for the other arguments).
+        # loader: "eager" decodes the whole file before running; "lazy" maps it and decodes each word on
+        # its first fetch (see loader.LazyProgram), writing the listing only after the run.
+        # "parallel" parses and lists chunks of the file in decode_workers processes (see
+        # parallel_decode.decode_parallel) and decodes each word on its first fetch (loader.WordProgram);
+        # it pays off for multi-million-line images.
+        # decode_cache: a decode_cache.DecodeCache the eager loader reads the decoded program and its
+        # listing from, or stores them in on a miss.
+        if loader == "lazy":
+            self.instructions = LazyProgram(input_path, self.decode_word)
+            self.memory_pointer = len(self.instructions)
+        elif loader == "parallel":
+            self.instructions = WordProgram(decode_parallel(self, input_path, assembly_path, decode_workers),
+                                            self.decode_word)
+            self.memory_pointer = len(self.instructions)
+        elif loader == "eager":
+            if decode_cache is not None:
+                decode_cache.load(self, input_path, assembly_path)
+            else:
+                words = self.hex_to_words(input_path)
+                self.words_to_assembly(words, assembly_path)
 
-        for instruction in self.assembly_instructions:
-            self.write_in_memory(instruction)
+            for instruction in self.assembly_instructions:
+                self.write_in_memory(instruction)
+        else:
+            raise ValueError(f"unknown loader: {loader}")
+
+        self.run(output_path, dispatch, trace, trace_every, hot_threshold, max_steps, profile, timing=timing,
+                 fast_forward=fast_forward, host=host, debugger=debugger)
+
+        if loader == "lazy" and assembly_path is not None:
+            self.instructions.write_listing(assembly_path)
+
+    def run(self, output_path, dispatch="table", trace="full", trace_every=1, hot_threshold=50, max_steps=None,
+            profile=None, append=False, timing=None, fast_forward=False, host=None, debugger=None):
+        # Runs the loaded program from program_counter.
+        # trace: "full" (MEM/REGS after every instruction), "delta", "binary", "digest" (state digest
+        # checkpoints, see tracing.DigestTrace) or "off" (final state only); True and False stand for "full"
+        # and "off". trace_every=N records every N-th instruction.
+        # max_steps stops the run after that many instructions; afterwards instruction_count holds the
+        # number executed and halted tells whether the program ran to its end.
+        # profile: True or a profiler.Profiler runs the instrumented loop instead; the profile is left in
+        # self.profiler.
+        # append: add to the trace in output_path instead of replacing it (see resume). output_path may
+        # also be an open file, which is written to and left open.
+        # timing: True or a timing.TimingModel runs the loop under the cache and pipeline model instead;
+        # the model is left in self.timing. It cannot be combined with profile.
+        # fast_forward: with the trace off, run register-only counted loops a whole batch of iterations
+        # at a time (see fastforward.LoopForwarder) instead of using the table or jit dispatch. Traced,
+        # profiled, timed and debugged runs step every instruction and ignore it.
+        # host: the syscalls.HostIO the program's syscalls print to and read from (default: stdout and no
+        # input); its pending output is written when the run ends.
+        # debugger: a debugger.Debugger (True for an empty one) whose breakpoints and watchpoints stop the
+        # run early; its stop attribute says why the run ended. Like profile and timing it replaces the
+        # run loop, but only instructions with a check attached pay for it.
+        if trace is True or trace is False:
+            trace = "full" if trace else "off"
+
+        if host is not None:
+            self.host = host
+
+        try:
+            mode = ("a" if append else "w") + ("b" if trace in BINARY_TRACE_MODES else "")
+            with open(output_path, mode) if not hasattr(output_path, "write") else nullcontext(output_path) as file:
+                if dispatch == "chain":
+                    if (trace != "full" or trace_every != 1 or max_steps is not None or profile or timing
+                            or fast_forward or debugger):
+                        raise ValueError("chain dispatch always runs to the end with the full trace")
+                    self.run_chain(file)
+
+                elif dispatch in ("table", "jit"):
+                    if bool(profile) + bool(timing) + bool(debugger) > 1:
+                        raise ValueError("profile, timing and debugger each replace the run loop; use one at a time")
+                    tracer = open_trace(trace, file, self, trace_every, append)
+                    if timing:
+                        self.timing = TimingModel() if timing is True else timing
+                        self.timing.run(self, tracer, max_steps)
+                    elif profile:
+                        # Profiling swaps the whole loop, so unprofiled runs pay nothing for it.
+                        self.profiler = Profiler() if profile is True else profile
+                        self.profiler.run(self, tracer, max_steps)
+                    elif debugger:
+                        self.debugger = Debugger() if debugger is True else debugger
+                        self.debugger.run(self, tracer, max_steps)
+                    elif fast_forward and trace == "off":
+                        self.loop_forwarder = LoopForwarder(self)
+                        self.loop_forwarder.run(max_steps)
+                    elif dispatch == "jit" and trace == "off":
+                        self.block_compiler = BlockCompiler(self, hot_threshold)
+                        self.block_compiler.run(max_steps)
+                    else:
+                        # Compiled blocks have no per-instruction trace, so traced runs use the interpreter.
+                        self.run_table(tracer, max_steps)
+                    self.halted = self.instruction_at(self.program_counter) is None
+                    tracer.finish()
+
+                else:
+                    raise ValueError(f"unknown dispatch mode: {dispatch}")
+        finally:
+            if self.host is not None:
+                self.host.flush()
+
+    def snapshot(self):
+        # Machine state for restore/resume; see snapshot.Snapshot.
+        return Snapshot.capture(self)
+
+    def restore(self, snapshot):
+        snapshot.restore(self)
+        return self
+
+    @classmethod
+    def resume(cls, snapshot, output_path, dispatch="table", trace="full", trace_every=1, hot_threshold=50,
+               max_steps=None, profile=None, append=False, timing=None, fast_forward=False, host=None,
+               debugger=None):
+        # Continues a snapshot in a fresh machine. With append=True the trace goes on at the end of the
+        # one in output_path, which for delta and binary traces must be the run the snapshot was taken
+        # from, traced up to its last step (their records only hold changes).
+        mips = cls()
+        snapshot.restore(mips)
+        mips.run(output_path, dispatch, trace, trace_every, hot_threshold, max_steps, profile, append, timing,
+                 fast_forward, host, debugger)
+        return mips
+
+    def instruction_at(self, address):
+        if 0 <= address < len(self.instructions):
+            return self.instructions[address]
+        return None
+
+    def run_table(self, tracer, max_steps=None):
+        handlers = self.bind_instructions()
+        count = len(handlers)
+        step = tracer.step
+        skip = tracer.skip
+        # Counts down to 0 when budgeted; -1 never reaches it.
+        budget = remaining = -1 if max_steps is None else max_steps
+        line = pc = None
+
+        try:
+            while remaining and 0 <= self.program_counter < count:
+                bound = handlers[self.program_counter] or self.bind_at(self.program_counter)
+                if bound is None: break
+                remaining -= 1
+                line, handler = bound
+                pc = self.program_counter
+
+                if handler is None:
+                    self.program_counter += 1
+                    skip(line, pc)
+                    continue
+
+                handler()
 
-        while isinstance(self.memory[self.program_counter], AssemblyInstruction):
-            instruction:AssemblyInstruction = self.memory[self.program_counter]
+                self.program_counter += 1
+                step(line, pc)
+                line = None
+        except BaseException:
+            if line is not None:
+                tracer.interrupted(line, pc)
+            raise
+        finally:
+            self.instruction_count += budget - remaining
+
+    def bind_instructions(self):
+        # Each instruction gets a pre-bound record (trace line, handler) so a step is a single call.
+        # Records are made by bind_at on the first fetch (False until then) and dropped with the
+        # instruction (None) when sw/sb overwrite its address.
+        handlers = [False] * len(self.instructions)
+        self.handlers = handlers
+        return handlers
+
+    def bind_at(self, address):
+        instruction = self.instructions[address]
+        bound = self.handlers[address] = self.bind_instruction(instruction) if instruction is not None else None
+        return bound
+
+    def invalidate_code(self, address):
+        # Data written over an instruction replaces it, as in the original shared memory list.
+        # Returns True when a compiled block covering the address was dropped.
+        self.instructions[address] = None
+        if self.handlers is not None:
+            self.handlers[address] = None
+        if self.loop_forwarder is not None:
+            self.loop_forwarder.invalidate(address)
+        if self.block_compiler is not None:
+            return self.block_compiler.invalidate(address)
+        return False
+
+    def bind_instruction(self, instruction):
+        line = str(instruction) + "\n"
+        if instruction.operation not in MIPS.dispatch_operands:
+            return line, None
+
+        method, operands = MIPS.dispatch_operands[instruction.operation]
+        handler = partial(getattr(self, method), *[getattr(instruction, operand) for operand in operands])
+        return line, handler
+
+    def run_chain(self, file):
+        while self.instruction_at(self.program_counter) is not None:
+            instruction:AssemblyInstruction = self.instructions[self.program_counter]
             file.write(str(instruction)+"\n")
 
             if instruction.operation == "add":
@@ -398,24 +827,71 @@ class MIPS:
                 self.j(instruction.constant)
             elif instruction.operation == "jal":
                 self.jal(instruction.constant)
+            elif instruction.operation == "syscall":
+                self.syscall()
 
             else:
                 self.program_counter += 1
                 continue
 
             self.program_counter += 1
-            if self.program_counter >= len(self.memory): break
             file.write(str(self)+"\n")
 
+    # Reference method and instruction fields for each operation, in the same order as run_chain.
+    dispatch_operands = {
+        "add": ("add", ("first_reg", "second_reg", "dest_reg")),
+        "sub": ("sub", ("first_reg", "second_reg", "dest_reg")),
+        "slt": ("slt", ("first_reg", "second_reg", "dest_reg")),
+        "and": ("AND", ("first_reg", "second_reg", "dest_reg")),
+        "or": ("OR", ("first_reg", "second_reg", "dest_reg")),
+        "xor": ("XOR", ("first_reg", "second_reg", "dest_reg")),
+        "nor": ("NOR", ("first_reg", "second_reg", "dest_reg")),
+        "mfhi": ("mfhi", ("dest_reg",)),
+        "mflo": ("mflo", ("dest_reg",)),
+        "addu": ("addu", ("first_reg", "second_reg", "dest_reg")),
+        "subu": ("subu", ("first_reg", "second_reg", "dest_reg")),
+        "mult": ("mult", ("first_reg", "second_reg")),
+        "multu": ("multu", ("first_reg", "second_reg")),
+        "div": ("div", ("first_reg", "second_reg")),
+        "divu": ("divu", ("first_reg", "second_reg")),
+        "sll": ("sll", ("first_reg", "dest_reg", "shamt")),
+        "srl": ("srl", ("first_reg", "dest_reg", "shamt")),
+        "sra": ("sra", ("first_reg", "dest_reg", "shamt")),
+        "sllv": ("sllv", ("first_reg", "second_reg", "dest_reg")),
+        "srlv": ("srlv", ("first_reg", "second_reg", "dest_reg")),
+        "srav": ("srav", ("first_reg", "second_reg", "dest_reg")),
+        "addi": ("addi", ("first_reg", "constant", "dest_reg")),
+        "slti": ("slti", ("first_reg", "constant", "dest_reg")),
+        "andi": ("andi", ("first_reg", "constant", "dest_reg")),
+        "ori": ("ori", ("first_reg", "constant", "dest_reg")),
+        "xori": ("xori", ("first_reg", "constant", "dest_reg")),
+        "addiu": ("addiu", ("first_reg", "constant", "dest_reg")),
+        "jr": ("jr", ("first_reg",)),
+        "lui": ("lui", ("dest_reg", "constant")),
+        "lw": ("lw", ("first_reg", "second_reg", "constant")),
+        "sw": ("sw", ("first_reg", "second_reg", "constant")),
+        "bltz": ("bltz", ("first_reg", "constant")),
+        "beq": ("beq", ("first_reg", "second_reg", "constant")),
+        "bne": ("bne", ("first_reg", "second_reg", "constant")),
+        "lb": ("lb", ("first_reg", "second_reg", "constant")),
+        "sb": ("sb", ("first_reg", "second_reg", "constant")),
+        "j": ("j", ("constant",)),
+        "jal": ("jal", ("constant",)),
+        "syscall": ("syscall", ()),
+    }
+
+    # Registers hold signed 32-bit values: every result wraps through to_signed. Immediates are
+    # decoded as unsigned 16-bit fields and sign-extended here where the instruction calls for it.
+
     def add(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = first_reg.value + second_reg.value
+        dest_reg.value = to_signed(first_reg.value + second_reg.value)
 
     def sub(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = first_reg.value - second_reg.value
+        dest_reg.value = to_signed(first_reg.value - second_reg.value)
 
     def slt(self, first_reg, second_reg, dest_reg):
         if first_reg.value < second_reg.value:
-            dest_reg.value = 0
+            dest_reg.value = 1
         else:
             dest_reg.value = 0
 
@@ -432,72 +908,70 @@ class MIPS:
         dest_reg.value = ~(first_reg.value|second_reg.value)
 
     def mfhi(self, dest_reg):
-        dest_reg.value = self.Reg_dict["HI"].value
+        dest_reg.value = self.regs[MIPS.HI]
 
     def mflo(self, dest_reg):
-        dest_reg.value = self.Reg_dict["LO"].value
+        dest_reg.value = self.regs[MIPS.LO]
 
     def addu(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = abs(first_reg.value) + abs(second_reg.value)
+        dest_reg.value = to_signed(first_reg.value + second_reg.value)
 
     def subu(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = abs(first_reg.value) - abs(second_reg.value)
+        dest_reg.value = to_signed(first_reg.value - second_reg.value)
 
     def mult(self, first_reg, second_reg):
-        res = '{:064b}'.format(first_reg.value * second_reg.value)
-        hi, lo = res[0:32], res[32:65]
-
-        self.Reg_dict['HI'].value = int(hi, 2)
-        self.Reg_dict['LO'].value = int(lo, 2)
+        self.regs[MIPS.HI], self.regs[MIPS.LO] = split_product(first_reg.value * second_reg.value)
 
     def multu(self, first_reg, second_reg):
-        res = '{:064b}'.format(abs(first_reg.value * second_reg.value))
-        hi, lo = res[0:32], res[32:65]
-
-        self.Reg_dict['HI'].value = int(hi, 2)
-        self.Reg_dict['LO'].value = int(lo, 2)
+        self.regs[MIPS.HI], self.regs[MIPS.LO] = split_product(to_unsigned(first_reg.value) * to_unsigned(second_reg.value))
 
     def div(self, first_reg, second_reg):
-        quotient = 0 if second_reg.value == 0 else first_reg.value//second_reg.value
-        remainder = 0 if second_reg.value == 0 else first_reg.value % second_reg.value
+        if second_reg.value == 0:
+            quotient, remainder = 0, 0
+        else:
+            quotient, remainder = divide(first_reg.value, second_reg.value)
 
-        self.Reg_dict['HI'].value = remainder
-        self.Reg_dict['LO'].value = quotient
+        self.regs[MIPS.HI] = remainder
+        self.regs[MIPS.LO] = quotient
 
     def divu(self, first_reg, second_reg):
-        quotient = 0 if second_reg.value == 0 else abs(first_reg.value // second_reg.value)
-        remainder = 0 if second_reg.value == 0 else abs(first_reg.value) % abs(second_reg.value)
+        if second_reg.value == 0:
+            quotient, remainder = 0, 0
+        else:
+            quotient, remainder = divide(to_unsigned(first_reg.value), to_unsigned(second_reg.value))
 
-        self.Reg_dict['HI'].value = remainder
-        self.Reg_dict['LO'].value = quotient
+        self.regs[MIPS.HI] = remainder
+        self.regs[MIPS.LO] = quotient
 
     def sll(self, first_reg, dest_reg, shamt):
-        dest_reg.value = first_reg.value << shamt
+        dest_reg.value = to_signed(first_reg.value << shamt)
 
     def srl(self, first_reg, dest_reg, shamt):
-        dest_reg.value = first_reg.value >> shamt
+        dest_reg.value = to_signed(to_unsigned(first_reg.value) >> shamt)
 
     def sra(self, first_reg, dest_reg, shamt):
         dest_reg.value = first_reg.value >> shamt
 
+    # Variable shifts use the low 5 bits of the shift register.
     def sllv(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = first_reg.value << second_reg.value
+        dest_reg.value = to_signed(first_reg.value << (second_reg.value & 0x1F))
 
     def srlv(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = first_reg.value >> second_reg.value
+        dest_reg.value = to_signed(to_unsigned(first_reg.value) >> (second_reg.value & 0x1F))
 
     def srav(self, first_reg, second_reg, dest_reg):
-        dest_reg.value = first_reg.value >> second_reg.value
+        dest_reg.value = first_reg.value >> (second_reg.value & 0x1F)
 
     def addi(self, first_reg, constant, dest_reg):
-        dest_reg.value = first_reg.value + constant
+        dest_reg.value = to_signed(first_reg.value + sign_extend16(constant))
 
     def slti(self, first_reg, constant, dest_reg):
-        if first_reg.value < constant:
+        if first_reg.value < sign_extend16(constant):
             dest_reg.value = 1
         else:
             dest_reg.value = 0
 
+    # Logical immediates are zero-extended.
     def andi(self, first_reg, constant, dest_reg):
         dest_reg.value = first_reg.value & constant
 
@@ -508,61 +982,48 @@ class MIPS:
         dest_reg.value = xor(first_reg.value, constant)
 
     def addiu(self, first_reg, constant, dest_reg):
-        dest_reg.value = abs(first_reg.value) + abs(constant)
+        dest_reg.value = to_signed(first_reg.value + sign_extend16(constant))
 
     def jr(self, first_reg):
         self.program_counter = first_reg.value - 1
 
     def lui(self, dest_reg, constant):
-        word = '{:016b}'.format(constant) + '{:016b}'.format(0)
-        dest_reg.value = int(word, 2)
+        dest_reg.value = to_signed(constant << 16)
 
     def lw(self, first_reg, second_reg, constant):
-        first_reg.value = self.memory[second_reg.value + constant]
+        first_reg.value = self.load_word(second_reg.value + sign_extend16(constant))
 
     def sw(self, first_reg, second_reg, constant):
-        self.memory[second_reg.value + constant] = first_reg.value
+        self.store_word(second_reg.value + sign_extend16(constant), first_reg.value)
 
     def bltz(self, first_reg, constant):
         if first_reg.value < 0:
-            self.program_counter += constant - 1
+            self.program_counter += sign_extend16(constant) - 1
 
     def beq(self, first_reg, second_reg, constant):
         if first_reg.value == second_reg.value:
-            self.program_counter += constant - 1
+            self.program_counter += sign_extend16(constant) - 1
 
     def bne(self, first_reg, second_reg, constant):
         if first_reg.value != second_reg.value:
-            self.program_counter += constant - 1
+            self.program_counter += sign_extend16(constant) - 1
 
     def lb(self, first_reg, second_reg, constant):
-        word = ""
-        upper_byte = '{:032b}'.format(self.memory[second_reg.value+constant])[0:8]
-        if upper_byte[0] == "1":
-            word = '{:024b}'.format(1).replace('0', '1') + upper_byte
-        else:
-            word = '{:024b}'.format(0) + upper_byte
-
-        first_reg.value = int(word, 2)
+        first_reg.value = self.load_byte(second_reg.value + sign_extend16(constant))
 
     def sb(self, first_reg, second_reg, constant):
-        word = ""
-        upper_byte = '{:032b}'.format(self.memory[first_reg.value+constant])[0:8]
-
-        if upper_byte[0] == "1":
-            word = '{:024b}'.format(1).replace('0', '1') + upper_byte
-        else:
-            word = '{:024b}'.format(0) + upper_byte
-
-        self.memory[second_reg.value + constant] = word
+        self.store_byte(second_reg.value + sign_extend16(constant), first_reg.value)
 
     def j(self, constant):
         self.program_counter = constant - 1
 
     def jal(self, constant):
-        self.Reg_dict["11111"].value = self.program_counter + 1
+        self.regs[31] = self.program_counter + 1
         self.program_counter = constant - 1
 
+    def syscall(self):
+        handle_syscall(self)
+
 if __name__ == '__main__':
     mips = MIPS()
     mips.simulate("input/input.txt", "output/output.txt")
\ No newline at end of file
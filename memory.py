@@ -0,0 +1,123 @@
+from struct import Struct
+
+from alu import sign_extend8
+
+PAGE_BITS = 12
+ADDRESS_MASK = 0xFFFFFFFF
+WORD_ADDRESS_MASK = ADDRESS_MASK >> 2
+
+signed_word = Struct(">i")
+unsigned_word = Struct(">I")
+
+
+class PagedMemory:
+    # Big-endian, byte-addressable 32-bit address space. Pages are bytearrays allocated on the first
+    # non-zero store, so reads of untouched memory return 0 without allocating anything.
+
+    def __init__(self, page_bits=PAGE_BITS):
+        self.page_bits = page_bits
+        self.page_size = 1 << page_bits
+        self.page_mask = self.page_size - 1
+        self.pages = {}
+        # Rendered dump() segment of every page holding a non-zero word, and the pages stored to since
+        # the segments were last brought up to date.
+        self.segments = {}
+        self.dirty = set()
+        self.dump_text = ""
+        # When a list, every store appends its word-aligned address (used by the delta trace writers).
+        self.write_log = None
+
+    def page_for_store(self, address):
+        number = address >> self.page_bits
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = bytearray(self.page_size)
+        elif type(page) is bytes:
+            # Shared with a snapshot (see freeze); copied on the first write.
+            page = self.pages[number] = bytearray(page)
+        return page
+
+    def load_word(self, address):
+        # Word accesses are aligned; the low two address bits are ignored.
+        page = self.pages.get(address >> self.page_bits)
+        if page is None:
+            return 0
+        return signed_word.unpack_from(page, address & self.page_mask & ~3)[0]
+
+    def store_word(self, address, value):
+        if self.write_log is not None:
+            self.write_log.append(address & ~3)
+        number = address >> self.page_bits
+        if value == 0 and number not in self.pages:
+            return
+        self.dirty.add(number)
+        unsigned_word.pack_into(self.page_for_store(address), address & self.page_mask & ~3, value & ADDRESS_MASK)
+
+    def load_byte(self, address):
+        page = self.pages.get(address >> self.page_bits)
+        if page is None:
+            return 0
+        return sign_extend8(page[address & self.page_mask])
+
+    def load_byte_unsigned(self, address):
+        page = self.pages.get(address >> self.page_bits)
+        if page is None:
+            return 0
+        return page[address & self.page_mask]
+
+    def store_byte(self, address, value):
+        if self.write_log is not None:
+            self.write_log.append(address & ~3)
+        number = address >> self.page_bits
+        if value & 0xFF == 0 and number not in self.pages:
+            return
+        self.dirty.add(number)
+        self.page_for_store(address)[address & self.page_mask] = value & 0xFF
+
+    def nonzero_words(self):
+        # (address, value) of every non-zero word, in address order. Only allocated pages are visited.
+        empty = bytes(self.page_size)
+        for number in sorted(self.pages):
+            page = self.pages[number]
+            if page != empty:
+                yield from self.page_words(number)
+
+    def page_words(self, number):
+        base = number << self.page_bits
+        for offset, (value,) in enumerate(signed_word.iter_unpack(self.pages[number])):
+            if value != 0:
+                yield base + (offset << 2), value
+
+    def dump(self):
+        # "word address:value" of every non-zero word in address order, joined by ";" (the MEM[...] of
+        # MIPS.__str__). Only the pages stored to since the last call are rendered again.
+        if self.dirty:
+            segments = self.segments
+            for number in self.dirty:
+                segment = ";".join([f"{address >> 2}:{value}" for address, value in self.page_words(number)])
+                if segment:
+                    segments[number] = segment
+                else:
+                    segments.pop(number, None)
+            self.dirty.clear()
+            self.dump_text = ";".join([segments[number] for number in sorted(segments)])
+        return self.dump_text
+
+    def freeze(self):
+        # Turns every page into an immutable bytes object and returns a copy of the page table. Pages
+        # stay shared between the copy and this memory until a store copies them back (page_for_store),
+        # so repeated snapshots only copy the pages written in between.
+        pages = self.pages
+        for number, page in pages.items():
+            if type(page) is not bytes:
+                pages[number] = bytes(page)
+        return dict(pages)
+
+    def thaw(self, pages):
+        # Adopts a page table returned by freeze(), sharing its pages.
+        self.pages = dict(pages)
+        self.segments = {}
+        self.dirty = set(self.pages)
+
+    def touched_pages(self):
+        return len(self.pages)
@@ -0,0 +1,80 @@
+import mmap
+import os
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# Below this many bytes per worker the pool costs more than it saves, and fewer workers are used.
+MIN_CHUNK_BYTES = 1 << 20
+
+
+def chunk_bounds(data, parts):
+    # Byte ranges splitting data into at most `parts` runs of whole lines.
+    size = len(data)
+    bounds = [0]
+    for part in range(1, parts):
+        cut = data.find(b"\n", max(bounds[-1], size * part // parts)) + 1
+        if cut <= bounds[-1]:
+            break
+        bounds.append(cut)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def decode_chunk(mips_class, input_path, start, end, listing_path):
+    # Worker: parses the lines in start..end into words and writes their assembly listing to
+    # listing_path (unless None). Returns the words as the bytes of an array("I"), so the result
+    # crosses the process boundary as one buffer. Each distinct word is decoded and printed once.
+    with open(input_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            lines = data[start:end].splitlines()
+    words = array("I", [int(line, 16) for line in lines])
+
+    if listing_path is not None:
+        decode_word = mips_class().decode_word
+        text = {word: str(decode_word(word)) + "\n" for word in dict.fromkeys(words)}
+        with open(listing_path, "w") as file:
+            file.write("".join(map(text.__getitem__, words)))
+    return words.tobytes()
+
+
+def decode_parallel(mips, input_path, assembly_path=None, workers=None):
+    # The words of a hex file as an array("I"), parsed in line-aligned chunks of the memory-mapped file
+    # by a process pool that also writes the assembly listing: each worker writes the segment of its
+    # chunk next to assembly_path and the segments are concatenated in order. Only the words come back,
+    # one buffer per chunk; the caller decodes them on demand (loader.WordProgram).
+    workers = workers or os.cpu_count() or 1
+    with open(input_path, "rb") as file:
+        size = file.seek(0, 2)
+        if size == 0:
+            bounds = []
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                bounds = chunk_bounds(data, max(1, min(workers, size // MIN_CHUNK_BYTES)))
+
+    segments = [None if assembly_path is None else f"{assembly_path}.part{index}" for index in range(len(bounds))]
+    try:
+        if len(bounds) <= 1:
+            results = [decode_chunk(type(mips), input_path, start, end, segment)
+                       for (start, end), segment in zip(bounds, segments)]
+        else:
+            with ProcessPoolExecutor(len(bounds)) as pool:
+                futures = [pool.submit(decode_chunk, type(mips), input_path, start, end, segment)
+                           for (start, end), segment in zip(bounds, segments)]
+                results = [future.result() for future in futures]
+
+        words = array("I")
+        for result in results:
+            words.frombytes(result)
+
+        if assembly_path is not None:
+            with open(assembly_path, "wb") as listing:
+                for segment in segments:
+                    with open(segment, "rb") as file:
+                        shutil.copyfileobj(file, listing, 1 << 20)
+    finally:
+        for segment in segments:
+            if segment is not None and os.path.exists(segment):
+                os.remove(segment)
+    return words
@@ -0,0 +1,215 @@
+import time
+
+from cfg import control_instructions
+
+branch_instructions = {"beq", "bne", "bltz"}
+
+# Name of the outermost frame in the collapsed stacks.
+ROOT_FRAME = "program"
+
+
+class Profiler:
+    # Execution profile of one simulate() run. run() is an instrumented copy of MIPS.run_table that
+    # simulate() swaps in when profiling, so the plain loop has no profiling code at all.
+    #
+    # Counts are per operation name and per program counter. For beq/bne/bltz it records taken and
+    # not-taken counts (a branch to the next instruction counts as not taken). For jal it records calls
+    # per target and per call site; for jr, the (jr address, destination) pairs. A shadow call stack,
+    # pushed by jal and popped by the jr that returns to the pushed address, gives the collapsed
+    # stacks. With sample_blocks=N, every N-th entry into a basic block (a run of instructions ended by
+    # a control instruction) is timed.
+
+    def __init__(self, sample_blocks=0):
+        self.sample_blocks = sample_blocks
+        self.mips = None
+        self.operations = {}
+        self.pcs = {}
+        self.branches = {}
+        self.calls = {}
+        self.call_sites = {}
+        self.returns = {}
+        self.collapsed = {}
+        self.stack = [(ROOT_FRAME, None)]
+        self.stack_key = ROOT_FRAME
+        self.block_start = None
+        self.block_entries = {}
+        self.block_times = {}
+        self.block_samples = {}
+        self.block_countdown = sample_blocks
+        self.block_timer = None
+
+    def run(self, mips, tracer, max_steps=None):
+        # Same loop, budget and trace calls as MIPS.run_table, plus the counters.
+        self.mips = mips
+        handlers = mips.bind_instructions()
+        instructions = mips.instructions
+        count = len(handlers)
+        step = tracer.step
+        skip = tracer.skip
+        operations = self.operations
+        pcs = self.pcs
+        collapsed = self.collapsed
+        budget = remaining = -1 if max_steps is None else max_steps
+        line = pc = None
+        self.enter_block(mips.program_counter)
+
+        try:
+            while remaining and 0 <= mips.program_counter < count:
+                bound = handlers[mips.program_counter] or mips.bind_at(mips.program_counter)
+                if bound is None: break
+                remaining -= 1
+                line, handler = bound
+                pc = mips.program_counter
+                # Read before running it: a store may replace the instruction.
+                operation = instructions[pc].operation
+                operations[operation] = operations.get(operation, 0) + 1
+                pcs[pc] = pcs.get(pc, 0) + 1
+                collapsed[self.stack_key] = collapsed.get(self.stack_key, 0) + 1
+
+                if handler is None:
+                    mips.program_counter += 1
+                    skip(line, pc)
+                    continue
+
+                handler()
+
+                mips.program_counter += 1
+                if operation in control_instructions:
+                    self.control(operation, pc, mips.program_counter)
+                step(line, pc)
+                line = None
+        except BaseException:
+            if line is not None:
+                tracer.interrupted(line, pc)
+            raise
+        finally:
+            mips.instruction_count += budget - remaining
+            self.leave_block()
+
+    def control(self, operation, pc, target):
+        if operation in branch_instructions:
+            record = self.branches.get(pc)
+            if record is None:
+                record = self.branches[pc] = [0, 0]
+            record[0 if target != pc + 1 else 1] += 1
+        elif operation == "jal":
+            self.calls[target] = self.calls.get(target, 0) + 1
+            self.call_sites[pc, target] = self.call_sites.get((pc, target), 0) + 1
+            self.stack.append((f"fn_{target}", pc + 1))
+            self.stack_key = self.stack_key + ";" + self.stack[-1][0]
+        elif operation == "jr":
+            self.returns[pc, target] = self.returns.get((pc, target), 0) + 1
+            if len(self.stack) > 1 and self.stack[-1][1] == target:
+                self.stack.pop()
+                self.stack_key = ";".join(frame for frame, _ in self.stack)
+
+        self.leave_block()
+        self.enter_block(target)
+
+    def enter_block(self, start):
+        self.block_start = start
+        self.block_entries[start] = self.block_entries.get(start, 0) + 1
+        if self.sample_blocks:
+            self.block_countdown -= 1
+            if not self.block_countdown:
+                self.block_countdown = self.sample_blocks
+                self.block_timer = time.perf_counter()
+
+    def leave_block(self):
+        if self.block_timer is not None:
+            elapsed = time.perf_counter() - self.block_timer
+            start = self.block_start
+            self.block_times[start] = self.block_times.get(start, 0.0) + elapsed
+            self.block_samples[start] = self.block_samples.get(start, 0) + 1
+            self.block_timer = None
+
+    def instruction_text(self, pc):
+        instruction = self.mips.instruction_at(pc) if self.mips is not None else None
+        return str(instruction) if instruction is not None else "(overwritten)"
+
+    def report(self, sort="count", limit=20):
+        # Plain-text report. sort orders the per-PC, branch and block tables: "count" (hottest first),
+        # "pc" (address order) or "time" (blocks by estimated time, the rest by count).
+        if sort not in ("count", "pc", "time"):
+            raise ValueError(f"unknown sort order: {sort}")
+        total = sum(self.operations.values()) or 1
+
+        def ordered(table, weight):
+            if sort == "pc":
+                return sorted(table, key=lambda key: key if isinstance(key, int) else key[0])[:limit]
+            return sorted(table, key=weight, reverse=True)[:limit]
+
+        lines = [f"instructions executed: {sum(self.operations.values())}", "", "operation       count       %"]
+        for operation, number in sorted(self.operations.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"{operation:<10}{number:>11}{number / total:>8.1%}")
+
+        lines += ["", "pc              count       %  instruction"]
+        for pc in ordered(self.pcs, self.pcs.get):
+            lines.append(f"{pc:<10}{self.pcs[pc]:>11}{self.pcs[pc] / total:>8.1%}  {self.instruction_text(pc)}")
+
+        if self.branches:
+            lines += ["", "branch          taken   not taken  taken %  instruction"]
+            for pc in ordered(self.branches, lambda pc: sum(self.branches[pc])):
+                taken, not_taken = self.branches[pc]
+                lines.append(f"{pc:<10}{taken:>11}{not_taken:>12}{taken / (taken + not_taken):>9.1%}"
+                             f"  {self.instruction_text(pc)}")
+
+        if self.calls:
+            lines += ["", "call target     calls  sites"]
+            for target in sorted(self.calls, key=self.calls.get, reverse=True)[:limit]:
+                sites = ", ".join(f"{site}x{number}" for (site, callee), number in sorted(self.call_sites.items())
+                                  if callee == target)
+                lines.append(f"{target:<10}{self.calls[target]:>11}  {sites}")
+
+        if self.returns:
+            lines += ["", "jr pc      destination      count"]
+            for (pc, target), number in sorted(self.returns.items(), key=lambda item: item[1], reverse=True)[:limit]:
+                lines.append(f"{pc:<10}{target:>12}{number:>11}")
+
+        if self.block_samples:
+            # Estimated time: mean of the sampled entries times all entries.
+            estimates = {start: self.block_times[start] / self.block_samples[start] * self.block_entries[start]
+                         for start in self.block_samples}
+            weight = estimates.get if sort == "time" else self.block_entries.get
+            lines += ["", "block         entries   sampled  mean us   est. ms"]
+            for start in ordered(estimates, weight):
+                mean = self.block_times[start] / self.block_samples[start]
+                lines.append(f"{start:<10}{self.block_entries[start]:>11}{self.block_samples[start]:>10}"
+                             f"{mean * 1e6:>9.2f}{estimates[start] * 1e3:>10.2f}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path, sort="count", limit=20):
+        with open(path, "w") as file:
+            file.write(self.report(sort, limit))
+
+    def write_collapsed(self, path):
+        # One "frame;frame;... count" line per call stack, counting executed instructions, as read by
+        # flamegraph.pl and compatible tools.
+        with open(path, "w") as file:
+            for stack, number in sorted(self.collapsed.items()):
+                file.write(f"{stack} {number}\n")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from main import MIPS
+
+    parser = argparse.ArgumentParser(description="Run a program under the profiler.")
+    parser.add_argument("input", nargs="?", default="input/input.txt")
+    parser.add_argument("--output", default="output/output.txt")
+    parser.add_argument("--trace", choices=["full", "delta", "binary", "off"], default="off")
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--report", default="output/profile.txt")
+    parser.add_argument("--collapsed", default="output/profile.folded")
+    parser.add_argument("--sort", choices=["count", "pc", "time"], default="count")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--sample-blocks", type=int, default=0, help="time every N-th basic block entry")
+    args = parser.parse_args()
+
+    profiler = Profiler(args.sample_blocks)
+    MIPS().simulate(args.input, args.output, trace=args.trace, max_steps=args.max_steps, profile=profiler)
+    profiler.write_report(args.report, args.sort, args.limit)
+    profiler.write_collapsed(args.collapsed)
+    print(profiler.report(args.sort, args.limit), end="")
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+from alu import to_signed
+from isa import register_index
+from main import MIPS
+from syscalls import HostIO
+
+# Longest JSON line accepted from clients and workers; programs and trace chunks travel inline.
+LINE_LIMIT = 1 << 26
+SERVER_TRACE_MODES = ("full", "delta", "off")
+
+
+def parse_program(program):
+    # A hex program inline: one string with a word per line, or a list of words (strings or integers).
+    if isinstance(program, str):
+        program = program.split()
+    return [word if isinstance(word, int) else int(word, 16) for word in program]
+
+
+class TraceChunks:
+    # File object handed to MIPS.run in a worker: every write the tracer makes (a batch of records) goes
+    # to the server as one trace message.
+
+    def __init__(self, send):
+        self.send = send
+
+    def write(self, data):
+        if data:
+            self.send({"type": "trace", "data": data})
+
+
+def run_job(mips, job, send):
+    # One job on a reused machine. Returns the result message without its id.
+    trace = job.get("trace", "off")
+    if trace not in SERVER_TRACE_MODES:
+        raise ValueError(f"trace must be one of {', '.join(SERVER_TRACE_MODES)}")
+    dispatch = job.get("dispatch", "table")
+    if dispatch not in ("table", "jit"):
+        raise ValueError("dispatch must be table or jit")
+
+    mips.reset()
+    mips.words_to_assembly(parse_program(job["program"]), None)
+    for instruction in mips.assembly_instructions:
+        mips.write_in_memory(instruction)
+    for name, value in job.get("registers", {}).items():
+        index = register_index(name, mips.register_table)
+        if index:
+            mips.regs[index] = to_signed(value)
+
+    console = io.StringIO()
+    host = HostIO(console, job.get("input", ""))
+    mips.run(TraceChunks(send), dispatch, trace, max_steps=job.get("max_steps"), host=host)
+    return {
+        "type": "result",
+        "status": "halted" if mips.halted else "budget_exceeded",
+        "instructions": mips.instruction_count,
+        "program_counter": mips.program_counter,
+        "registers": list(mips.regs),
+        "console": console.getvalue(),
+        "exit_code": host.exit_code,
+    }
+
+
+def worker():
+    # Worker process: one warm machine, jobs on stdin, JSON lines back on stdout, one job at a time.
+    mips = MIPS()
+    mips.decode_words([0])
+    out = sys.stdout
+
+    def send(message):
+        out.write(json.dumps(message) + "\n")
+        out.flush()
+
+    for line in sys.stdin:
+        try:
+            result = run_job(mips, json.loads(line), send)
+        except Exception as error:
+            result = {"type": "result", "status": "error", "error": f"{type(error).__name__}: {error}"}
+        send(result)
+
+
+class WorkerPool:
+    # Warm worker processes (see worker) handed out one job at a time. A worker whose job is cancelled or
+    # times out may still be running it, so it is killed and replaced by a fresh one.
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = asyncio.Queue()
+        self.replacements = set()
+
+    async def start(self):
+        for worker in await asyncio.gather(*[self.spawn() for _ in range(self.size)]):
+            self.idle.put_nowait(worker)
+
+    async def spawn(self):
+        return await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--worker",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=LINE_LIMIT)
+
+    async def run(self, job, send, timeout=None):
+        # Sends job to an idle worker and forwards its trace messages to send until the result, which is
+        # returned. timeout counts from the moment a worker takes the job.
+        worker = await self.idle.get()
+        try:
+            result = await asyncio.wait_for(self.exchange(worker, job, send), timeout)
+        except BaseException:
+            task = asyncio.get_running_loop().create_task(self.replace(worker))
+            self.replacements.add(task)
+            task.add_done_callback(self.replacements.discard)
+            raise
+        self.idle.put_nowait(worker)
+        return result
+
+    async def exchange(self, worker, job, send):
+        worker.stdin.write(json.dumps(job).encode() + b"\n")
+        await worker.stdin.drain()
+        while True:
+            line = await worker.stdout.readline()
+            if not line:
+                raise RuntimeError("worker exited")
+            message = json.loads(line)
+            if message["type"] == "result":
+                return message
+            await send(message)
+
+    async def replace(self, worker):
+        if worker.returncode is None:
+            worker.kill()
+        await worker.wait()
+        self.idle.put_nowait(await self.spawn())
+
+    async def close(self):
+        await asyncio.gather(*self.replacements, return_exceptions=True)
+        while not self.idle.empty():
+            worker = self.idle.get_nowait()
+            worker.stdin.close()
+            await worker.wait()
+
+
+class Server:
+    # JSON-lines protocol, one message per line in each direction.
+    #
+    # Requests:
+    #   {"type": "run", "id": ..., "program": "0x3c010064\n..." or [...], "max_steps": N, "trace": "full" |
+    #    "delta" | "off", "dispatch": "table" | "jit", "registers": {"t0": 5, "$9": -1}, "input": syscall
+    #    input text, "timeout": seconds}
+    #   {"type": "cancel", "id": ...}
+    # Replies, tagged with the job's id:
+    #   {"type": "trace", "data": "..."}, as the trace is produced;
+    #   {"type": "result", "status": "halted" | "budget_exceeded" | "error" | "timeout" | "cancelled",
+    #    "instructions", "program_counter", "registers" (34 slots, HI and LO last), "console" (syscall
+    #    output), "exit_code" (None unless the program called exit), "elapsed"}.
+    # Invalid requests get {"type": "error", "error": ...}. At end of input the server finishes the
+    # connection's jobs and closes it.
+
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+
+    async def handle(self, reader, writer):
+        jobs = {}
+
+        async def send(message):
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+
+        async for line in reader:
+            try:
+                request = json.loads(line)
+                kind = request.get("type", "run")
+                identifier = request.get("id")
+            except (ValueError, AttributeError):
+                await send({"type": "error", "error": "requests are JSON objects, one per line"})
+                continue
+
+            if kind == "run":
+                if identifier in jobs:
+                    await send({"type": "error", "id": identifier, "error": "a job with this id is running"})
+                elif "program" not in request:
+                    await send({"type": "error", "id": identifier, "error": "run requests need a program"})
+                else:
+                    jobs[identifier] = asyncio.create_task(self.job(request, send))
+                    jobs[identifier].add_done_callback(lambda _, identifier=identifier: jobs.pop(identifier, None))
+                    # Lets the job start, so a cancel that follows reaches its handler instead of dropping
+                    # a task that never ran (and never answered).
+                    await asyncio.sleep(0)
+            elif kind == "cancel":
+                if identifier in jobs:
+                    jobs[identifier].cancel()
+            else:
+                await send({"type": "error", "id": identifier, "error": f"unknown request type: {kind}"})
+
+        await asyncio.gather(*jobs.values(), return_exceptions=True)
+        writer.close()
+
+    async def job(self, request, send):
+        identifier = request.get("id")
+        job = {key: request[key] for key in ("program", "max_steps", "trace", "dispatch", "registers", "input")
+               if key in request}
+        start = time.perf_counter()
+
+        async def forward(message):
+            message["id"] = identifier
+            await send(message)
+
+        try:
+            result = await self.pool.run(job, forward, request.get("timeout", self.timeout))
+        except asyncio.TimeoutError:
+            result = {"type": "result", "status": "timeout"}
+        except asyncio.CancelledError:
+            result = {"type": "result", "status": "cancelled"}
+        except Exception as error:
+            result = {"type": "result", "status": "error", "error": f"{type(error).__name__}: {error}"}
+        result["id"] = identifier
+        result["elapsed"] = time.perf_counter() - start
+        await send(result)
+
+
+async def stdio_streams():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+async def serve(args):
+    pool = WorkerPool(args.workers)
+    await pool.start()
+    server = Server(pool, args.timeout)
+    try:
+        if args.stdio:
+            await server.handle(*await stdio_streams())
+        else:
+            listener = await asyncio.start_unix_server(server.handle, args.socket, limit=LINE_LIMIT)
+            print(f"listening on {args.socket} with {args.workers} workers", file=sys.stderr)
+            async with listener:
+                await listener.serve_forever()
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulation server: JSON-lines jobs run by warm worker processes.")
+    parser.add_argument("--socket", default="output/mips.sock", help="Unix socket to listen on")
+    parser.add_argument("--stdio", action="store_true", help="serve one client on stdin/stdout instead")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--timeout", type=float, default=None, help="default per-job timeout in seconds")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker()
+        return
+    if not args.stdio and os.path.exists(args.socket):
+        os.remove(args.socket)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
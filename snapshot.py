@@ -0,0 +1,134 @@
+import zlib
+from array import array
+from struct import Struct
+
+from loader import WordProgram
+from memory import PagedMemory
+from syscalls import HEAP_START
+
+SNAPSHOT_MAGIC = b"MSNP\x02"
+# page_bits, program_counter, memory_pointer, instruction_count, heap_pointer, program words, overwritten
+# slots, pages
+snapshot_header = Struct(">BqqqqIII")
+# Version 1 snapshots, from before sbrk, have no heap_pointer.
+SNAPSHOT_MAGIC_V1 = b"MSNP\x01"
+snapshot_header_v1 = Struct(">BqqqIII")
+register_file = Struct(">34i")
+page_number = Struct(">I")
+
+
+def program_words(mips):
+    # The program as words, None for slots overwritten by data. Lazily decoded programs give the words
+    # of their image without decoding them; an unchanged restored program is shared as it is.
+    instructions = mips.instructions
+    if isinstance(instructions, list):
+        return tuple(mips.encode_instruction(i) if i is not None else None for i in instructions)
+
+    erased = {address for address, instruction in instructions.decoded.items() if instruction is None}
+    if not erased and isinstance(instructions, WordProgram):
+        return instructions.words
+    return tuple(None if address in erased else instructions.word(address) for address in range(len(instructions)))
+
+
+class Snapshot:
+    # Complete machine state at a step boundary: the register file (with HI and LO), data memory,
+    # program, memory_pointer, program_counter, instruction_count and the sbrk heap_pointer. The
+    # syscall console is host state and is not part of it.
+    #
+    # In memory, snapshots share pages with the machine they were taken from and with every machine
+    # restored from them; a page is copied only when one of them stores to it (PagedMemory.freeze), so
+    # taking and restoring a snapshot costs about as much as the pages written since the last one.
+
+    def __init__(self, regs, pages, page_bits, words, memory_pointer, program_counter, instruction_count,
+                 heap_pointer=HEAP_START):
+        self.regs = regs
+        self.pages = pages
+        self.page_bits = page_bits
+        self.words = words
+        self.memory_pointer = memory_pointer
+        self.program_counter = program_counter
+        self.instruction_count = instruction_count
+        self.heap_pointer = heap_pointer
+
+    @classmethod
+    def capture(cls, mips):
+        return cls(tuple(mips.regs), mips.memory.freeze(), mips.memory.page_bits, program_words(mips),
+                   mips.memory_pointer, mips.program_counter, mips.instruction_count, mips.heap_pointer)
+
+    def restore(self, mips):
+        # Replaces the whole state of mips. The Register views keep working: regs is updated in place.
+        mips.regs[:] = array("i", self.regs)
+        mips.memory = PagedMemory(self.page_bits)
+        mips.memory.thaw(self.pages)
+        mips.instructions = WordProgram(self.words, mips.decode_word)
+        mips.memory_pointer = self.memory_pointer
+        mips.program_counter = self.program_counter
+        mips.instruction_count = self.instruction_count
+        mips.heap_pointer = self.heap_pointer
+        mips.handlers = None
+        mips.block_compiler = None
+        mips.loop_forwarder = None
+        mips.halted = mips.instruction_at(mips.program_counter) is None
+
+    def to_bytes(self):
+        # MSNP header, then a zlib stream: header fields, registers, the addresses of overwritten program
+        # slots, the program words (0 in overwritten slots) and the non-zero pages.
+        erased = [address for address, word in enumerate(self.words) if word is None]
+        empty = bytes(1 << self.page_bits)
+        pages = [(number, page) for number, page in sorted(self.pages.items()) if page != empty]
+
+        parts = [
+            snapshot_header.pack(self.page_bits, self.program_counter, self.memory_pointer, self.instruction_count,
+                                 self.heap_pointer, len(self.words), len(erased), len(pages)),
+            register_file.pack(*self.regs),
+            Struct(f">{len(erased)}I").pack(*erased),
+            Struct(f">{len(self.words)}I").pack(*[word if word is not None else 0 for word in self.words]),
+        ]
+        for number, page in pages:
+            parts.append(page_number.pack(number))
+            parts.append(bytes(page))
+        return SNAPSHOT_MAGIC + zlib.compress(b"".join(parts))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data.startswith(SNAPSHOT_MAGIC):
+            data = zlib.decompress(data[len(SNAPSHOT_MAGIC):])
+            page_bits, program_counter, memory_pointer, instruction_count, heap_pointer, length, erased_count, \
+                page_count = snapshot_header.unpack_from(data)
+            offset = snapshot_header.size
+        elif data.startswith(SNAPSHOT_MAGIC_V1):
+            data = zlib.decompress(data[len(SNAPSHOT_MAGIC_V1):])
+            page_bits, program_counter, memory_pointer, instruction_count, length, erased_count, page_count = \
+                snapshot_header_v1.unpack_from(data)
+            heap_pointer = HEAP_START
+            offset = snapshot_header_v1.size
+        else:
+            raise ValueError("not a snapshot")
+
+        regs = register_file.unpack_from(data, offset)
+        offset += register_file.size
+        erased = Struct(f">{erased_count}I").unpack_from(data, offset)
+        offset += 4 * erased_count
+        words = list(Struct(f">{length}I").unpack_from(data, offset))
+        offset += 4 * length
+        for address in erased:
+            words[address] = None
+
+        pages = {}
+        page_size = 1 << page_bits
+        for _ in range(page_count):
+            (number,) = page_number.unpack_from(data, offset)
+            offset += page_number.size
+            pages[number] = data[offset:offset + page_size]
+            offset += page_size
+        return cls(regs, pages, page_bits, tuple(words), memory_pointer, program_counter, instruction_count,
+                   heap_pointer)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
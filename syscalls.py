@@ -0,0 +1,119 @@
+import re
+import sys
+
+from alu import to_signed
+
+# Service codes in $v0, as in SPIM.
+PRINT_INT = 1
+PRINT_STRING = 4
+READ_INT = 5
+READ_STRING = 8
+SBRK = 9
+EXIT = 10
+PRINT_CHAR = 11
+READ_CHAR = 12
+EXIT2 = 17
+
+# First word address handed out by sbrk, well above the program and the workloads' data.
+HEAP_START = 0x04000000
+
+leading_integer = re.compile(r"\s*([+-]?\d+)")
+
+
+class HostIO:
+    # Guest console of syscall. Output is collected and written to output (a text file, sys.stdout by
+    # default) once batch characters are pending, when the run ends and on exit; batch=1 writes and
+    # flushes on every call instead. Input is read from the preloaded string input, so batch runs
+    # never wait on a terminal.
+
+    def __init__(self, output=None, input="", batch=1 << 16):
+        self.output = output if output is not None else sys.stdout
+        self.batch = batch
+        self.pending = []
+        self.pending_size = 0
+        self.input = input
+        self.position = 0
+        self.exit_code = None
+
+    def write(self, text):
+        if self.batch <= 1:
+            self.output.write(text)
+            self.output.flush()
+            return
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.output.write("".join(self.pending))
+            self.pending.clear()
+            self.pending_size = 0
+        self.output.flush()
+
+    def read_line(self):
+        # The next input line with its newline; "" at the end of input.
+        end = self.input.find("\n", self.position)
+        end = len(self.input) if end < 0 else end + 1
+        line = self.input[self.position:end]
+        self.position = end
+        return line
+
+    def read_char(self):
+        if self.position >= len(self.input):
+            return None
+        self.position += 1
+        return self.input[self.position - 1]
+
+
+def read_int(line):
+    # Like SPIM: the integer at the start of the line, 0 if there is none.
+    match = leading_integer.match(line)
+    return to_signed(int(match.group(1))) if match else 0
+
+
+def handle_syscall(mips):
+    # Runs the service in $v0 with its arguments in $a0/$a1. Strings hold one character per word
+    # address, the layout sb and lb give them, and end at a 0; sbrk sizes count words too. Unknown
+    # service codes do nothing, as syscall did before it was implemented.
+    regs = mips.regs
+    service = regs[2]
+    host = mips.host
+    if host is None:
+        host = mips.host = HostIO()
+
+    if service == PRINT_INT:
+        host.write(str(regs[4]))
+    elif service == PRINT_CHAR:
+        host.write(chr(regs[4] & 0xFF))
+    elif service == PRINT_STRING:
+        address = regs[4]
+        characters = []
+        character = mips.load_byte(address) & 0xFF
+        while character:
+            characters.append(chr(character))
+            address += 1
+            character = mips.load_byte(address) & 0xFF
+        host.write("".join(characters))
+    elif service == READ_INT:
+        regs[2] = read_int(host.read_line())
+    elif service == READ_CHAR:
+        character = host.read_char()
+        regs[2] = ord(character) & 0xFF if character is not None else -1
+    elif service == READ_STRING:
+        # At most $a1 - 1 characters of the next line (newline included, like fgets), then a 0.
+        address, length = regs[4], regs[5]
+        if length > 0:
+            line = host.read_line()[:length - 1]
+            for offset, character in enumerate(line):
+                mips.store_byte(address + offset, ord(character) & 0xFF)
+            mips.store_byte(address + len(line), 0)
+    elif service == SBRK:
+        regs[2] = mips.heap_pointer
+        mips.heap_pointer = to_signed(mips.heap_pointer + regs[4])
+    elif service == EXIT or service == EXIT2:
+        host.exit_code = regs[4] if service == EXIT2 else 0
+        host.flush()
+        # The run loops add 1 and stop past the last instruction.
+        mips.program_counter = len(mips.instructions) - 1
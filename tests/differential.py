@@ -0,0 +1,321 @@
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+from array import array
+from unittest import mock
+
+from benchmark.workloads import i_type, j_type, r_type, write_hex
+from debugger import Debugger
+from lockstep import LockstepEngine
+import parallel_decode
+from main import MIPS
+from snapshot import Snapshot
+from syscalls import EXIT, PRINT_INT, READ_CHAR, READ_INT, READ_STRING, SBRK, HostIO
+from timing import Cache, TimingModel
+from tracing import read_digests, state_digest
+
+# Word addresses the generated programs load from and store to, above their code.
+DATA = 256
+DATA_WORDS = 64
+# Registers the generated code computes in; $2, $4 and $5 only carry syscall arguments, $16 counts loops
+# and $31 holds return addresses.
+WORKING = list(range(8, 16))
+COUNTER = 16
+
+ALU = ["add", "addu", "sub", "subu", "and", "or", "xor", "nor", "slt", "sllv", "srlv", "srav"]
+IMMEDIATE = ["addi", "addiu", "slti", "andi", "ori", "xori"]
+SERVICES = [PRINT_INT, READ_INT, READ_CHAR, READ_STRING, SBRK, EXIT]
+# Console input of the single-machine runs; the lockstep lanes have none.
+INPUT = "42\n-7 z\nhello\n"
+
+
+def straight_code(rng, words, size, length, calls=None):
+    # size groups of one to five instructions. Branches and jumps go forward to the start of a group
+    # of the same stretch or just past it, so only the loops run anything twice and a syscall always
+    # gets the arguments its group sets up. With calls, jal groups are left as None and their
+    # addresses added to calls, for random_program to point at a subroutine.
+    starts, branches = [], []
+    for _ in range(size):
+        starts.append(len(words))
+        d, s, t = rng.choice(WORKING), rng.choice([0] + WORKING), rng.choice([0] + WORKING)
+        kind = rng.random()
+        if kind < 0.3:
+            words.append(r_type(rng.choice(ALU), d, s, t))
+        elif kind < 0.45:
+            words.append(i_type(rng.choice(IMMEDIATE), d, s, rng.randrange(0x10000)))
+        elif kind < 0.5:
+            words.append(r_type(rng.choice(["sll", "srl", "sra"]), d, rt=s, shamt=rng.randrange(32)))
+        elif kind < 0.55:
+            words.append(r_type(rng.choice(["mult", "multu", "div", "divu"]), rs=s, rt=t))
+            words.append(r_type(rng.choice(["mfhi", "mflo"]), d))
+        elif kind < 0.65:
+            operation = rng.choice(["lw", "lb", "lbu", "sw", "sb"])
+            words.append(i_type(operation, d, 0, DATA + rng.randrange(DATA_WORDS)))
+        elif kind < 0.67:
+            # A store over the program: the instruction there is gone and the run halts if it gets there.
+            words.append(i_type("sw", d, 0, rng.randrange(length)))
+        elif kind < 0.77:
+            branches.append((len(words), rng.choice(["beq", "bne", "bltz", "j"]), t, s))
+            words.append(None)
+        elif kind < 0.82 and calls is not None:
+            calls.append(len(words))
+            words.append(None)
+        else:
+            service = rng.choice(SERVICES)
+            words.append(i_type("addi", 2, 0, service))
+            if service == READ_STRING:
+                words.append(i_type("addi", 4, 0, DATA + rng.randrange(DATA_WORDS - 4)))
+                words.append(i_type("addi", 5, 0, rng.randrange(5)))
+            else:
+                words.append(r_type("add", 4, s, 0))
+            words.append(r_type("syscall"))
+            words.append(r_type("add", d, 2, 0))
+    starts.append(len(words))
+
+    for index, operation, t, s in branches:
+        target = rng.choice([start for start in starts if start > index])
+        words[index] = j_type("j", target) if operation == "j" else i_type(operation, t, s, target - index)
+
+
+def counted_loop(rng, words):
+    # $16 = n; a body of register-only or memory instructions; $16 -= 1; back while $16 != 0.
+    words.append(i_type("addi", COUNTER, 0, rng.randint(1, 40)))
+    loop = len(words)
+    for _ in range(rng.randint(1, 6)):
+        d, s, t = rng.choice(WORKING), rng.choice([0] + WORKING), rng.choice([0] + WORKING)
+        if rng.random() < 0.8:
+            words.append(r_type(rng.choice(ALU), d, s, t))
+        else:
+            words.append(i_type(rng.choice(["lw", "sw"]), d, 0, DATA + rng.randrange(DATA_WORDS)))
+    words.append(i_type("addi", COUNTER, COUNTER, -1))
+    words.append(i_type("bne", 0, COUNTER, loop - len(words)))
+
+
+def random_program(rng, length):
+    # Straight code, counted loops and calls, about length words, then a jump past the end of the
+    # program and the subroutines the calls go to, each ending in jr $31. Nothing jumps into a loop
+    # and only jal enters a subroutine, so every program ends.
+    words = []
+    calls = []
+    while len(words) < length:
+        if rng.random() < 0.3:
+            counted_loop(rng, words)
+        else:
+            straight_code(rng, words, rng.randint(1, 8), length, calls)
+
+    leave = len(words)
+    words.append(None)
+    entries = []
+    for _ in range(rng.randint(1, 2)):
+        entries.append(len(words))
+        straight_code(rng, words, rng.randint(1, 4), length)
+        words.append(r_type("jr", rs=31))
+    words[leave] = j_type("j", len(words))
+    for index in calls:
+        words[index] = j_type("jal", rng.choice(entries))
+    return words
+
+
+def machine_state(mips):
+    return list(mips.regs), [mips.load_word(address) for address in range(DATA, DATA + DATA_WORDS)]
+
+
+def outcome(mips, console):
+    # What two runs of the same program must agree on. Chain dispatch does not count instructions, so
+    # the count is kept apart.
+    return (machine_state(mips), mips.program_counter, console.getvalue()), mips.instruction_count
+
+
+class Case:
+    # A generated program, the initial registers of its lanes and the reference run of lane 0: table
+    # dispatch, trace off, INPUT on the console. Checks take a Case and return whether their execution
+    # path ends the same way.
+
+    def __init__(self, seed, index, directory, length=60, lanes=8):
+        self.seed = seed
+        self.index = index
+        self.directory = directory
+        rng = random.Random(seed * 1_000_003 + index)
+        self.path = os.path.join(directory, f"program_{seed}_{index}.txt")
+        write_hex(self.path, random_program(rng, length))
+        self.lanes = [[0] * 8 + [rng.randint(-2 ** 31, 2 ** 31 - 1) for _ in WORKING] + [0] * 18
+                      for _ in range(lanes)]
+        self.registers = self.lanes[0]
+
+        console = io.StringIO()
+        self.reference = self.start(HostIO(console, INPUT), trace="off")
+        self.expected = outcome(self.reference, console)
+
+    def random(self, name):
+        # Separate choices per check, so adding a check does not change what the others do.
+        return random.Random(f"{self.seed}/{self.index}/{name}")
+
+    def output(self, name):
+        return os.path.join(self.directory, f"{name}_{self.seed}_{self.index}.out")
+
+    def start(self, host, output_path=os.devnull, registers=None, **options):
+        mips = MIPS()
+        mips.regs[:] = array("i", self.registers if registers is None else registers)
+        options.setdefault("assembly_path", None)
+        mips.simulate(self.path, output_path, host=host, **options)
+        return mips
+
+    def run(self, **options):
+        console = io.StringIO()
+        return outcome(self.start(HostIO(console, INPUT), **options), console)
+
+
+def check_jit(case):
+    return case.run(trace="off", dispatch="jit", hot_threshold=1) == case.expected
+
+
+def check_fast_forward(case):
+    return case.run(trace="off", fast_forward=True) == case.expected
+
+
+def check_lazy_loader(case):
+    return case.run(trace="off", loader="lazy") == case.expected
+
+
+def check_chain(case):
+    # Chain and table dispatch with the full trace: the same trace and the same final state.
+    trace = case.output("chain")
+    case.run(output_path=trace)
+    with open(trace, "r") as file:
+        table_trace = file.read()
+    state, _ = case.run(output_path=trace, dispatch="chain")
+    with open(trace, "r") as file:
+        return file.read() == table_trace and state == case.expected[0]
+
+
+def check_lockstep(case):
+    # Every lane against its own simulate() run, which reads no input either.
+    mips = MIPS()
+    mips.words_to_assembly(mips.hex_to_words(case.path), None)
+    engine = LockstepEngine(mips.assembly_instructions, case.lanes, memory_words=DATA + DATA_WORDS)
+    engine.run()
+    for lane, registers in enumerate(case.lanes):
+        reference = case.start(HostIO(io.StringIO()), registers=registers, trace="off")
+        if ((engine.registers(lane), engine.memory[lane, DATA:].tolist()) != machine_state(reference)
+                or engine.instruction_count[lane] != reference.instruction_count):
+            return False
+    return True
+
+
+def check_resume(case):
+    # Stopped at a random step, saved, loaded and resumed in a fresh machine on the same console.
+    console = io.StringIO()
+    host = HostIO(console, INPUT)
+    steps = case.random("resume").randrange(case.reference.instruction_count + 1)
+    mips = case.start(host, trace="off", max_steps=steps)
+    path = case.output("resume")
+    mips.snapshot().save(path)
+    mips = MIPS.resume(Snapshot.load(path), os.devnull, trace="off", host=host)
+    return outcome(mips, console) == case.expected
+
+
+def check_debugger(case):
+    # Run again after every stop of a breakpoint and two watchpoints until the program ends.
+    rng = case.random("debugger")
+    debugger = Debugger()
+    debugger.break_at(rng.randrange(len(case.reference.instructions)))
+    debugger.watch_register(rng.choice(WORKING))
+    debugger.watch_memory(DATA + rng.randrange(DATA_WORDS))
+    console = io.StringIO()
+    host = HostIO(console, INPUT)
+    mips = case.start(host, trace="off", max_steps=0)
+    while True:
+        mips.run(os.devnull, trace="off", host=host, debugger=debugger)
+        if debugger.stop.reason == "halted": break
+    return outcome(mips, console) == case.expected
+
+
+def last_checkpoint(path):
+    with open(path, "rb") as file:
+        return read_digests(file.read())[1][-1]
+
+
+def check_digest(case):
+    # The digest kept up to date per step ends at a digest of the final state, also when a resumed run
+    # appends to the trace.
+    trace = case.output("digest")
+    final = (case.reference.instruction_count, case.reference.program_counter, state_digest(case.reference))
+    if case.run(output_path=trace, trace="digest", trace_every=5) != case.expected or last_checkpoint(trace) != final:
+        return False
+
+    console = io.StringIO()
+    host = HostIO(console, INPUT)
+    steps = case.random("digest").randrange(case.reference.instruction_count + 1)
+    mips = case.start(host, trace, trace="digest", trace_every=5, max_steps=steps)
+    mips = MIPS.resume(mips.snapshot(), trace, trace="digest", trace_every=5, append=True, host=host)
+    return outcome(mips, console) == case.expected and last_checkpoint(trace) == final
+
+
+def check_timing(case):
+    # Small caches, so fetches and loads miss as well as hit.
+    timing = TimingModel(icache=Cache(64, 2, 8, name="icache"), dcache=Cache(64, 1, 16, name="dcache"))
+    return case.run(trace="off", timing=timing) == case.expected
+
+
+def check_profile(case):
+    return case.run(trace="off", profile=True) == case.expected
+
+
+def check_parallel_loader(case):
+    # Chunks of a few lines, so the pool decodes and lists the program in pieces: the same listing as
+    # the eager loader and the same final state.
+    listing = case.output("listing")
+    case.start(HostIO(io.StringIO(), INPUT), trace="off", assembly_path=listing)
+    with open(listing, "r") as file:
+        eager_listing = file.read()
+    with mock.patch.object(parallel_decode, "MIN_CHUNK_BYTES", 64):
+        result = case.run(trace="off", loader="parallel", decode_workers=3, assembly_path=listing)
+    with open(listing, "r") as file:
+        return file.read() == eager_listing and result == case.expected
+
+
+CHECKS = {
+    "chain": check_chain,
+    "jit": check_jit,
+    "fast_forward": check_fast_forward,
+    "lazy loader": check_lazy_loader,
+    "lockstep": check_lockstep,
+    "resume": check_resume,
+    "debugger": check_debugger,
+    "digest trace": check_digest,
+    "timing": check_timing,
+    "profile": check_profile,
+    "parallel loader": check_parallel_loader,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run seeded random programs, syscalls and calls included, "
+                                                 "through every execution path and compare the final states "
+                                                 "with the table dispatch.")
+    parser.add_argument("--programs", type=int, default=200)
+    parser.add_argument("--length", type=int, default=60, help="instructions per program, about")
+    parser.add_argument("--lanes", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", choices=sorted(CHECKS), action="append", help="run only these checks")
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(args.programs):
+            case = Case(args.seed, index, directory, args.length, args.lanes)
+            failing = [name for name, check in CHECKS.items() if (not args.check or name in args.check)
+                       and not check(case)]
+            if failing:
+                failures += 1
+                print(f"program {index} (seed {args.seed}) differs from the table dispatch in: {', '.join(failing)}")
+
+    print(f"{args.programs} programs, {failures} mismatches")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import tempfile
+import unittest
+
+from tests.differential import CHECKS, Case
+
+# Generated programs each execution path runs here; python -m tests.differential runs more, and other seeds.
+PROGRAMS = 25
+
+
+class DifferentialTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.cases = [Case(0, index, cls.directory.name) for index in range(PROGRAMS)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def check(self, name):
+        failing = [case.index for case in self.cases if not CHECKS[name](case)]
+        self.assertEqual(failing, [], f"{name} differs from the table dispatch")
+
+    def test_chain(self):
+        self.check("chain")
+
+    def test_jit(self):
+        self.check("jit")
+
+    def test_fast_forward(self):
+        self.check("fast_forward")
+
+    def test_lazy_loader(self):
+        self.check("lazy loader")
+
+    def test_lockstep(self):
+        self.check("lockstep")
+
+    def test_resume(self):
+        self.check("resume")
+
+    def test_debugger(self):
+        self.check("debugger")
+
+    def test_digest_trace(self):
+        self.check("digest trace")
+
+    def test_timing(self):
+        self.check("timing")
+
+    def test_profile(self):
+        self.check("profile")
+
+    def test_parallel_loader(self):
+        self.check("parallel loader")
+
+
+if __name__ == '__main__':
+    unittest.main()
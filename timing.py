@@ -0,0 +1,322 @@
+from alu import sign_extend16
+from cfg import conditional_branches
+from memory import WORD_ADDRESS_MASK
+
+load_instructions = {"lw", "lb", "lbu"}
+store_instructions = {"sw", "sb"}
+jump_instructions = {"j", "jal", "jr"}
+muldiv_latency = {"mult": "multiply_latency", "multu": "multiply_latency",
+                  "div": "divide_latency", "divu": "divide_latency"}
+hilo_reads = {"mfhi", "mflo"}
+# Operations that read no general purpose register.
+no_sources = {"lui", "mfhi", "mflo", "j", "jal"}
+# syscall reads the service in $v0 and its arguments in $a0 and $a1.
+syscall_sources = frozenset({2, 4, 5})
+
+# Instruction classes of the timing records.
+PLAIN, LOAD, STORE, BRANCH, JUMP, MULDIV, HILO = range(7)
+
+STALLS = ("load_use", "branch", "jump", "hilo", "icache", "dcache")
+
+
+class Cache:
+    # Set-associative cache of line tags over byte addresses, with "lru" or "fifo" replacement. Only hits
+    # and misses are modelled, not contents; stores allocate like loads (write-allocate).
+
+    def __init__(self, size=8192, associativity=2, line_size=32, policy="lru", name="cache"):
+        for value, what in ((size, "size"), (line_size, "line size")):
+            if value <= 0 or value & (value - 1):
+                raise ValueError(f"{name}: {what} must be a power of two")
+        if line_size < 4:
+            raise ValueError(f"{name}: line size must be at least 4 bytes, one instruction")
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"{name}: unknown replacement policy: {policy}")
+        sets = size // (associativity * line_size) if associativity > 0 else 0
+        if sets < 1 or sets * associativity * line_size != size or sets & (sets - 1):
+            raise ValueError(f"{name}: {size} bytes do not split into {associativity}-way sets of {line_size}-byte lines")
+
+        self.name = name
+        self.size = size
+        self.associativity = associativity
+        self.line_size = line_size
+        self.policy = policy
+        self.line_bits = line_size.bit_length() - 1
+        self.set_mask = sets - 1
+        # Tags of each set, least recently used (or oldest) first.
+        self.sets = [[] for _ in range(sets)]
+        self.lru = policy == "lru"
+        self.hits = 0
+        self.misses = 0
+
+    def access(self, address):
+        # True on a hit. The most recent line of a set is checked first, as runs of fetches and
+        # sequential accesses keep hitting it.
+        line = address >> self.line_bits
+        ways = self.sets[line & self.set_mask]
+        if ways and ways[-1] == line:
+            self.hits += 1
+            return True
+        if line in ways:
+            self.hits += 1
+            if self.lru:
+                ways.remove(line)
+                ways.append(line)
+            return True
+        self.misses += 1
+        if len(ways) >= self.associativity:
+            del ways[0]
+        ways.append(line)
+        return False
+
+    def hit_rate(self):
+        accesses = self.hits + self.misses
+        return self.hits / accesses if accesses else None
+
+    def describe(self):
+        return f"{self.size} B, {self.associativity}-way, {self.line_size} B lines, {self.policy}"
+
+
+class TimingModel:
+    # Cycle estimate of a run on a classic 5-stage MIPS pipeline (IF ID EX MEM WB) with full forwarding,
+    # L1 instruction and data caches. Like profiler.Profiler, run() is an instrumented copy of
+    # MIPS.run_table that simulate() swaps in, so untimed runs pay nothing.
+    #
+    # Every instruction issues in one cycle plus its stalls: load_use when it reads the register loaded
+    # by the instruction just before; branch_penalty for a taken beq/bne/bltz (predicted not taken,
+    # resolved in EX); jump_penalty for j/jal/jr (resolved in ID); mfhi/mflo, mult and div wait until
+    # the multiply/divide unit's result is ready; and miss_penalty for each instruction fetch or
+    # lw/sw/lb/sb data access that misses its cache. Filling the pipeline adds 4 cycles to the run.
+
+    def __init__(self, icache=None, dcache=None, miss_penalty=10, load_use_penalty=1, branch_penalty=2,
+                 jump_penalty=1, multiply_latency=4, divide_latency=32):
+        self.icache = icache if icache is not None else Cache(name="icache")
+        self.dcache = dcache if dcache is not None else Cache(name="dcache")
+        self.miss_penalty = miss_penalty
+        self.load_use_penalty = load_use_penalty
+        self.branch_penalty = branch_penalty
+        self.jump_penalty = jump_penalty
+        self.multiply_latency = multiply_latency
+        self.divide_latency = divide_latency
+        self.instructions = 0
+        self.cycles = 0
+        self.stalls = dict.fromkeys(STALLS, 0)
+        self.taken_branches = 0
+        self.branches = 0
+        # Timing record of each address, made on its first fetch; see record().
+        self.records = {}
+        # Cycle the multiply/divide unit's result is ready, and the register the last instruction loaded.
+        self.hilo_ready = 0
+        self.loaded = None
+
+    def record(self, instruction):
+        # (instruction, class, registers read, register loaded, base register, offset, latency).
+        operation = instruction.operation
+        if operation == "syscall":
+            sources = syscall_sources
+        else:
+            if operation in no_sources:
+                sources = ()
+            elif operation in load_instructions:
+                sources = (instruction.second_reg,)
+            else:
+                sources = (instruction.first_reg, instruction.second_reg)
+            sources = frozenset(register.code for register in sources if register is not None and register.code)
+
+        loaded = base = offset = None
+        latency = 0
+        if operation in load_instructions or operation in store_instructions:
+            kind = LOAD if operation in load_instructions else STORE
+            if instruction.first_reg is not None and instruction.second_reg is not None:
+                base = instruction.second_reg.code
+                offset = sign_extend16(instruction.constant)
+                if kind == LOAD and instruction.first_reg.code:
+                    loaded = instruction.first_reg.code
+        elif operation in conditional_branches:
+            kind = BRANCH
+        elif operation in jump_instructions:
+            kind = JUMP
+        elif operation in muldiv_latency:
+            kind = MULDIV
+            latency = getattr(self, muldiv_latency[operation])
+        elif operation in hilo_reads:
+            kind = HILO
+        else:
+            kind = PLAIN
+        return instruction, kind, sources, loaded, base, offset, latency
+
+    def run(self, mips, tracer, max_steps=None):
+        # Same loop, budget and trace calls as MIPS.run_table, plus the model.
+        handlers = mips.bind_instructions()
+        instructions = mips.instructions
+        regs = mips.regs
+        count = len(handlers)
+        step = tracer.step
+        skip = tracer.skip
+        records = self.records
+        record = self.record
+        stalls = self.stalls
+        fetch = self.icache.access
+        fetch_bits = self.icache.line_bits - 2
+        access = self.dcache.access
+        miss_penalty = self.miss_penalty
+        load_use_penalty = self.load_use_penalty
+        branch_penalty = self.branch_penalty
+        jump_penalty = self.jump_penalty
+        cycle = self.cycles
+        loaded_register = self.loaded
+        hilo_ready = self.hilo_ready
+        # Fetches from the line fetched last are hits that leave the cache as it is, so they skip
+        # Cache.access and are counted here.
+        fetch_line = None
+        fetch_hits = branches = taken = 0
+        budget = remaining = -1 if max_steps is None else max_steps
+        line = pc = None
+
+        try:
+            while remaining and 0 <= mips.program_counter < count:
+                bound = handlers[mips.program_counter] or mips.bind_at(mips.program_counter)
+                if bound is None: break
+                remaining -= 1
+                line, handler = bound
+                pc = mips.program_counter
+                instruction = instructions[pc]
+                # Records follow the instruction at the address, which a store may replace.
+                timing = records.get(pc)
+                if timing is None or timing[0] is not instruction:
+                    timing = records[pc] = record(instruction)
+                _, kind, sources, loaded, base, offset, latency = timing
+
+                cycle += 1
+                if pc >> fetch_bits == fetch_line:
+                    fetch_hits += 1
+                else:
+                    fetch_line = pc >> fetch_bits
+                    if not fetch(pc << 2):
+                        cycle += miss_penalty
+                        stalls["icache"] += miss_penalty
+                if loaded_register is not None and loaded_register in sources:
+                    cycle += load_use_penalty
+                    stalls["load_use"] += load_use_penalty
+                loaded_register = loaded
+
+                if kind == LOAD or kind == STORE:
+                    # The address lw/sw/lb/sb will use, read before the instruction runs.
+                    if base is not None and not access(((regs[base] + offset) & WORD_ADDRESS_MASK) << 2):
+                        cycle += miss_penalty
+                        stalls["dcache"] += miss_penalty
+                elif kind == MULDIV or kind == HILO:
+                    if hilo_ready > cycle:
+                        stalls["hilo"] += hilo_ready - cycle
+                        cycle = hilo_ready
+                    if kind == MULDIV:
+                        hilo_ready = cycle + latency
+
+                if handler is None:
+                    mips.program_counter += 1
+                    skip(line, pc)
+                    continue
+
+                handler()
+
+                mips.program_counter += 1
+                if kind == BRANCH:
+                    branches += 1
+                    if mips.program_counter != pc + 1:
+                        taken += 1
+                        cycle += branch_penalty
+                        stalls["branch"] += branch_penalty
+                elif kind == JUMP:
+                    cycle += jump_penalty
+                    stalls["jump"] += jump_penalty
+                step(line, pc)
+                line = None
+        except BaseException:
+            if line is not None:
+                tracer.interrupted(line, pc)
+            raise
+        finally:
+            mips.instruction_count += budget - remaining
+            self.instructions += budget - remaining
+            self.cycles = cycle
+            self.loaded = loaded_register
+            self.hilo_ready = hilo_ready
+            self.icache.hits += fetch_hits
+            self.branches += branches
+            self.taken_branches += taken
+
+    def total_cycles(self):
+        return self.cycles + 4 if self.instructions else 0
+
+    def cpi(self):
+        return self.total_cycles() / self.instructions if self.instructions else None
+
+    def summary(self):
+        return {
+            "instructions": self.instructions,
+            "cycles": self.total_cycles(),
+            "cpi": self.cpi(),
+            "stalls": dict(self.stalls),
+            "branches": self.branches,
+            "taken_branches": self.taken_branches,
+            "icache": {"hits": self.icache.hits, "misses": self.icache.misses, "hit_rate": self.icache.hit_rate()},
+            "dcache": {"hits": self.dcache.hits, "misses": self.dcache.misses, "hit_rate": self.dcache.hit_rate()},
+        }
+
+    def report(self):
+        def rate(cache):
+            hit_rate = cache.hit_rate()
+            return f"{hit_rate:.2%}" if hit_rate is not None else "-"
+
+        cpi = self.cpi()
+        cycles = self.total_cycles() or 1
+        lines = [
+            f"instructions: {self.instructions}",
+            f"cycles:       {self.total_cycles()}",
+            f"CPI:          {cpi:.3f}" if cpi is not None else "CPI:          -",
+            "",
+            f"icache: {self.icache.describe()}: {self.icache.hits} hits, {self.icache.misses} misses, {rate(self.icache)}",
+            f"dcache: {self.dcache.describe()}: {self.dcache.hits} hits, {self.dcache.misses} misses, {rate(self.dcache)}",
+            f"branches: {self.branches}, taken {self.taken_branches}",
+            "",
+            "stall        cycles       %",
+        ]
+        for cause in STALLS:
+            lines.append(f"{cause:<10}{self.stalls[cause]:>11}{self.stalls[cause] / cycles:>8.1%}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        with open(path, "w") as file:
+            file.write(self.report())
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from main import MIPS
+
+    parser = argparse.ArgumentParser(description="Run a program under the cache and pipeline timing model.")
+    parser.add_argument("input", nargs="?", default="input/input.txt")
+    parser.add_argument("--output", default="output/output.txt")
+    parser.add_argument("--trace", choices=["full", "delta", "binary", "off"], default="off")
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--report", default="output/timing.txt")
+    for cache in ("icache", "dcache"):
+        parser.add_argument(f"--{cache}-size", type=int, default=8192)
+        parser.add_argument(f"--{cache}-ways", type=int, default=2)
+        parser.add_argument(f"--{cache}-line", type=int, default=32)
+        parser.add_argument(f"--{cache}-policy", choices=["lru", "fifo"], default="lru")
+    parser.add_argument("--miss-penalty", type=int, default=10)
+    parser.add_argument("--branch-penalty", type=int, default=2)
+    parser.add_argument("--multiply-latency", type=int, default=4)
+    parser.add_argument("--divide-latency", type=int, default=32)
+    args = parser.parse_args()
+
+    model = TimingModel(
+        Cache(args.icache_size, args.icache_ways, args.icache_line, args.icache_policy, "icache"),
+        Cache(args.dcache_size, args.dcache_ways, args.dcache_line, args.dcache_policy, "dcache"),
+        miss_penalty=args.miss_penalty, branch_penalty=args.branch_penalty,
+        multiply_latency=args.multiply_latency, divide_latency=args.divide_latency,
+    )
+    MIPS().simulate(args.input, args.output, trace=args.trace, max_steps=args.max_steps, timing=model)
+    model.write_report(args.report)
+    print(model.report(), end="")
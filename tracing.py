@@ -0,0 +1,392 @@
+import zlib
+from array import array
+from struct import Struct
+
+from isa import written_registers
+
+TRACE_MODES = ("full", "delta", "binary", "digest", "off")
+# Modes whose trace file is opened in binary mode.
+BINARY_TRACE_MODES = ("binary", "digest")
+
+# Version 2 widened the change counts: with trace_every, hundreds of words can change between records.
+BINARY_MAGIC = b"MTRC\x02"
+# pc, flags, changed registers, changed words
+record_header = Struct(">IBHI")
+register_entry = Struct(">BH")
+memory_entry = Struct(">IH")
+
+DIGEST_MAGIC = b"MDGT\x01"
+digest_header = Struct(">I")
+# Checkpoint: instructions run so far, program_counter after them, state digest.
+checkpoint_record = Struct(">QqQ")
+DIGEST_MASK = (1 << 64) - 1
+# Memory words hash under keys above the 34 register slots.
+MEMORY_KEY_BASE = 64
+
+# Record flag: the record is followed by a state line in the text trace (skipped operations have none).
+HAS_STATE = 1
+
+
+def encode_value(value):
+    # Register and memory values as signed big-endian integers of the smallest length that fits.
+    length = (value.bit_length() + 8) // 8
+    return value.to_bytes(length, "big", signed=True)
+
+
+class TraceWriter:
+    # Buffers trace output and writes it in batches. step() is called after every executed instruction
+    # and skip() for instructions without a handler; with every=N only every N-th call is recorded.
+
+    def __init__(self, file, mips, every=1, batch=4096):
+        self.file = file
+        self.mips = mips
+        self.every = every
+        self.countdown = every
+        self.batch = batch
+        self.buffer = []
+
+    def step(self, line, pc):
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.every
+        self.record(line, pc, True)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def skip(self, line, pc):
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.every
+        self.record(line, pc, False)
+
+    def interrupted(self, line, pc):
+        # The instruction that raised is still listed, as the reference loop writes it before executing.
+        self.record(line, pc, False)
+        self.flush()
+
+    def finish(self):
+        self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+
+
+class FullTrace(TraceWriter):
+    # The original output.txt format: the instruction, then MEM[...] and REGS[...] after it ran.
+
+    def record(self, line, pc, has_state):
+        self.buffer.append(line)
+        if has_state:
+            self.buffer.append(str(self.mips) + "\n")
+
+
+class DeltaTrace(TraceWriter):
+    # The instruction, then DELTA[...] with the registers ($n=v) and memory words (@n=v) that changed
+    # since the previous recorded state.
+
+    def __init__(self, file, mips, every=1, batch=4096, append=False):
+        TraceWriter.__init__(self, file, mips, every, batch)
+        if append:
+            # Seeded with the current contents, so a resumed run (MIPS.resume) also records words set to 0.
+            self.registers = mips.regs[:32]
+            self.words = {address >> 2: value for address, value in mips.memory.nonzero_words()}
+            mips.memory.write_log = []
+        else:
+            # A new trace starts from the zero state delta_to_text and binary_to_text assume, so the first
+            # record also carries the registers and words set before the run.
+            self.registers = array("i", bytes(4 * 32))
+            self.words = {}
+            mips.memory.write_log = [address for address, _ in mips.memory.nonzero_words()]
+
+    def changes(self):
+        regs = self.mips.regs
+        registers = []
+        if regs[:32] != self.registers:
+            previous = self.registers
+            registers = [(i, v) for i, (v, p) in enumerate(zip(regs, previous)) if v != p]
+            previous[:] = regs[:32]
+
+        words = []
+        memory = self.mips.memory
+        if memory.write_log:
+            for address in sorted(set(memory.write_log)):
+                value = memory.load_word(address)
+                if self.words.get(address >> 2, 0) != value:
+                    self.words[address >> 2] = value
+                    words.append((address >> 2, value))
+            memory.write_log.clear()
+        return registers, words
+
+    def record(self, line, pc, has_state):
+        self.buffer.append(line)
+        if has_state:
+            registers, words = self.changes()
+            entries = [f"${i}={v}" for i, v in registers] + [f"@{a}={v}" for a, v in words]
+            self.buffer.append("DELTA[" + ";".join(entries) + "]\n")
+
+    def finish(self):
+        TraceWriter.finish(self)
+        self.mips.memory.write_log = None
+
+
+class BinaryTrace(DeltaTrace):
+    # One record per recorded instruction: program counter, flags and the same changes as DeltaTrace.
+    # The file must be opened in binary mode; binary_to_text() turns it back into the full text format.
+
+    def __init__(self, file, mips, every=1, batch=4096, append=False):
+        DeltaTrace.__init__(self, file, mips, every, batch, append)
+        # Appended traces (MIPS.resume) continue the records of the existing file.
+        if file.tell() == 0:
+            file.write(BINARY_MAGIC)
+
+    def record(self, line, pc, has_state):
+        registers, words = self.changes() if has_state else ((), ())
+        parts = [record_header.pack(pc, HAS_STATE if has_state else 0, len(registers), len(words))]
+        for index, value in registers:
+            encoded = encode_value(value)
+            parts.append(register_entry.pack(index, len(encoded)) + encoded)
+        for address, value in words:
+            encoded = encode_value(value)
+            parts.append(memory_entry.pack(address, len(encoded)) + encoded)
+        self.buffer.append(b"".join(parts))
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(b"".join(self.buffer))
+            self.buffer.clear()
+
+
+def slot_hash(key, value):
+    # Hash of one register slot or memory word (splitmix64 of key and value); 0 for a zero value, so
+    # untouched memory adds nothing.
+    if not value:
+        return 0
+    z = ((key << 32 | value & 0xFFFFFFFF) + 0x9E3779B97F4A7C15) & DIGEST_MASK
+    z = ((z ^ z >> 30) * 0xBF58476D1CE4E5B9) & DIGEST_MASK
+    z = ((z ^ z >> 27) * 0x94D049BB133111EB) & DIGEST_MASK
+    return z ^ z >> 31
+
+
+def state_digest(mips):
+    # Sum of the slot hashes of the 34 register slots and every memory word, modulo 2**64. The sum is
+    # independent of the order of the writes, so DigestTrace can keep it up to date by replacing the
+    # hash of each written slot, and two runs reaching the same state always have the same digest.
+    digest = sum(slot_hash(index, value) for index, value in enumerate(mips.regs))
+    digest += sum(slot_hash(MEMORY_KEY_BASE + (address >> 2), value) for address, value in mips.memory.nonzero_words())
+    return digest & DIGEST_MASK
+
+
+class DigestTrace(TraceWriter):
+    # Golden trace for regression checks: a checkpoint (instructions run, program_counter, state_digest)
+    # for the starting state, every N instructions and after the last. The digest is updated per step
+    # from the slots the instruction wrote (its destination registers and the memory write log), not
+    # recomputed. The file holds DIGEST_MAGIC, N and zlib-compressed records; an appended run
+    # (MIPS.resume) adds a new stream.
+
+    def __init__(self, file, mips, every=1, batch=4096):
+        TraceWriter.__init__(self, file, mips, every, batch)
+        if file.tell() == 0:
+            file.write(DIGEST_MAGIC + digest_header.pack(every))
+        self.compressor = zlib.compressobj()
+        self.digest = state_digest(mips)
+        self.registers = list(mips.regs)
+        self.words = {address >> 2: value for address, value in mips.memory.nonzero_words()}
+        self.written = {}
+        self.steps = mips.instruction_count
+        self.recorded = None
+        mips.memory.write_log = []
+        self.record(None, None, True)
+
+    def written_at(self, pc):
+        # Register slots the instruction at pc writes, found on its first step. A store that replaced
+        # the instruction that ran leaves no instruction to ask, so all slots are compared.
+        instruction = self.mips.instruction_at(pc)
+        slots = written_registers(self.mips, instruction) if instruction is not None else range(len(self.registers))
+        self.written[pc] = slots
+        return slots
+
+    def step(self, line, pc):
+        regs = self.mips.regs
+        registers = self.registers
+        slots = self.written.get(pc)
+        if slots is None:
+            slots = self.written_at(pc)
+        for index in slots:
+            value = regs[index]
+            if value != registers[index]:
+                self.digest += slot_hash(index, value) - slot_hash(index, registers[index])
+                registers[index] = value
+
+        write_log = self.mips.memory.write_log
+        if write_log:
+            load_word = self.mips.memory.load_word
+            words = self.words
+            for address in write_log:
+                value = load_word(address)
+                address >>= 2
+                old = words.get(address, 0)
+                if value != old:
+                    key = MEMORY_KEY_BASE + address
+                    self.digest += slot_hash(key, value) - slot_hash(key, old)
+                    words[address] = value
+            write_log.clear()
+
+        self.steps += 1
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.every
+        self.record(line, pc, True)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def skip(self, line, pc):
+        self.steps += 1
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.every
+        self.record(line, pc, True)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def record(self, line, pc, has_state):
+        self.digest &= DIGEST_MASK
+        self.buffer.append(checkpoint_record.pack(self.steps, self.mips.program_counter, self.digest))
+        self.recorded = self.steps
+
+    def interrupted(self, line, pc):
+        self.finish()
+
+    def finish(self):
+        # The final state is always a checkpoint.
+        if self.recorded != self.steps:
+            self.record(None, None, True)
+        self.flush()
+        self.file.write(self.compressor.flush())
+        self.mips.memory.write_log = None
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.compressor.compress(b"".join(self.buffer)))
+            self.buffer.clear()
+
+
+def read_digests(data):
+    # The checkpoint interval of a digest trace and its checkpoints, a list of (instructions,
+    # program_counter, digest).
+    if not data.startswith(DIGEST_MAGIC):
+        raise ValueError("not a digest trace")
+    every, = digest_header.unpack_from(data, len(DIGEST_MAGIC))
+    records = bytearray()
+    data = data[len(DIGEST_MAGIC) + digest_header.size:]
+    while data:
+        decompressor = zlib.decompressobj()
+        records += decompressor.decompress(data)
+        data = decompressor.unused_data
+    return every, list(checkpoint_record.iter_unpack(records))
+
+
+class NullTrace(TraceWriter):
+    # Tracing off: only the final state is written.
+
+    def step(self, line, pc):
+        pass
+
+    def skip(self, line, pc):
+        pass
+
+    def interrupted(self, line, pc):
+        pass
+
+    def finish(self):
+        self.file.write(str(self.mips) + "\n")
+
+
+def open_trace(mode, file, mips, every=1, append=False):
+    if mode == "full":
+        return FullTrace(file, mips, every)
+    if mode == "delta":
+        return DeltaTrace(file, mips, every, append=append)
+    if mode == "binary":
+        return BinaryTrace(file, mips, every, append=append)
+    if mode == "digest":
+        return DigestTrace(file, mips, every)
+    if mode == "off":
+        return NullTrace(file, mips, every)
+    raise ValueError(f"unknown trace mode: {mode}")
+
+
+def render_state(registers, words):
+    memory = ";".join([f"{address}:{words[address]}" for address in sorted(words) if words[address] != 0])
+    return "MEM[" + memory + "]\n" + "REGS[" + ";".join([f"${i}={v}" for i, v in enumerate(registers)]) + "]\n"
+
+
+def delta_to_text(lines):
+    # Rebuilds the full text trace from a delta trace.
+    registers = [0] * 32
+    words = {}
+    for line in lines:
+        if not line.startswith("DELTA["):
+            yield line
+            continue
+        for entry in filter(None, line.strip()[len("DELTA["):-1].split(";")):
+            key, value = entry.split("=")
+            if key[0] == "$":
+                registers[int(key[1:])] = int(value)
+            else:
+                words[int(key[1:])] = int(value)
+        yield render_state(registers, words)
+
+
+def binary_to_text(data, assembly_lines):
+    # Rebuilds the full text trace from a binary trace; assembly_lines is the program listing
+    # (assembly_code.txt), indexed by program counter.
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError("not a binary trace")
+
+    registers = [0] * 32
+    words = {}
+    offset = len(BINARY_MAGIC)
+    while offset < len(data):
+        pc, flags, register_count, word_count = record_header.unpack_from(data, offset)
+        offset += record_header.size
+        for _ in range(register_count):
+            index, length = register_entry.unpack_from(data, offset)
+            offset += register_entry.size
+            registers[index] = int.from_bytes(data[offset:offset + length], "big", signed=True)
+            offset += length
+        for _ in range(word_count):
+            address, length = memory_entry.unpack_from(data, offset)
+            offset += memory_entry.size
+            words[address] = int.from_bytes(data[offset:offset + length], "big", signed=True)
+            offset += length
+
+        yield assembly_lines[pc].rstrip("\n") + "\n"
+        if flags & HAS_STATE:
+            yield render_state(registers, words)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a delta or binary trace to the full text format.")
+    parser.add_argument("trace")
+    parser.add_argument("output")
+    parser.add_argument("--assembly", default="output/assembly_code.txt",
+                        help="program listing used to name the instructions of a binary trace")
+    args = parser.parse_args()
+
+    with open(args.trace, "rb") as file:
+        data = file.read()
+
+    with open(args.output, "w") as file:
+        if data.startswith(BINARY_MAGIC):
+            with open(args.assembly, "r") as listing:
+                file.writelines(binary_to_text(data, listing.read().splitlines()))
+        else:
+            file.writelines(delta_to_text(data.decode().splitlines(keepends=True)))